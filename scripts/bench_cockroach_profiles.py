@@ -0,0 +1,83 @@
+"""
+Compare boot time and memory use of a Cockroach node under each resource profile.
+
+Every node is started like managed_cockroach starts it, a small table is written to it, and
+the resident memory of its process group is sampled.
+
+    python scripts/bench_cockroach_profiles.py --runs 3
+    python scripts/bench_cockroach_profiles.py --profile small --rows 10000
+"""
+import os
+import statistics
+import subprocess
+import time
+from typing import Tuple
+
+import click
+
+from managed_service_fixtures import find_free_port
+from managed_service_fixtures.services.cockroach import (
+    COCKROACH_PROFILES,
+    CockroachManager,
+    execute_sql,
+)
+
+
+def group_rss_mib(pgid: int) -> float:
+    """Resident memory of every process in a process group, with ps for macOS too"""
+    output = subprocess.run(
+        ["ps", "-A", "-o", "pgid=,rss="], check=True, capture_output=True, text=True
+    ).stdout
+    kib = sum(
+        int(rss)
+        for group, rss in (line.split() for line in output.splitlines())
+        if int(group) == pgid
+    )
+    return kib / 1024
+
+
+def run(profile: str, rows: int) -> Tuple[float, float, float]:
+    """Boot a node, return (boot seconds, RSS after boot, RSS after writing rows) in MiB"""
+    manager = CockroachManager(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+        profile=profile,
+    )
+    start = time.monotonic()
+    with manager as details:
+        boot = time.monotonic() - start
+        # mirakuru starts the node in its own session, the shell and cockroach share a group
+        pgid = os.getpgid(manager.mirakuru_process.process.pid)
+        idle = group_rss_mib(pgid)
+        execute_sql(details, "CREATE TABLE bench (id INT PRIMARY KEY, payload STRING)")
+        execute_sql(
+            details,
+            f"INSERT INTO bench SELECT i, repeat('x', 512) FROM generate_series(1, {rows}) AS i",
+        )
+        loaded = group_rss_mib(pgid)
+    return boot, idle, loaded
+
+
+@click.command()
+@click.option(
+    "--profile",
+    "profiles",
+    multiple=True,
+    type=click.Choice(sorted(COCKROACH_PROFILES)),
+    help="Profiles to compare, all of them by default",
+)
+@click.option("--runs", default=3, help="Nodes to boot per profile")
+@click.option("--rows", default=50_000, help="Rows of 512 bytes written to each node")
+def main(profiles: Tuple[str, ...], runs: int, rows: int):
+    click.echo(
+        f"{'profile':<10} {'boot s':>8} {'idle RSS MiB':>14} {'loaded RSS MiB':>16}"
+    )
+    for profile in profiles or sorted(COCKROACH_PROFILES):
+        results = [run(profile, rows) for _ in range(runs)]
+        boot, idle, loaded = (statistics.median(r) for r in zip(*results))
+        click.echo(f"{profile:<10} {boot:>8.2f} {idle:>14.0f} {loaded:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare resetting a database between tests with SQLAlchemy drop_all/create_all against
+restoring a CockroachSnapshot.
+
+    python scripts/bench_cockroach_snapshot.py --tables 20 --iterations 10
+"""
+import statistics
+import time
+from typing import Callable, List
+
+import click
+import sqlalchemy as sa
+
+from managed_service_fixtures import CockroachSnapshot, find_free_port
+from managed_service_fixtures.services.cockroach import CockroachManager
+
+
+def build_metadata(tables: int) -> sa.MetaData:
+    metadata = sa.MetaData()
+    for i in range(tables):
+        sa.Table(
+            f"table_{i}",
+            metadata,
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String, index=True),
+            sa.Column("created", sa.DateTime),
+        )
+    return metadata
+
+
+def timed(func: Callable[[], None], iterations: int) -> List[float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.monotonic()
+        func()
+        durations.append(time.monotonic() - start)
+    return durations
+
+
+def report(label: str, durations: List[float]):
+    click.echo(
+        f"{label:<22} mean {statistics.mean(durations) * 1000:8.1f} ms   "
+        f"median {statistics.median(durations) * 1000:8.1f} ms   "
+        f"max {max(durations) * 1000:8.1f} ms"
+    )
+
+
+@click.command()
+@click.option("--tables", default=20, help="Number of tables in the schema")
+@click.option("--iterations", default=10, help="Resets to time for each strategy")
+def main(tables: int, iterations: int):
+    metadata = build_metadata(tables)
+    with CockroachManager(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+    ) as details:
+        engine = sa.create_engine(details.sync_dsn)
+        metadata.create_all(engine)
+
+        def drop_create():
+            metadata.drop_all(engine)
+            metadata.create_all(engine)
+
+        report("drop_all/create_all", timed(drop_create, iterations))
+
+        snapshot = CockroachSnapshot(details)
+        start = time.monotonic()
+        snapshot.capture()
+        click.echo(
+            f"snapshot capture       {(time.monotonic() - start) * 1000:8.1f} ms"
+        )
+
+        def restore():
+            snapshot.drop(snapshot.restore())
+
+        report("snapshot restore", timed(restore, iterations))
+        snapshot.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure how long xdist workers take to register with (join) and unregister from (leave) a
+published service, for each state registry backend, with every worker joining at once.
+
+    python scripts/bench_registry.py --workers 8 --workers 32 --workers 128
+"""
+import multiprocessing
+import pathlib
+import statistics
+import tempfile
+import time
+from typing import List, Tuple
+
+import click
+
+from managed_service_fixtures.registry import REGISTRIES
+
+
+def worker(
+    backend: str, state_file_path: pathlib.Path, worker_id: str, barrier, results
+) -> None:
+    registry = REGISTRIES[backend](state_file_path)
+    barrier.wait()
+    start = time.monotonic()
+    registry.register(worker_id)
+    joined = time.monotonic()
+    barrier.wait()
+    left_start = time.monotonic()
+    registry.unregister(worker_id)
+    results.put((joined - start, time.monotonic() - left_start))
+
+
+def run(backend: str, workers: int) -> Tuple[List[float], List[float]]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file_path = pathlib.Path(tmp_dir) / "bench.json"
+        registry = REGISTRIES[backend](state_file_path)
+        with registry.lock:
+            registry.publish({"hostname": "localhost", "port": 1234, "sessions": []})
+
+        barrier = multiprocessing.Barrier(workers)
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=worker,
+                args=(backend, state_file_path, f"gw{i}", barrier, results),
+            )
+            for i in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        timings = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        assert registry.retire(), "workers left references behind"
+    return [join for join, _ in timings], [leave for _, leave in timings]
+
+
+def describe(durations: List[float]) -> str:
+    ms = sorted(d * 1000 for d in durations)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"median {statistics.median(ms):8.2f} ms  p95 {p95:8.2f} ms  max {ms[-1]:8.2f} ms"
+
+
+@click.command()
+@click.option(
+    "--workers",
+    "worker_counts",
+    multiple=True,
+    type=int,
+    default=[8, 32, 128],
+    help="Number of concurrent workers, may be repeated",
+)
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(sorted(REGISTRIES)),
+    default=sorted(REGISTRIES),
+    help="Registry backend to measure, may be repeated",
+)
+def main(worker_counts: List[int], backends: List[str]):
+    for workers in worker_counts:
+        for backend in backends:
+            joins, leaves = run(backend, workers)
+            click.echo(f"{backend:<7} {workers:>4} workers  join  {describe(joins)}")
+            click.echo(f"{backend:<7} {workers:>4} workers  leave {describe(leaves)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,13 @@ import time
 
 import click
 
-from managed_service_fixtures import LoggingTCPExecutor, find_free_port
+from managed_service_fixtures import LoggingTCPExecutor, ServiceGroup, find_free_port
 
 logger = logging.getLogger(__name__)
 
 
 class MotoManager(LoggingTCPExecutor):
-    cmd_template = "moto_server --host {host} --port {port} s3"
+    cmd_template = "moto_server --host {host} --port {port}"
     env_name = "TEST_MOTO_DETAILS"
 
 
@@ -50,11 +50,15 @@ class VaultManager(LoggingTCPExecutor):
 
 
 @click.command()
-def main():
-    moto = MotoManager()
-    redis = RedisManager()
-    cockroach = CockroachManager()
-    vault = VaultManager()
+@click.option(
+    "--verbose", is_flag=True, help="Log the output of every service, color coded"
+)
+def main(verbose: bool):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    moto = MotoManager(verbose=verbose)
+    redis = RedisManager(verbose=verbose)
+    cockroach = CockroachManager(verbose=verbose)
+    vault = VaultManager(verbose=verbose)
     contexts = [moto, redis, cockroach, vault]
     with contextlib.ExitStack() as stack:
 
@@ -75,8 +79,8 @@ def main():
         logger.info(
             f"To introspect test database, run 'cockroach sql --host={crdb_details['host']}:{crdb_details['sql_port']} --insecure' "
         )
-        for context in contexts:
-            stack.enter_context(context)
+        # Boot all services concurrently, total startup is the slowest service
+        stack.enter_context(ServiceGroup(*contexts))
 
         while True:
             time.sleep(1)
@@ -1,10 +1,49 @@
 from importlib_metadata import version
 
+from .lazy import LazyService
+from .logpump import PumpedTCPExecutor
+from .plugin import (
+    _managed_service_prewarm,
+    pytest_addoption,
+    pytest_collection_finish,
+    pytest_collection_modifyitems,
+    pytest_configure,
+    pytest_runtest_makereport,
+    pytest_runtest_setup,
+    pytest_sessionfinish,
+    pytest_sessionstart,
+    pytest_terminal_summary,
+    pytest_testnodedown,
+)
+from .pool import ServicePool
 from .run_service_executor import LoggingTCPExecutor, find_free_port
+from .service_group import ServiceGroup, managed_service_group
 from .services.asgi_app import AppDetails, AppManager, managed_asgi_app_factory
-from .services.cockroach import CockroachDetails, managed_cockroach
-from .services.moto import MotoDetails, managed_moto
-from .services.redis import RedisDetails, managed_redis
-from .services.vault import VaultDetails, managed_vault
+from .services.cockroach import (
+    CockroachDetails,
+    CockroachMigrations,
+    CockroachProfile,
+    CockroachSnapshot,
+    managed_cockroach,
+    managed_cockroach_fresh,
+    managed_cockroach_migrations,
+    managed_cockroach_snapshot,
+)
+from .services.moto import MotoDetails, S3Seeder, managed_moto, managed_moto_seed
+from .services.redis import (
+    RedisDetails,
+    managed_redis,
+    managed_redis_flushed,
+    managed_redis_fresh,
+    managed_redis_pool,
+)
+from .services.vault import (
+    VaultDetails,
+    VaultSeeder,
+    managed_vault,
+    managed_vault_fresh,
+    managed_vault_pool,
+    managed_vault_seed,
+)
 
 __version__ = version(__package__)
@@ -0,0 +1,61 @@
+"""
+Keep tests that use the same managed services on a limited number of xdist workers.
+
+With -n auto every worker that runs a test depending on managed_cockroach registers with
+the shared node and creates its own database, and every worker running tests against an
+app from managed_asgi_app_factory starts its own app. --service-workers=N limits each of
+those services to at most N workers. Services that tests use together (e.g. tests using
+{crdb}, {crdb, redis} and {crdb, moto}) are joined into one family, and the tests of each
+family are spread over at most N xdist_group marks, so xdist's loadgroup scheduler runs
+them on at most N workers. Lower N trades wall-clock time for fewer per-worker copies
+(memory, setup).
+
+Test modules are kept together in the same group so module-scoped fixtures aren't set up on
+several workers. Tests that already have an xdist_group mark, and tests that use no managed
+service, are left alone.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+import pytest
+
+from managed_service_fixtures import demand
+
+
+def service_families(
+    combinations: Iterable[Tuple[str, ...]]
+) -> Dict[str, Tuple[str, ...]]:
+    """Map each service to every service it's used with, directly or through others"""
+    families: Dict[str, Tuple[str, ...]] = {}
+    for services in combinations:
+        family = set(services)
+        for service in services:
+            family.update(families.get(service, ()))
+        merged = tuple(sorted(family))
+        for service in merged:
+            families[service] = merged
+    return families
+
+
+def assign_affinity_groups(items: List[pytest.Item], workers: int) -> Dict[str, int]:
+    """Mark `items` with xdist_group, return how many tests went into each group"""
+    # Every xdist worker must assign the same groups, so only depend on collection order
+    needed: List[Tuple[pytest.Item, Tuple[str, ...]]] = []
+    for item in items:
+        if item.get_closest_marker("xdist_group"):
+            continue
+        services = tuple(sorted(demand.services_needed(item.fixturenames)))
+        if services:
+            needed.append((item, services))
+    families = service_families(services for _, services in needed)
+
+    module_buckets: Dict[Tuple[str, ...], Dict[str, int]] = {}
+    sizes: Dict[str, int] = {}
+    for item, services in needed:
+        family = families[services[0]]
+        buckets = module_buckets.setdefault(family, {})
+        module = item.nodeid.split("::")[0]
+        bucket = buckets.setdefault(module, len(buckets) % workers)
+        group = f"managed-{'+'.join(family)}-{bucket}"
+        item.add_marker(pytest.mark.xdist_group(group))
+        sizes[group] = sizes.get(group, 0) + 1
+    return sizes
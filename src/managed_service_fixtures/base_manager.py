@@ -1,19 +1,52 @@
 import abc
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
 import json
 import logging
 import os
 import pathlib
-import time
+import tempfile
 from dataclasses import dataclass, field
 from types import TracebackType
-from typing import Callable, List, Optional, Tuple, Type
+from typing import Callable, Iterator, List, Optional, Tuple, Type
 
 import mirakuru
 import pytest
-from filelock import FileLock
+
+from managed_service_fixtures import timings
+from managed_service_fixtures.ports import is_port_conflict, reserving
+from managed_service_fixtures.readiness import wait_until_ready
+from managed_service_fixtures.registry import (
+    OwnerRecord,
+    is_stale,
+    kill_process_groups,
+    owner_entry,
+    process_groups,
+    registry_class,
+)
+from managed_service_fixtures.rendezvous import TeardownRendezvous
+from managed_service_fixtures.warm import WarmServiceLease, keep_warm_enabled
 
 logger = logging.getLogger(__name__)
 
+# Runs the blocking __enter__ / __exit__ of managers and groups used with `async with`
+_lifecycle_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def lifecycle_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Threads for async service lifecycles, kept apart from the event loop's default executor
+    so that services booting for minutes can't starve run_in_executor(None, ...) callers
+    """
+    global _lifecycle_executor
+    if _lifecycle_executor is None:
+        _lifecycle_executor = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix="managed-service-lifecycle"
+        )
+    return _lifecycle_executor
+
 
 @dataclass
 class ServiceDetails:
@@ -58,9 +91,18 @@ class ExternalServiceLifecycleManager(abc.ABC):
     determine if any other workers still need it up. The manager will not tear down the service until
     all non-manager workers have removed their `worker_id` from the state file.
 
-    Finally, you may set an environment variable pointing to a file containing connection details
+    You may set an environment variable pointing to a file containing connection details
     for a service started outside of this fixture, such as a remote test cluster. In that case,
     no process will be started or stopped by mirakuru.
+
+    Managers also work with `async with`. Every blocking step (lock waits, process spawn,
+    readiness polling, waiting for other workers at teardown) then runs on a worker thread,
+    so the event loop keeps running and several services can be started concurrently with
+    asyncio.gather.
+
+    Finally, with MANAGED_SERVICE_FIXTURES_KEEP_WARM=1 the process is started by a detached
+    broker (see managed_service_fixtures.warm) that keeps it running after the tests finish,
+    so the next pytest invocation attaches to it instead of starting a new one.
     """
 
     # env_file_pointer would be something like TEST_REDIS_DETAILS
@@ -71,11 +113,17 @@ class ExternalServiceLifecycleManager(abc.ABC):
     env_file_pointer: str = None
     json_state_file_name: str = None
     service_details_class: Type[ServiceDetails] = ServiceDetails
+    # Set to False in subclasses whose service can't safely outlive the test run
+    supports_keep_warm: bool = True
+    # Seconds to wait for _check_ready to pass after _start_service returns
+    readiness_timeout: float = 60.0
+    # Times to try _start_service, on new ports, when another process took its ports
+    start_attempts: int = 5
 
     def __init__(
         self,
         worker_id: str,
-        tmp_path_factory: pytest.TempPathFactory,
+        tmp_path_factory: Optional[pytest.TempPathFactory],
         unused_tcp_port_factory: Callable[[], int],
         # Optional overrides to cls attributes for factory fixture pattern
         env_file_pointer: Optional[str] = None,
@@ -87,7 +135,9 @@ class ExternalServiceLifecycleManager(abc.ABC):
 
         worker_id: pytest-xdist fixture to give a worker id when run in parallel
         tmp_path_factory: core pytest fixture, returns temporary directories.
+            May be None when used outside of pytest (scripts, benchmarks) with worker_id="master".
         unused_tcp_port_factory: pytest-asyncio fixture, returns unused TCP ports.
+            Ports it returns are reserved across processes, see ports.py.
 
         Example usage:
 
@@ -109,6 +159,11 @@ class ExternalServiceLifecycleManager(abc.ABC):
         self.service_details_class = service_details_class or self.service_details_class
 
         self.mirakuru_process = None  # set in __enter__, used in __exit__
+        self.warm_lease: Optional[WarmServiceLease] = None
+        # ^^ set in __enter__ instead of mirakuru_process when keeping services warm
+        self.rendezvous: Optional[TeardownRendezvous] = None
+        self.owner_record: Optional[OwnerRecord] = None
+        # ^^ set in __enter__ if this instance started the service's processes
         self.manage_process_lifecycle = False
         # ^^ may get set to True during __enter__ when running in parallel
         self.configed_from_env = False
@@ -116,15 +171,28 @@ class ExternalServiceLifecycleManager(abc.ABC):
         # connection details are read from a file pointed at by environ variables
 
         self.worker_id = worker_id
-        self.unused_tcp_port_factory = unused_tcp_port_factory
+        self.unused_tcp_port_factory = reserving(unused_tcp_port_factory)
 
         # Need to position our state file in a dir common to all of the xdist
         # workers, but still scoped to be within this test run. Will end
         # up being something like $TMPDIR/pytest-of-<username>/pytest-N/
-        root_tmp_dir = tmp_path_factory.getbasetemp().parent
+        if tmp_path_factory is not None:
+            root_tmp_dir = tmp_path_factory.getbasetemp().parent
+        else:
+            root_tmp_dir = pathlib.Path(tempfile.gettempdir())
 
         self.state_file_path = root_tmp_dir / self.json_state_file_name
-        self.lock_file_path = pathlib.Path(str(self.state_file_path) + ".lock")
+        # Where the manager publishes connection details and other workers register,
+        # the JSON state file unless MANAGED_SERVICE_FIXTURES_REGISTRY says otherwise
+        self.registry = registry_class()(self.state_file_path)
+        self.lock_file_path = self.registry.lock_file_path
+
+        # Names the service in timings and in the log pump's output
+        self.service_name = pathlib.Path(self.json_state_file_name).stem
+        # Recorded in __exit__ for the plugin's end of session summary
+        self.timings = timings.LifecycleTimings(
+            service=self.service_name, worker_id=worker_id
+        )
 
     @abc.abstractmethod
     def _start_service(
@@ -137,10 +205,91 @@ class ExternalServiceLifecycleManager(abc.ABC):
         and this code path won't be entered if there is a pointer to a connection
         details filepath at env variable self.env_file_pointer.
 
+        Take ports from self.unused_tcp_port_factory in here rather than in __init__: when
+        another process binds them first, this is called again for new ones.
+
         Must return a tuple of ServiceDetails-subclassed pydantic model and mirakuru process.
         """
         raise NotImplementedError()
 
+    def _check_ready(self, service_details: ServiceDetails) -> bool:
+        """
+        Override with a protocol-level check (a query, a health endpoint, a PING) that only
+        passes once the service can actually serve requests. mirakuru's TCP check, which only
+        means the port accepts connections, has already passed when this is called.
+        """
+        return True
+
+    def _recycle(
+        self, service_details: ServiceDetails, process: mirakuru.Executor
+    ) -> bool:
+        """
+        Reset a running instance to a pristine state for re-use by ServicePool. Return False
+        (the default) if the service has no cheap reset, the pool then restarts the process.
+        """
+        return False
+
+    def _start_service_retrying(self) -> Tuple[ServiceDetails, mirakuru.Executor]:
+        """_start_service, again on new ports if something else bound its ports first"""
+        for attempt in range(1, self.start_attempts + 1):
+            try:
+                return self._start_service()
+            except Exception as e:
+                if attempt == self.start_attempts or not is_port_conflict(e):
+                    raise
+                logger.warning(
+                    f"{type(self).__name__} lost its port to another process ({e}), "
+                    f"retrying on new ports ({attempt}/{self.start_attempts})"
+                )
+
+    def _start_ready_service(self) -> Tuple[ServiceDetails, mirakuru.Executor]:
+        """_start_service, then block until _check_ready passes (with exponential backoff)"""
+        with self.timings.phase("start"):
+            service_details, process = self._start_service_retrying()
+        try:
+            with self.timings.phase("ready"):
+                wait_until_ready(
+                    lambda: self._check_ready(service_details),
+                    timeout=self.readiness_timeout,
+                    description=type(self).__name__,
+                )
+        except BaseException:
+            # Not only timeouts, e.g. Ctrl-C while waiting, which isn't an Exception
+            process.stop()
+            raise
+        return service_details, process
+
+    def _warm_kwargs(self) -> dict:
+        """
+        Extra __init__ kwargs a keep-warm broker needs to construct an equivalent manager.
+        Kept-warm instances are only re-used by managers with the same class and kwargs.
+        """
+        return {}
+
+    def _acquire_service(self) -> Tuple[ServiceDetails, Optional[mirakuru.Executor]]:
+        if self.supports_keep_warm and keep_warm_enabled():
+            self.warm_lease = WarmServiceLease(self)
+            with self.timings.phase("start"):
+                return self.warm_lease.acquire(), None
+        return self._start_ready_service()
+
+    def _release_service(self) -> None:
+        with self.timings.phase("stop"):
+            if self.warm_lease:
+                self.warm_lease.release()
+            else:
+                self.mirakuru_process.stop()
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the registry's file lock, timing how long it took to get it"""
+        with self.timings.phase("lock"):
+            self.registry.lock.acquire()
+        try:
+            yield
+        finally:
+            self.registry.lock.release()
+
     def _service_from_env(self):
         if self.env_file_pointer and os.environ.get(self.env_file_pointer):
             settings_file_path = pathlib.Path(os.environ[self.env_file_pointer])
@@ -154,6 +303,36 @@ class ExternalServiceLifecycleManager(abc.ABC):
                     f"Env variable {self.env_file_pointer} set but no file exists at {settings_file_path}. Starting new service."
                 )
 
+    def _own(self) -> Optional[dict]:
+        """
+        Record this process as the owner of the processes it just started, in the registry's
+        owner_dir() where later runs reap them if this one is killed. Returns the owner entry.
+        """
+        pgids = process_groups(self.mirakuru_process)
+        if not pgids:
+            # Nothing started here (kept warm), or already gone
+            return None
+        self.owner_record = OwnerRecord(self.service_name, owner_entry(pgids))
+        self.owner_record.write()
+        return self.owner_record.owner
+
+    def _disown(self) -> None:
+        """Drop the owner record, once the processes are stopped"""
+        if self.owner_record:
+            self.owner_record.remove()
+
+    def _reap(self, state: dict) -> None:
+        """Kill what a dead manager left running and unpublish its service. Holds the lock."""
+        owner = state["owner"]
+        logger.warning(
+            f"Manager of {self.service_name} (pid {owner['pid']}) is gone, killing "
+            f"process groups {owner['pgids']}"
+        )
+        kill_process_groups(owner["pgids"])
+        self.registry.evict()
+        if owner["pgids"]:
+            OwnerRecord(self.service_name, owner).remove()
+
     def __enter__(self) -> ServiceDetails:
         # Check environment variables / class config to see if the service
         # is being started outside of this class (e.g. a remote test cluster)
@@ -165,42 +344,62 @@ class ExternalServiceLifecycleManager(abc.ABC):
         if self.worker_id == "master":
             service_details = self._service_from_env()
             if not service_details:
-                service_details, self.mirakuru_process = self._start_service()
+                service_details, self.mirakuru_process = self._acquire_service()
+                self._own()
 
         # Otherwise tests are in parallel and the logic is more complicated
         else:
-            with FileLock(self.lock_file_path):
-                if not self.state_file_path.is_file():
-                    # Lock file doesn't exist, which means this instance is the
-                    # first to try and access it, so it becomes the manager among
-                    # parallel pytest workers.
-                    self.manage_process_lifecycle = True
-                    service_details = self._service_from_env()
-                    if not service_details:
-                        service_details, self.mirakuru_process = self._start_service()
-
-                    state_file_dict = service_details.dict()
-                    state_file_dict["sessions"] = []
-                else:
-                    # If the lock file does exist, this worker needs to record
-                    # that it is using the service and the manager should not shut
-                    # it down until this instance has exited the context block
-                    self.manage_process_lifecycle = False
-                    state_file_dict = json.loads(self.state_file_path.read_text())
-                    service_details = self.service_details_class(
-                        is_manager=False, **state_file_dict
-                    )
-
-                    # This is why ServiceDetails subclasses should not
-                    # override or re-use the `sessions` field.
-                    service_details.sessions.append(self.worker_id)
-
-                # Manager or not, serialize created or mutated state_file_dict
-                # to state_file_path while still holding the lockfile lock.
-                self.state_file_path.write_text(
-                    service_details.json(exclude={"is_manager"})
-                )
+            # If the service is already published, this worker records that it is
+            # using the service and the manager will not shut it down until this
+            # instance has exited the context block. That's atomic in the registry,
+            # without electing a manager.
+            with self.timings.phase("lock"):
+                state = self.registry.register(self.worker_id)
+            if state is None or is_stale(state):
+                with self._locked():
+                    # Somebody may have published, or taken over from a manager that
+                    # died, while we waited for the lock
+                    state = self.registry.register(self.worker_id)
+                    if state is not None and is_stale(state):
+                        self._reap(state)
+                        state = None
+                    if state is None:
+                        # Nothing published, which means this instance is the first
+                        # to try and access it, so it becomes the manager among
+                        # parallel pytest workers.
+                        self.manage_process_lifecycle = True
+                        owner = None
+                        service_details = self._service_from_env()
+                        if not service_details:
+                            (
+                                service_details,
+                                self.mirakuru_process,
+                            ) = self._acquire_service()
+                            # Listen before publishing so that every worker able to
+                            # register is also able to notify us when it unregisters.
+                            self.rendezvous = TeardownRendezvous(self.state_file_path)
+                            self.rendezvous.listen()
+                            # Lets the next worker, or run, clean up after us if we die
+                            owner = self._own()
+
+                        # Only the *other* xdist sessions record their presence in here
+                        service_details.sessions = []
+                        state = dataclasses.asdict(service_details)
+                        state.pop("is_manager")
+                        if owner:
+                            state["owner"] = owner
+                        self.registry.publish(state)
+
+            if not self.manage_process_lifecycle:
+                # This is why ServiceDetails subclasses should not
+                # override or re-use the `sessions` field.
+                state.pop("owner", None)
+                service_details = self.service_details_class(is_manager=False, **state)
 
+        if self.configed_from_env:
+            self.timings.role = "external"
+        elif self.worker_id != "master":
+            self.timings.role = "manager" if self.manage_process_lifecycle else "worker"
         return service_details
 
     def __exit__(
@@ -211,51 +410,81 @@ class ExternalServiceLifecycleManager(abc.ABC):
     ) -> None:
         # If the service is being managed externally, we have nothing to do here
         if self.configed_from_env:
+            timings.record(self.timings)
             return
 
         # If tests were run serially, the shutdown logic is simple
         elif self.worker_id == "master":
-            self.mirakuru_process.stop()
+            self._release_service()
+            self._disown()
 
         # Lastly the complicated part, shutting down the service in parallel test exec
-        # If this instance is the manager, it polls the state file until there's no
-        # registered workers left, then shuts down the service.
+        # If this instance is the manager, it waits until there's no registered workers
+        # left in the state file, then shuts down the service. Workers notify the manager
+        # over self.rendezvous when they unregister, so it re-checks the state file only
+        # when something changed instead of polling it.
         # Otherwise this worker needs to remove itself from the state file.
         else:
             if self.manage_process_lifecycle:
-                any_other_users = True  # We assume at first, anyway.
-
                 while True:
-                    with FileLock(self.lock_file_path):
-                        state_file_dict = json.loads(self.state_file_path.read_text())
-                        # Only the *other* xdist sessions record their presence in here. Not us.
-                        # (can then use an empty-or-not test on this list).
-                        any_other_users = bool(len(state_file_dict["sessions"]))
-
-                        if not any_other_users:
+                    with self._locked():
+                        # Only the *other* xdist sessions register in here. Not us.
+                        if self.registry.retire():
                             # Finally, nobody else using it!
-                            self.mirakuru_process.stop()
+                            self._release_service()
+                            self.rendezvous.close()
 
                             # Clean up our files.
-                            self.state_file_path.unlink()
                             # Implicitly also releases the FileLock!
                             self.lock_file_path.unlink()
 
-                            break  # Blessed freedom. Skips sleep.
+                            break  # Blessed freedom. Skips waiting.
 
                     # Lock released, but still looping. There are other sessions still.
-                    # Try again in a bit!
-                    time.sleep(0.25)
+                    # Block until one of them tells us it left.
+                    with self.timings.phase("wait_workers"):
+                        self.rendezvous.wait()
+
+                self._disown()
 
             else:
-                with FileLock(self.lock_file_path):
-                    # All we need to do is remove ourselves from the current sessions. The manager
-                    # session is responsible for hanging around until all workers are unregistered
-                    # and then shutting down the service.
-                    state_file_dict = json.loads(self.state_file_path.read_text())
+                # All we need to do is remove ourselves from the current sessions. The manager
+                # session is responsible for hanging around until all workers are unregistered
+                # and then shutting down the service.
+                with self.timings.phase("lock"):
+                    self.registry.unregister(self.worker_id)
+                    state = self.registry.state()
+
+                if state is not None and is_stale(state):
+                    # The manager died while we used its service. Nobody is going to stop
+                    # it, so the last worker out does.
+                    with self._locked():
+                        state = self.registry.state() or {}
+                        if is_stale(state) and not state["sessions"]:
+                            self._reap(state)
+                else:
+                    # Wake the manager up now that we're unregistered
+                    TeardownRendezvous.notify(self.state_file_path)
+
+        timings.record(self.timings)
 
-                    concurrent_sessions = state_file_dict["sessions"]
-                    assert self.worker_id in concurrent_sessions
-                    concurrent_sessions.remove(self.worker_id)
+    async def __aenter__(self) -> ServiceDetails:
+        """
+        __enter__ on a lifecycle_executor() thread. Starting the service, polling for
+        readiness and waiting on the registry lock still block, that thread rather than the
+        event loop, for as long as they take.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(lifecycle_executor(), self.__enter__)
 
-                    self.state_file_path.write_text(json.dumps(state_file_dict))
+    async def __aexit__(
+        self,
+        exc_type: Type[BaseException],
+        exc_val: BaseException,
+        exc_tb: TracebackType,
+    ) -> None:
+        """__exit__ on a lifecycle_executor() thread, see __aenter__"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            lifecycle_executor(), self.__exit__, exc_type, exc_val, exc_tb
+        )
@@ -0,0 +1,215 @@
+"""
+Which services the selected tests need, worked out from their fixture closures.
+
+Session fixtures only start their service when a test requests them, so services no
+selected test needs never start. With --prewarm-services the plugin goes further: once
+collection (and deselection) is done, it works out every service fixture in some selected
+test's fixture closure (prewarm_candidates), and an autouse session fixture enters them all
+on background threads when the first test is set up. Services then boot side by side
+instead of one after another as tests first ask for them. The fixture takes over the
+prewarmed service through fixture_service().
+
+Prewarmed services are started with their fixture's defaults. A service whose configuring
+fixture (a seed, migrations) is overridden for some selected test is left to its fixture,
+which couldn't use a service started without that configuration.
+
+Under xdist every worker collects every test, so every worker prewarms the services needed
+by any selected test. Which tests a worker then actually runs, and so which services it
+needed, is recorded as tests run and summarized at the end of the session.
+
+Fixtures are registered with register_service_fixture(). Those registered without a manager
+class (pools, factories) are only counted in the summary, never prewarmed.
+
+The plugin also asks uses_service_output() which services' output to attach to a failing
+test's report, so that it only gets the output of the services that test used.
+"""
+import concurrent.futures
+import logging
+import pathlib
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Type,
+)
+
+import pytest
+
+from managed_service_fixtures.lazy import maybe_lazy
+
+if TYPE_CHECKING:
+    from managed_service_fixtures.base_manager import (
+        ExternalServiceLifecycleManager,
+        ServiceDetails,
+    )
+
+logger = logging.getLogger(__name__)
+
+# fixture name -> manager class to prewarm it with, or None if it can't be prewarmed
+SERVICE_FIXTURES: Dict[
+    str, Optional[Callable[..., "ExternalServiceLifecycleManager"]]
+] = {}
+
+# fixture name -> fixture that configures its service, see prewarm_candidates
+CONFIGURING_FIXTURES: Dict[str, str] = {}
+
+# fixture name -> name its services' output is pumped under (see logpump), None if the
+# fixture starts services of any name (factories)
+SERVICE_OUTPUT_NAMES: Dict[str, Optional[str]] = {}
+
+# Tests run in this process that used each service fixture
+demand: Dict[str, int] = {}
+
+_prewarmed: Dict[str, "PrewarmedService"] = {}
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def register_service_fixture(
+    fixture_name: str,
+    manager_class: Optional[Callable[..., "ExternalServiceLifecycleManager"]] = None,
+    output_name: Optional[str] = None,
+    configured_by: Optional[str] = None,
+) -> None:
+    """
+    `output_name` is the service_name of the fixture's managers, by default worked out from
+    the json_state_file_name of `manager_class`. `configured_by` names the fixture that
+    configures the service (e.g. managed_moto_seed), if any.
+    """
+    SERVICE_FIXTURES[fixture_name] = manager_class
+    if configured_by:
+        CONFIGURING_FIXTURES[fixture_name] = configured_by
+    if output_name is None and manager_class is not None:
+        output_name = pathlib.Path(manager_class.json_state_file_name).stem
+    SERVICE_OUTPUT_NAMES[fixture_name] = output_name
+
+
+def services_needed(fixturenames: Iterable[str]) -> List[str]:
+    return [name for name in fixturenames if name in SERVICE_FIXTURES]
+
+
+def uses_service_output(fixturenames: Iterable[str], output_name: str) -> bool:
+    """
+    True if the service whose output is pumped under `output_name` may belong to one of
+    `fixturenames`. Also matches the names of variants and replicas, "cockroachdb" covers
+    "cockroachdb-migrated" and "app" covers "app-0".
+    """
+    for name in services_needed(fixturenames):
+        service = SERVICE_OUTPUT_NAMES[name]
+        if service is None:
+            return True
+        if output_name == service or output_name.startswith(f"{service}-"):
+            return True
+    return False
+
+
+def overridden(item: pytest.Item, fixture_name: str) -> bool:
+    """True if `fixture_name` resolves to a fixture from outside this package for `item`"""
+    # pytest has no public API for the definitions a test's fixture names resolve to
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    fixturedefs = (
+        fixtureinfo.name2fixturedefs.get(fixture_name) if fixtureinfo else None
+    )
+    if not fixturedefs:
+        return False
+    return not fixturedefs[-1].func.__module__.startswith(f"{__package__}.")
+
+
+def prewarm_candidates(items: Iterable[pytest.Item]) -> List[str]:
+    """Service fixtures `items` need that can be prewarmed with their default configuration"""
+    needed: Dict[str, None] = {}
+    configured = set()
+    for item in items:
+        for name in services_needed(item.fixturenames):
+            needed[name] = None
+            if name in CONFIGURING_FIXTURES and overridden(
+                item, CONFIGURING_FIXTURES[name]
+            ):
+                configured.add(name)
+    return [name for name in needed if name not in configured]
+
+
+def record_demand(fixturenames: Iterable[str]) -> None:
+    for name in services_needed(fixturenames):
+        demand[name] = demand.get(name, 0) + 1
+
+
+class PrewarmedService:
+    """Enters `manager` on a background thread, hands its details to the fixture later"""
+
+    def __init__(self, manager: "ExternalServiceLifecycleManager"):
+        global _executor
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix="managed-service-prewarm"
+            )
+        self.manager = manager
+        self.future = _executor.submit(manager.__enter__)
+
+    def __enter__(self) -> "ServiceDetails":
+        return self.future.result()
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException],
+        exc_val: BaseException,
+        exc_tb: TracebackType,
+    ) -> None:
+        self.manager.__exit__(exc_type, exc_val, exc_tb)
+
+
+def prewarm(
+    fixture_names: Iterable[str],
+    worker_id: str,
+    tmp_path_factory,
+    unused_tcp_port_factory: Callable[[], int],
+) -> List[str]:
+    """Start the services of `fixture_names` that can be prewarmed, return their names"""
+    started = []
+    for name in fixture_names:
+        manager_class = SERVICE_FIXTURES.get(name)
+        if manager_class is None or name in _prewarmed:
+            continue
+        _prewarmed[name] = PrewarmedService(
+            manager_class(
+                worker_id=worker_id,
+                tmp_path_factory=tmp_path_factory,
+                unused_tcp_port_factory=unused_tcp_port_factory,
+            )
+        )
+        started.append(name)
+    return started
+
+
+def fixture_service(
+    fixture_name: str, manager: "ExternalServiceLifecycleManager"
+) -> ContextManager["ServiceDetails"]:
+    """
+    What a service fixture should enter: the service prewarmed for it if there is one,
+    otherwise `manager` (wrapped in a LazyService if lazy startup is enabled).
+    """
+    prewarmed = _prewarmed.pop(fixture_name, None)
+    if prewarmed is not None:
+        return prewarmed
+    return maybe_lazy(manager)
+
+
+def stop_unclaimed() -> List[str]:
+    """
+    Stop prewarmed services no fixture took over (no test run here needed them, or the
+    session was cut short with -x), return their names.
+    """
+    names = list(_prewarmed)
+    for name in names:
+        prewarmed = _prewarmed.pop(name)
+        try:
+            prewarmed.future.result()
+        except Exception as e:
+            logger.warning(f"Prewarming {name} failed: {e}")
+            continue
+        prewarmed.__exit__(None, None, None)
+    return names
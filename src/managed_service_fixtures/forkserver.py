@@ -0,0 +1,148 @@
+"""
+Fork server for ASGI apps that have to run out of process.
+
+Starting an app with `uvicorn` in a subprocess pays for interpreter startup and a full import
+of the app and its dependencies every time. A fork server is a Python process that imports
+the app once and then forks a child per requested instance, each child serving the already
+imported app with uvicorn.Server on its own port. Children start in tens of milliseconds and
+share the parent's memory copy-on-write.
+
+The test process talks to the server over its stdin / stdout, one line per request:
+
+    -> "<host> <port>\\n"      fork a child serving the app on host:port
+    <- "<pid>\\n"              or "error <message>\\n"
+
+The server and its children log to stderr, which is read by the log pump. When the test
+process goes away the server sees EOF on stdin, stops its children and exits. The server
+itself lives in forkserver_daemon.py:
+
+    python -m managed_service_fixtures.forkserver_daemon myapp.main:app
+"""
+import atexit
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from managed_service_fixtures.logpump import get_log_pump
+from managed_service_fixtures.ports import PortTaken, port_in_use
+from managed_service_fixtures.warm import pid_alive
+
+
+class ForkServer:
+    def __init__(self, app_location: str, name: str = "forkserver"):
+        self.app_location = app_location
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "managed_service_fixtures.forkserver_daemon",
+                app_location,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        get_log_pump().attach(name, self.process.stderr)
+        self.lock = threading.Lock()
+
+    def fork(self, host: str, port: int) -> int:
+        with self.lock:
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"Fork server for {self.app_location} exited with {self.process.returncode}"
+                )
+            self.process.stdin.write(f"{host} {port}\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline().strip()
+        if not reply.isdigit():
+            raise RuntimeError(
+                f"Fork server for {self.app_location} could not fork: {reply or 'exited'}"
+            )
+        return int(reply)
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+_servers: Dict[str, ForkServer] = {}
+_servers_lock = threading.Lock()
+
+
+def get_fork_server(app_location: str) -> ForkServer:
+    """The fork server for app_location, started on first use and stopped at exit"""
+    with _servers_lock:
+        server = _servers.get(app_location)
+        if server is None or server.process.poll() is not None:
+            server = _servers[app_location] = ForkServer(app_location)
+        return server
+
+
+@atexit.register
+def _close_servers() -> None:
+    for server in _servers.values():
+        server.close()
+
+
+class ForkedApp:
+    """
+    An app instance forked from a ForkServer, with the start / running / stop methods of a
+    mirakuru executor.
+    """
+
+    def __init__(self, app_location: str, host: str, port: int, timeout: float = 60.0):
+        self.app_location = app_location
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pid: Optional[int] = None
+
+    def start(self) -> "ForkedApp":
+        # Otherwise whatever took the port would pass for the app below
+        if port_in_use(self.host, self.port):
+            raise PortTaken(f"{self.host}:{self.port} already in use")
+        self.pid = get_fork_server(self.app_location).fork(self.host, self.port)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return self
+            except OSError:
+                pass
+            if not self.running():
+                if port_in_use(self.host, self.port):
+                    raise PortTaken(f"{self.host}:{self.port} already in use")
+                raise RuntimeError(
+                    f"{self.app_location} exited before serving on {self.host}:{self.port}"
+                )
+            if time.monotonic() > deadline:
+                self.stop()
+                raise TimeoutError(
+                    f"{self.app_location} not serving on {self.host}:{self.port} after {self.timeout}s"
+                )
+            time.sleep(0.005)
+
+    def running(self) -> bool:
+        return self.pid is not None and pid_alive(self.pid)
+
+    def stop(self) -> None:
+        if not self.running():
+            return
+        os.kill(self.pid, signal.SIGTERM)
+        deadline = time.monotonic() + 10
+        while self.running():
+            if time.monotonic() > deadline:
+                os.kill(self.pid, signal.SIGKILL)
+                break
+            time.sleep(0.01)
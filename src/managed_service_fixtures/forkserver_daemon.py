@@ -0,0 +1,68 @@
+"""
+The fork server process, see managed_service_fixtures.forkserver for the client side.
+
+    python -m managed_service_fixtures.forkserver_daemon myapp.main:app
+"""
+import gc
+import logging
+import os
+import signal
+import sys
+
+
+def _reap_children(signum, frame) -> None:
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def _serve_child(app, host: str, port: int) -> None:
+    """Runs in a forked child, never returns"""
+    import uvicorn
+
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # stdout is the server's reply channel, keep the child's output off it
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run()
+    finally:
+        os._exit(0)
+
+
+def serve(app_location: str) -> None:
+    from uvicorn.importer import import_from_string
+
+    app = import_from_string(app_location)
+    # Keep objects imported so far out of the garbage collector's reach, so that
+    # collections in the children don't touch (and copy) the pages they live on
+    gc.freeze()
+    signal.signal(signal.SIGCHLD, _reap_children)
+    children = []
+    reply = sys.stdout
+    try:
+        for line in sys.stdin:
+            try:
+                host, port = line.split()
+                pid = os.fork()
+            except Exception as e:
+                reply.write(f"error {e!r}\n")
+                reply.flush()
+                continue
+            if pid == 0:
+                _serve_child(app, host, int(port))
+            children.append(pid)
+            reply.write(f"{pid}\n")
+            reply.flush()
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve(sys.argv[1])
@@ -0,0 +1,115 @@
+"""
+Start services on first use instead of when the fixture is requested.
+
+A session fixture like managed_cockroach boots its service as soon as any test asks for
+it, even if that test skips itself at runtime before ever connecting. LazyService wraps a
+lifecycle manager so that entering it returns a LazyServiceDetails proxy instead. The first
+access to a connection attribute on the proxy (sync_dsn, url, port, ...) enters the manager,
+which goes through the usual locked start / xdist registration, and every later access is
+forwarded to the real details. If nothing ever connects, the manager is never entered and
+exiting does nothing.
+
+Inspecting the proxy doesn't start the service: isinstance() sees the manager's details
+class, and the ServiceDetails metadata fields answer for a service nothing has started or
+joined yet (is_manager False, no sessions) until it is started.
+
+The bundled session fixtures are lazy when MANAGED_SERVICE_FIXTURES_LAZY=1. Wrap managers
+from managed_asgi_app_factory or managed_service_group yourself:
+
+    with LazyService(managed_asgi_app_factory("app:app")) as app_details:
+        ...
+"""
+import os
+import threading
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, Optional, Type
+
+if TYPE_CHECKING:
+    from managed_service_fixtures.base_manager import (
+        ExternalServiceLifecycleManager,
+        ServiceDetails,
+    )
+
+LAZY_ENV = "MANAGED_SERVICE_FIXTURES_LAZY"
+
+# ServiceDetails fields, as LazyServiceDetails answers them before the service is started
+UNSTARTED_METADATA: Dict[str, Callable[[], Any]] = {
+    "is_manager": lambda: False,
+    "sessions": list,
+}
+
+
+def lazy_enabled() -> bool:
+    return os.environ.get(LAZY_ENV, "").lower() in ("1", "true", "yes")
+
+
+class LazyServiceDetails:
+    """Stands in for a manager's ServiceDetails until the service is first used"""
+
+    def __init__(self, manager: "ExternalServiceLifecycleManager"):
+        object.__setattr__(self, "_manager", manager)
+        object.__setattr__(self, "_details", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def started(self) -> bool:
+        return self._details is not None
+
+    def _resolve(self) -> "ServiceDetails":
+        with self._lock:
+            if self._details is None:
+                object.__setattr__(self, "_details", self._manager.__enter__())
+        return self._details
+
+    # isinstance() and dataclasses.replace() see the real details class
+    @property
+    def __class__(self):
+        return self._manager.service_details_class
+
+    def __getattr__(self, name: str) -> Any:
+        if self._details is None and name in UNSTARTED_METADATA:
+            return UNSTARTED_METADATA[name]()
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._resolve(), name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        return self._resolve() == other
+
+    # Hashable only if the details are, like the dataclasses without frozen=True aren't
+    def __hash__(self) -> int:
+        return hash(self._resolve())
+
+    def __repr__(self) -> str:
+        if self._details is None:
+            return (
+                f"<LazyServiceDetails of {type(self._manager).__name__}, not started>"
+            )
+        return repr(self._details)
+
+
+class LazyService:
+    def __init__(self, manager: "ExternalServiceLifecycleManager"):
+        self.manager = manager
+        self.details: Optional[LazyServiceDetails] = None
+
+    def __enter__(self) -> LazyServiceDetails:
+        self.details = LazyServiceDetails(self.manager)
+        return self.details
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException],
+        exc_val: BaseException,
+        exc_tb: TracebackType,
+    ) -> None:
+        if self.details is not None and self.details.started:
+            self.manager.__exit__(exc_type, exc_val, exc_tb)
+
+
+def maybe_lazy(
+    manager: "ExternalServiceLifecycleManager",
+) -> ContextManager["ServiceDetails"]:
+    """Wrap `manager` in a LazyService if MANAGED_SERVICE_FIXTURES_LAZY is set"""
+    return LazyService(manager) if lazy_enabled() else manager
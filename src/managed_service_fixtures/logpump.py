@@ -0,0 +1,152 @@
+"""
+Non-blocking reader for the stdout/stderr of every managed process.
+
+A child writing to a pipe nobody reads stalls once the pipe buffer fills, and letting every
+child inherit our stdout interleaves their output with pytest's. Instead, PumpedTCPExecutor
+pipes stdout and stderr together and hands the pipe to a single background thread, which
+waits on all of them with a selector. Each line is logged on a per-service logger
+(managed_service_fixtures.output.<name>), tagged with the service name (in a per-service
+color when stderr is a terminal), and kept in a bounded ring buffer so the plugin can attach
+the last lines to the report of a failing test or a failed startup.
+"""
+import collections
+import itertools
+import logging
+import os
+import selectors
+import subprocess
+import sys
+import threading
+from typing import Any, Deque, Dict, List, Optional
+
+import mirakuru
+
+LOG_LINES_ENV = "MANAGED_SERVICE_FIXTURES_LOG_LINES"
+
+# ANSI colors handed out to services in order: green, yellow, blue, magenta, cyan, red
+COLORS = ["\x1b[32m", "\x1b[33m", "\x1b[34m", "\x1b[35m", "\x1b[36m", "\x1b[31m"]
+RESET = "\x1b[0m"
+
+
+class LogPump:
+    def __init__(self, buffer_lines: int = 100, colorize: bool = False):
+        self.buffer_lines = buffer_lines
+        self.colorize = colorize
+        self.buffers: Dict[str, Deque[str]] = {}
+        self.colors: Dict[str, str] = {}
+        self._color_cycle = itertools.cycle(COLORS)
+        # fd -> (name, logger, level, partial line)
+        self._streams: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        # Written to when a stream is attached, to wake the selector up
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(
+            target=self._run, name="managed-service-log-pump", daemon=True
+        )
+        self._thread.start()
+
+    def attach(self, name: str, stream: Any, level: int = logging.INFO) -> None:
+        """
+        Start reading `stream` (a pipe file object or fd). The fd is duplicated, so whoever
+        owns `stream` can close it at any time. Reading stops at EOF.
+        """
+        fd = stream if isinstance(stream, int) else stream.fileno()
+        fd = os.dup(fd)
+        os.set_blocking(fd, False)
+        with self._lock:
+            if name not in self.buffers:
+                self.buffers[name] = collections.deque(maxlen=self.buffer_lines)
+                self.colors[name] = next(self._color_cycle)
+            logger = logging.getLogger(f"managed_service_fixtures.output.{name}")
+            self._streams[fd] = [name, logger, level, b""]
+            self._selector.register(fd, selectors.EVENT_READ)
+        os.write(self._wake_w, b"\0")
+
+    def tail(self, name: str) -> List[str]:
+        with self._lock:
+            return list(self.buffers.get(name, ()))
+
+    def tails(self) -> Dict[str, List[str]]:
+        with self._lock:
+            return {name: list(lines) for name, lines in self.buffers.items()}
+
+    def _emit(self, fd: int, line: bytes) -> None:
+        name, logger, level, _ = self._streams[fd]
+        text = line.decode(errors="replace").rstrip()
+        self.buffers[name].append(text)
+        tag = f"{self.colors[name]}{name}{RESET}" if self.colorize else name
+        logger.log(level, f"[{tag}] {text}")
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self._selector.select():
+                fd = key.fd
+                if fd == self._wake_r:
+                    os.read(fd, 4096)
+                    continue
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                with self._lock:
+                    stream = self._streams[fd]
+                    if not data:
+                        # EOF, the process and everything it spawned exited
+                        if stream[3]:
+                            self._emit(fd, stream[3])
+                        self._selector.unregister(fd)
+                        del self._streams[fd]
+                        os.close(fd)
+                        continue
+                    *lines, stream[3] = (stream[3] + data).split(b"\n")
+                    for line in lines:
+                        self._emit(fd, line)
+
+
+_pump: Optional[LogPump] = None
+_pump_lock = threading.Lock()
+
+
+def get_log_pump() -> LogPump:
+    global _pump
+    with _pump_lock:
+        if _pump is None:
+            colorize = sys.stderr.isatty() and "NO_COLOR" not in os.environ
+            _pump = LogPump(
+                buffer_lines=int(os.environ.get(LOG_LINES_ENV, 100)), colorize=colorize
+            )
+        return _pump
+
+
+def service_output() -> Dict[str, List[str]]:
+    """Last lines of output of every service started in this process, by service name"""
+    if _pump is None:
+        return {}
+    return _pump.tails()
+
+
+class PumpedTCPExecutor(mirakuru.TCPExecutor):
+    """
+    mirakuru.TCPExecutor whose combined stdout/stderr is read by the log pump under `name`
+    instead of being left in a pipe nobody reads.
+    """
+
+    def __init__(self, *args, name: str, level: int = logging.INFO, **kwargs):
+        kwargs.setdefault("stdout", subprocess.PIPE)
+        kwargs.setdefault("stderr", subprocess.STDOUT)
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.level = level
+        self._pumped_process = None
+
+    def check_subprocess(self) -> bool:
+        # First called right after the process is spawned, before waiting for the port,
+        # so output produced during startup is read as well.
+        if self.process is not None and self.process is not self._pumped_process:
+            if self.process.stdout is not None:
+                get_log_pump().attach(self.name, self.process.stdout, self.level)
+            self._pumped_process = self.process
+        return super().check_subprocess()
@@ -0,0 +1,197 @@
+"""
+pytest hooks, re-exported from the package __init__ so that they are registered along with
+the fixtures by `pytest_plugins = "managed_service_fixtures"`.
+"""
+import json
+import pathlib
+from typing import Dict, List
+
+import pytest
+
+from managed_service_fixtures import affinity, demand, logpump, registry, timings
+from managed_service_fixtures.run_service_executor import find_free_port
+
+WORKEROUTPUT_TIMINGS_KEY = "managed_service_timings"
+WORKEROUTPUT_DEMAND_KEY = "managed_service_demand"
+# Service fixtures to prewarm, set after collection with --prewarm-services
+PREWARM_KEY = pytest.StashKey[List[str]]()
+
+# Timings shipped back to the xdist controller by each worker as it shuts down
+_worker_timings: List[dict] = []
+# Services used by the tests each worker ran, by worker id (master for serial runs)
+_worker_demand: Dict[str, dict] = {}
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("managed-service-fixtures")
+    group.addoption(
+        "--no-service-timings",
+        action="store_true",
+        default=False,
+        help="Don't print the summary of how long managed services spent in each lifecycle phase",
+    )
+    group.addoption(
+        "--service-timings-json",
+        default=None,
+        metavar="PATH",
+        help="Write managed service lifecycle timings to PATH as JSON",
+    )
+    group.addoption(
+        "--no-service-output",
+        action="store_true",
+        default=False,
+        help="Don't attach the last lines of managed services' output to failure reports",
+    )
+    group.addoption(
+        "--prewarm-services",
+        action="store_true",
+        default=False,
+        help="Start the managed services selected tests need in the background after collection",
+    )
+    group.addoption(
+        "--service-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Run tests using the same managed services on at most N xdist workers (with --dist loadgroup)",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    if not config.getoption("service_workers", default=None):
+        return
+    if config.getoption("service_workers") < 1:
+        raise pytest.UsageError("--service-workers must be at least 1")
+    if hasattr(config, "workerinput"):
+        # Workers re-parse the command line, where the dist mode may still be "load".
+        # Have xdist turn our xdist_group marks into scheduling groups regardless.
+        config.option.loadgroup = True
+        return
+    # On the controller, which picks the scheduler. -n without --dist means "load",
+    # and loadgroup is load plus xdist_group marks.
+    dist = config.getoption("dist", default="no")
+    if dist == "load":
+        config.option.dist = "loadgroup"
+    elif dist not in ("no", "loadgroup"):
+        raise pytest.UsageError(
+            f"--service-workers needs --dist loadgroup (or load), not --dist {dist}"
+        )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionstart(session: pytest.Session) -> None:
+    # On the controller (or serial run), before xdist starts workers and before any
+    # service is started: kill what managers of killed runs left running
+    if not hasattr(session.config, "workerinput"):
+        registry.reap_orphans()
+
+
+def _worker_id(config: pytest.Config) -> str:
+    workerinput = getattr(config, "workerinput", None)
+    return workerinput["workerid"] if workerinput else "master"
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(
+    session: pytest.Session, config: pytest.Config, items: List[pytest.Item]
+) -> None:
+    # tryfirst, xdist turns xdist_group marks into scheduling groups in its own hook
+    workers = config.getoption("service_workers", default=None)
+    if workers:
+        affinity.assign_affinity_groups(items, workers)
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    # Tests deselected with -k / -m are gone from session.items by now
+    config = session.config
+    if config.getoption("prewarm_services", default=False):
+        config.stash[PREWARM_KEY] = demand.prewarm_candidates(session.items)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _managed_service_prewarm(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> None:
+    # Autouse session fixtures are set up first, before the first test's service fixtures
+    # look for prewarmed services
+    fixture_names = request.config.stash.get(PREWARM_KEY, [])
+    if fixture_names:
+        demand.prewarm(
+            fixture_names,
+            worker_id=_worker_id(request.config),
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=find_free_port,
+        )
+
+
+def pytest_runtest_setup(item: pytest.Item) -> None:
+    # Not reached for tests skipped by a marker
+    demand.record_demand(item.fixturenames)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item: pytest.Item, call):
+    outcome = yield
+    report = outcome.get_result()
+    # A failure in setup includes a service failing to start
+    if not report.failed or item.config.getoption("no_service_output", default=False):
+        return
+    # Only services whose process runs in this process (the xdist worker that started
+    # them) have their output buffered here. Of those, only the ones this test used.
+    for name, lines in logpump.service_output().items():
+        if lines and demand.uses_service_output(item.fixturenames, name):
+            report.sections.append(
+                (f"Managed service output: {name}", "\n".join(lines))
+            )
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    # Session-scoped fixtures have been torn down by now, so every manager has recorded
+    # its timings. On an xdist worker, hand them to the controller.
+    unused = demand.stop_unclaimed()
+    worker_demand = {"demand": dict(demand.demand), "prewarmed_unused": unused}
+    workeroutput = getattr(session.config, "workeroutput", None)
+    if workeroutput is not None:
+        workeroutput[WORKEROUTPUT_TIMINGS_KEY] = timings.recorded()
+        workeroutput[WORKEROUTPUT_DEMAND_KEY] = worker_demand
+    elif demand.demand or unused:
+        _worker_demand["master"] = worker_demand
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error) -> None:
+    workeroutput = getattr(node, "workeroutput", None) or {}
+    _worker_timings.extend(workeroutput.get(WORKEROUTPUT_TIMINGS_KEY, []))
+    worker_demand = workeroutput.get(WORKEROUTPUT_DEMAND_KEY)
+    if worker_demand and (worker_demand["demand"] or worker_demand["prewarmed_unused"]):
+        _worker_demand[node.workerinput["workerid"]] = worker_demand
+
+
+def pytest_terminal_summary(terminalreporter, config: pytest.Config) -> None:
+    if _worker_demand:
+        terminalreporter.write_sep("=", "managed service demand")
+        for worker_id, worker_demand in sorted(_worker_demand.items()):
+            used = [
+                f"{name} ({count} test{'' if count == 1 else 's'})"
+                for name, count in sorted(worker_demand["demand"].items())
+            ]
+            unused = [
+                f"{name} (prewarmed, unused)"
+                for name in worker_demand["prewarmed_unused"]
+            ]
+            terminalreporter.write_line(f"{worker_id}: {', '.join(used + unused)}")
+
+    entries = timings.recorded() + _worker_timings
+    if not entries:
+        return
+
+    # Options may not be registered if this plugin was loaded late (from a conftest
+    # outside of the initial paths), so don't assume they exist.
+    json_path = config.getoption("service_timings_json", default=None)
+    if json_path:
+        pathlib.Path(json_path).write_text(json.dumps(entries, indent=2))
+
+    if not config.getoption("no_service_timings", default=False):
+        terminalreporter.write_sep("=", "managed service timings (seconds)")
+        for line in timings.format_table(entries):
+            terminalreporter.write_line(line)
@@ -0,0 +1,94 @@
+"""
+Pool of pre-started service instances for tests that need a service all to themselves.
+
+Starting a fresh process for every test costs a full boot each time. ServicePool keeps
+`size` instances booted on background threads, hands one out per checkout, and recycles it
+after checkin while the next test runs, either with a cheap in-service reset (e.g. FLUSHALL
+for Redis) or by restarting the process. Per-test isolation then costs roughly a queue get.
+
+Pools are per process, under xdist every worker has its own pool. Instances never go
+through the state file, so they are not shared with other workers.
+"""
+import concurrent.futures
+import logging
+import os
+import queue
+from typing import Dict, Tuple
+
+import mirakuru
+
+from managed_service_fixtures.base_manager import (
+    ExternalServiceLifecycleManager,
+    ServiceDetails,
+)
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE_ENV = "MANAGED_SERVICE_FIXTURES_POOL_SIZE"
+
+
+def pool_size() -> int:
+    return int(os.environ.get(POOL_SIZE_ENV, 2))
+
+
+class ServicePool:
+    """
+    pool = ServicePool(RedisServiceManager(...), size=2)
+    details = pool.checkout()   # blocks until an instance is ready
+    ...
+    pool.checkin(details)       # recycled in the background
+    pool.close()
+    """
+
+    def __init__(self, manager: ExternalServiceLifecycleManager, size: int = 2):
+        self.manager = manager
+        self.size = size
+        # Holds (details, process) tuples, or the exception a background boot failed with
+        self.ready: queue.Queue = queue.Queue()
+        self.in_use: Dict[int, Tuple[ServiceDetails, mirakuru.Executor]] = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix=f"{type(manager).__name__}-pool"
+        )
+        for _ in range(size):
+            self.executor.submit(self._boot)
+
+    def _boot(self) -> None:
+        try:
+            self.ready.put(self.manager._start_ready_service())
+        except BaseException as e:
+            self.ready.put(e)
+
+    def _recycle(self, details: ServiceDetails, process: mirakuru.Executor) -> None:
+        try:
+            if self.manager._recycle(details, process):
+                self.ready.put((details, process))
+                return
+        except Exception as e:
+            logger.warning(f"Could not reset {details}, restarting it instead: {e!r}")
+        process.stop()
+        self._boot()
+
+    def checkout(self) -> ServiceDetails:
+        item = self.ready.get()
+        if isinstance(item, BaseException):
+            # Keep the pool at full size for the next checkout
+            self.executor.submit(self._boot)
+            raise item
+        details, process = item
+        self.in_use[id(details)] = item
+        return details
+
+    def checkin(self, details: ServiceDetails) -> None:
+        details, process = self.in_use.pop(id(details))
+        self.executor.submit(self._recycle, details, process)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        processes = [process for _, process in self.in_use.values()]
+        self.in_use.clear()
+        while not self.ready.empty():
+            item = self.ready.get_nowait()
+            if not isinstance(item, BaseException):
+                processes.append(item[1])
+        for process in processes:
+            process.stop()
@@ -0,0 +1,146 @@
+"""
+Port allocation that holds reservations across processes.
+
+Finding a free port by binding port 0 and closing the socket (what find_free_port and
+pytest-asyncio's unused_tcp_port_factory do) only says the port was free a moment ago. Until
+the service binds it, any other process can be handed the same port, and with many xdist
+workers and CI jobs starting services at once that happens.
+
+Ports handed out here are recorded, with the pid asking for them, in a reservations file
+shared by every process of the same user (MANAGED_SERVICE_FIXTURES_PORT_DIR, default a
+directory in the system temp dir), under a file lock. A reserved port is never handed out
+again until the reservation expires after RESERVATION_TTL seconds or its process exits. By
+then the service has bound it, so the OS won't offer it either.
+
+That covers races between processes using this package. Anything else grabbing the port is
+caught when the service fails to start: is_port_conflict() recognizes those errors, and
+ExternalServiceLifecycleManager retries _start_service on new ports.
+"""
+import contextlib
+import errno
+import json
+import os
+import pathlib
+import socket
+import tempfile
+import time
+from typing import Callable, Dict
+
+import mirakuru
+from filelock import FileLock
+
+from managed_service_fixtures.logpump import get_log_pump
+from managed_service_fixtures.warm import pid_alive
+
+PORT_DIR_ENV = "MANAGED_SERVICE_FIXTURES_PORT_DIR"
+
+# Seconds a reservation holds, long enough for any service to bind its port
+RESERVATION_TTL = 120.0
+
+
+class PortTaken(RuntimeError):
+    """A service could not bind its port because another process got there first"""
+
+
+def probe_port() -> int:
+    # https://stackoverflow.com/a/45690594/1391176
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        s.bind(("", 0))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return s.getsockname()[1]
+
+
+def port_in_use(host: str, port: int) -> bool:
+    """True if something accepts connections on host:port"""
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def port_dir() -> pathlib.Path:
+    if os.environ.get(PORT_DIR_ENV):
+        path = pathlib.Path(os.environ[PORT_DIR_ENV])
+    else:
+        path = (
+            pathlib.Path(tempfile.gettempdir()) / f"managed-service-ports-{os.getuid()}"
+        )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class PortReservations:
+    def __init__(self, path: pathlib.Path, ttl: float = RESERVATION_TTL):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.lock = FileLock(str(self.path) + ".lock")
+
+    def _load(self) -> Dict[str, dict]:
+        """Reservations still held, called holding self.lock"""
+        try:
+            reservations = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+        now = time.time()
+        return {
+            port: r
+            for port, r in reservations.items()
+            if r["expires"] > now and pid_alive(r["pid"])
+        }
+
+    def reserve(
+        self, candidates: Callable[[], int] = probe_port, attempts: int = 100
+    ) -> int:
+        """Reserve and return the first port from `candidates` nobody else has reserved"""
+        with self.lock:
+            reservations = self._load()
+            for _ in range(attempts):
+                port = candidates()
+                if str(port) not in reservations:
+                    break
+            else:
+                raise RuntimeError(
+                    f"No unreserved port after {attempts} candidates, see {self.path}"
+                )
+            reservations[str(port)] = {
+                "pid": os.getpid(),
+                "expires": time.time() + self.ttl,
+            }
+            self.path.write_text(json.dumps(reservations))
+        return port
+
+
+def reserve_port(candidates: Callable[[], int] = probe_port) -> int:
+    """A free port, reserved in the reservations file of port_dir()"""
+    return PortReservations(port_dir() / "reservations.json").reserve(candidates)
+
+
+def reserving(factory: Callable[[], int]) -> Callable[[], int]:
+    """
+    `factory` (e.g. unused_tcp_port_factory) with the ports it hands out reserved, skipping
+    ports other processes have reserved. Returned as is if it already reserves ports.
+    """
+    if factory is reserve_port or getattr(factory, "reserves_ports", False):
+        return factory
+
+    def reserving_factory() -> int:
+        return reserve_port(factory)
+
+    reserving_factory.reserves_ports = True
+    return reserving_factory
+
+
+def is_port_conflict(exc: BaseException) -> bool:
+    """True if `exc` means a service failed to start because its port was taken"""
+    if isinstance(exc, (PortTaken, mirakuru.AlreadyRunning)):
+        return True
+    if isinstance(exc, OSError) and exc.errno == errno.EADDRINUSE:
+        return True
+    if isinstance(exc, mirakuru.ExecutorError):
+        # The process exited (or never got ready), its output tells why
+        name = getattr(exc.executor, "name", None)
+        if name:
+            tail = "\n".join(get_log_pump().tail(name)[-20:]).lower()
+            return "address already in use" in tail
+    return False
@@ -0,0 +1,108 @@
+"""
+A small TCP proxy spreading connections over several upstream servers, round-robin.
+
+Used by AppManager to put a single URL in front of several app replicas. Every accepted
+connection is paired with a connection to the next upstream and bytes are copied both ways
+until either side closes, so plain HTTP, keep-alive and websockets all work. The proxy runs
+an asyncio event loop on its own thread in the process that started it.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+class RoundRobinProxy:
+    """
+    proxy = RoundRobinProxy([("localhost", 8001), ("localhost", 8002)])
+    proxy.start()   # listens on proxy.host:proxy.port, a free port unless one is given
+    ...
+    proxy.stop()
+
+    Has the start / running / stop methods of a mirakuru executor so that it can be stopped
+    along with the processes it fronts.
+    """
+
+    def __init__(
+        self,
+        upstreams: List[Tuple[str, int]],
+        host: str = "localhost",
+        port: Optional[int] = None,
+    ):
+        self.upstreams = upstreams
+        self.host = host
+        self.port = port or 0
+        self._next_upstream = itertools.cycle(upstreams)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._started = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _handle(
+        self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter
+    ) -> None:
+        host, port = next(self._next_upstream)
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            logger.warning(f"Proxy could not connect to {host}:{port}: {e!r}")
+            client_writer.close()
+            return
+        await asyncio.gather(
+            _pipe(client_reader, upstream_writer),
+            _pipe(upstream_reader, client_writer),
+        )
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            self._error = e
+            self._started.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        await self._stopping.wait()
+        server.close()
+        # asyncio.run cancels the connections still being proxied
+
+    def start(self) -> "RoundRobinProxy":
+        self._thread = threading.Thread(
+            target=asyncio.run,
+            args=(self._serve(),),
+            name=f"round-robin-proxy-{self.host}",
+            daemon=True,
+        )
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        if self.running():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
@@ -0,0 +1,69 @@
+"""
+Protocol-level readiness checks.
+
+mirakuru's TCPExecutor considers a service started as soon as its port accepts a connection,
+but Cockroach, Vault and uvicorn can accept TCP before they can serve requests. Managers
+implement ExternalServiceLifecycleManager._check_ready with the helpers here, and
+wait_until_ready polls that check with exponential backoff so fixtures return as soon as the
+service answers a real request.
+"""
+import logging
+import socket
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def wait_until_ready(
+    check: Callable[[], bool],
+    timeout: float = 60.0,
+    initial_delay: float = 0.01,
+    max_delay: float = 1.0,
+    description: str = "service",
+) -> None:
+    """
+    Call `check` until it returns True, sleeping initial_delay, then twice as long after
+    every failed attempt up to max_delay. Exceptions raised by the check count as not ready.
+    Raises TimeoutError if the service isn't ready within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    last_error: Optional[BaseException] = None
+    while True:
+        try:
+            if check():
+                return
+        except Exception as e:
+            last_error = e
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"{description} not ready after {timeout}s (last error: {last_error!r})"
+            )
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def http_ready(url: str, timeout: float = 1.0, max_status: int = 499) -> bool:
+    """True if an HTTP GET to `url` gets a response with status <= max_status."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        return False
+    return status <= max_status
+
+
+def redis_ping(host: str, port: int, timeout: float = 1.0) -> bool:
+    """True if Redis answers PING with PONG (it answers -LOADING while loading data)."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(b"PING\r\n")
+            return sock.recv(64).startswith(b"+PONG")
+    except OSError:
+        return False
@@ -0,0 +1,349 @@
+"""
+Registries where the manager xdist worker publishes a service's connection details and the
+other workers register while they use it.
+
+ExternalServiceLifecycleManager elects the manager while holding the registry's file lock,
+but registering and unregistering only need the registry to be atomic:
+
+ - JsonStateRegistry (the default) keeps everything in the JSON state file, so every
+   register / unregister takes the file lock and re-reads and rewrites the whole file.
+ - SqliteStateRegistry keeps the details and a refcount per worker in a SQLite database in
+   WAL mode. Register / unregister are single transactions that touch one row, and don't take
+   the file lock at all.
+
+Pick one with MANAGED_SERVICE_FIXTURES_REGISTRY=json|sqlite (every xdist worker inherits
+the controller's environment, so they all agree). scripts/bench_registry.py compares them.
+
+Published state carries an `owner` entry: the manager's pid, when that process started
+and the process groups of the service it started. If the manager dies (e.g. SIGKILL),
+is_stale() tells the next worker to look at the state that it should kill the orphaned
+process groups and take over. A manager that is merely slow or paused (SIGSTOP, a suspended
+laptop) is still alive and is left alone. The start time tells a re-used pid apart.
+
+The registry lives in the pytest-N temp directory of one run, which the next run never
+looks at. So every process that starts a service (serial runs too) also keeps its owner
+entry in an OwnerRecord, in a directory shared by every run of the same user
+(MANAGED_SERVICE_FIXTURES_OWNER_DIR, default a directory in the system temp dir). The
+plugin calls reap_orphans() at the start of each session to kill what killed runs left.
+"""
+import abc
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import signal
+import sqlite3
+import subprocess
+import tempfile
+from typing import Dict, Iterator, List, Optional, Type
+
+from filelock import FileLock
+
+from managed_service_fixtures.warm import pid_alive
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_ENV = "MANAGED_SERVICE_FIXTURES_REGISTRY"
+OWNER_DIR_ENV = "MANAGED_SERVICE_FIXTURES_OWNER_DIR"
+
+
+def process_start_time(pid: int) -> Optional[str]:
+    """
+    When process `pid` started, only meant to be compared with an earlier answer for the
+    same pid. None if there's no such process or it can't be told.
+    """
+    if os.path.isdir("/proc"):
+        try:
+            stat = pathlib.Path(f"/proc/{pid}/stat").read_text()
+        except OSError:
+            return None
+        # Field 22, counting from the state field (3) after the parenthesized name
+        return stat.rpartition(")")[2].split()[19]
+    result = subprocess.run(
+        ["ps", "-o", "lstart=", "-p", str(pid)], capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def owner_entry(process_groups: List[int]) -> dict:
+    pid = os.getpid()
+    return {"pid": pid, "started": process_start_time(pid), "pgids": process_groups}
+
+
+def process_groups(executor) -> List[int]:
+    """Process groups of a mirakuru executor, or of a group of them (AppManager replicas)"""
+    if executor is None:
+        return []
+    if hasattr(executor, "executors"):
+        return [pgid for e in executor.executors for pgid in process_groups(e)]
+    process = getattr(executor, "process", None)
+    if process is None:
+        return []
+    try:
+        return [os.getpgid(process.pid)]
+    except ProcessLookupError:
+        return []
+
+
+def kill_process_groups(pgids: List[int]) -> None:
+    for pgid in pgids:
+        # Never our own group, e.g. a service that wasn't started in a new session
+        if pgid == os.getpgrp():
+            continue
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(pgid, signal.SIGKILL)
+
+
+def owner_alive(owner: dict) -> bool:
+    """True unless the owner's process is gone, or its pid now belongs to another process"""
+    if not pid_alive(owner["pid"]):
+        return False
+    started = process_start_time(owner["pid"])
+    return started is None or owner["started"] is None or started == owner["started"]
+
+
+def is_stale(state: dict) -> bool:
+    """True if the manager that published `state` is dead"""
+    owner = state.get("owner")
+    if owner is None:
+        return False
+    return not owner_alive(owner)
+
+
+def owner_dir() -> pathlib.Path:
+    if os.environ.get(OWNER_DIR_ENV):
+        path = pathlib.Path(os.environ[OWNER_DIR_ENV])
+    else:
+        name = f"managed-service-owners-{os.getuid()}"
+        path = pathlib.Path(tempfile.gettempdir()) / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class OwnerRecord:
+    """An owner entry kept in owner_dir(), where later test runs find it"""
+
+    def __init__(self, service: str, owner: dict):
+        self.owner = owner
+        # The process group tells apart services a process starts under the same name
+        self.path = owner_dir() / f"{service}-{owner['pid']}-{owner['pgids'][0]}.json"
+
+    def write(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.owner))
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            self.path.unlink()
+
+
+def reap_orphans() -> List[int]:
+    """
+    Kill the process groups of every stale owner record in owner_dir(), services whose
+    manager was killed in this or an earlier test run. Returns the killed process groups.
+    """
+    reaped = []
+    for path in sorted(owner_dir().glob("*.json")):
+        try:
+            owner = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            continue
+        if not is_stale({"owner": owner}):
+            continue
+        logger.warning(
+            f"{path.stem} was left running by pid {owner['pid']}, which is gone, killing "
+            f"process groups {owner['pgids']}"
+        )
+        kill_process_groups(owner["pgids"])
+        reaped.extend(owner["pgids"])
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+    return reaped
+
+
+class StateRegistry(abc.ABC):
+    def __init__(self, state_file_path: pathlib.Path):
+        self.state_file_path = pathlib.Path(state_file_path)
+        self.lock_file_path = pathlib.Path(str(self.state_file_path) + ".lock")
+        self.lock = FileLock(self.lock_file_path)
+
+    @abc.abstractmethod
+    def publish(self, state: dict) -> None:
+        """Make connection details available to other workers. Called holding self.lock."""
+
+    @abc.abstractmethod
+    def register(self, worker_id: str) -> Optional[dict]:
+        """
+        Atomically add a reference from worker_id to the published service and return its
+        connection details, with every registered worker in `sessions`. Returns None without
+        registering if nothing is published.
+        """
+
+    @abc.abstractmethod
+    def unregister(self, worker_id: str) -> None:
+        """Drop one reference from worker_id"""
+
+    @abc.abstractmethod
+    def state(self) -> Optional[dict]:
+        """The published connection details, like register() returns, without registering"""
+
+    @abc.abstractmethod
+    def retire(self) -> bool:
+        """
+        Atomically unpublish the service and remove its state if no worker holds a reference.
+        Returns False, changing nothing, if some still do.
+        """
+
+    @abc.abstractmethod
+    def evict(self) -> None:
+        """Unpublish a stale service, dropping every worker's reference. Called holding self.lock."""
+
+
+class JsonStateRegistry(StateRegistry):
+    def publish(self, state: dict) -> None:
+        self.state_file_path.write_text(json.dumps(state))
+
+    def register(self, worker_id: str) -> Optional[dict]:
+        with self.lock:
+            if not self.state_file_path.is_file():
+                return None
+            state = json.loads(self.state_file_path.read_text())
+            state["sessions"].append(worker_id)
+            self.state_file_path.write_text(json.dumps(state))
+            return state
+
+    def unregister(self, worker_id: str) -> None:
+        with self.lock:
+            if not self.state_file_path.is_file():
+                return
+            state = json.loads(self.state_file_path.read_text())
+            # Not there if a stale service we registered with was evicted since
+            if worker_id in state["sessions"]:
+                state["sessions"].remove(worker_id)
+                self.state_file_path.write_text(json.dumps(state))
+
+    def state(self) -> Optional[dict]:
+        with self.lock:
+            if not self.state_file_path.is_file():
+                return None
+            return json.loads(self.state_file_path.read_text())
+
+    def retire(self) -> bool:
+        with self.lock:
+            state = json.loads(self.state_file_path.read_text())
+            if state["sessions"]:
+                return False
+            self.state_file_path.unlink()
+            return True
+
+    def evict(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            self.state_file_path.unlink()
+
+
+class SqliteStateRegistry(StateRegistry):
+    # Seconds a transaction waits on another worker's write before giving up
+    busy_timeout = 60.0
+
+    def __init__(self, state_file_path: pathlib.Path):
+        super().__init__(state_file_path)
+        self.db_path = self.state_file_path.with_suffix(".sqlite")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # A connection per transaction: the manager removes the database file when it retires
+        # the service, and a long-lived connection would keep using the removed file.
+        conn = sqlite3.connect(
+            self.db_path, timeout=self.busy_timeout, isolation_level=None
+        )
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS service (id INTEGER PRIMARY KEY CHECK (id = 0), state TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (worker_id TEXT PRIMARY KEY, refs INTEGER)"
+            )
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def publish(self, state: dict) -> None:
+        state = {k: v for k, v in state.items() if k != "sessions"}
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.execute(
+                "INSERT OR REPLACE INTO service VALUES (0, ?)", (json.dumps(state),)
+            )
+
+    def register(self, worker_id: str) -> Optional[dict]:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state FROM service").fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "INSERT INTO sessions VALUES (?, 1) ON CONFLICT (worker_id) DO UPDATE SET refs = refs + 1",
+                (worker_id,),
+            )
+            sessions = conn.execute("SELECT worker_id, refs FROM sessions").fetchall()
+        state = json.loads(row[0])
+        state["sessions"] = [w for w, refs in sessions for _ in range(refs)]
+        return state
+
+    def unregister(self, worker_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE sessions SET refs = refs - 1 WHERE worker_id = ?", (worker_id,)
+            )
+            conn.execute("DELETE FROM sessions WHERE refs <= 0")
+
+    def state(self) -> Optional[dict]:
+        if not self.db_path.exists():
+            return None
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state FROM service").fetchone()
+            if row is None:
+                return None
+            sessions = conn.execute("SELECT worker_id, refs FROM sessions").fetchall()
+        state = json.loads(row[0])
+        state["sessions"] = [w for w, refs in sessions for _ in range(refs)]
+        return state
+
+    def retire(self) -> bool:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM sessions").fetchone():
+                return False
+            conn.execute("DELETE FROM service")
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(str(self.db_path) + suffix)
+        return True
+
+    def evict(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM service")
+            conn.execute("DELETE FROM sessions")
+
+
+REGISTRIES: Dict[str, Type[StateRegistry]] = {
+    "json": JsonStateRegistry,
+    "sqlite": SqliteStateRegistry,
+}
+
+
+def registry_class() -> Type[StateRegistry]:
+    name = os.environ.get(REGISTRY_ENV, "json")
+    try:
+        return REGISTRIES[name]
+    except KeyError:
+        raise ValueError(
+            f"{REGISTRY_ENV}={name!r}, expected one of {', '.join(REGISTRIES)}"
+        ) from None
@@ -0,0 +1,106 @@
+"""
+Local Unix socket the manager xdist worker listens on while it waits for the other workers
+to finish with a service.
+
+Non-manager workers connect and send a byte after unregistering themselves from the state
+file, which wakes the manager up so it can re-check the state file immediately. That replaces
+polling the state file on a timer. The state file remains the source of truth, the socket is
+only a wake-up signal, so missing a notification costs at most one fallback timeout.
+"""
+import contextlib
+import hashlib
+import logging
+import pathlib
+import selectors
+import socket
+import tempfile
+import time
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class TeardownRendezvous:
+    # How long the manager blocks without hearing from anyone before re-checking the
+    # state file anyway. Only matters if a notification was lost.
+    fallback_timeout: float = 5.0
+    # Used when Unix sockets are not available (e.g. Windows)
+    poll_interval: float = 0.25
+
+    def __init__(self, state_file_path: Union[str, pathlib.Path]):
+        self.socket_path = self.socket_path_for(state_file_path)
+        self.sock: Optional[socket.socket] = None  # set in listen
+
+    @staticmethod
+    def socket_path_for(state_file_path: Union[str, pathlib.Path]) -> pathlib.Path:
+        """
+        Unix socket paths are limited to ~104 characters, which a path inside the pytest
+        basetemp dir can easily exceed, so derive a short name in the system temp dir from
+        the state file path. Every worker computes the same path.
+        """
+        digest = hashlib.sha1(str(state_file_path).encode()).hexdigest()[:16]
+        return pathlib.Path(tempfile.gettempdir()) / f"msf-{digest}.sock"
+
+    def listen(self) -> bool:
+        """
+        Start listening for worker notifications. Returns False if the socket could not be
+        created, in which case wait() falls back to sleeping for poll_interval.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            # Leftover from a crashed run
+            self.socket_path.unlink()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(str(self.socket_path))
+            sock.listen(128)
+        except OSError as e:
+            logger.warning(
+                f"Could not listen on {self.socket_path} ({e}), falling back to polling for teardown"
+            )
+            sock.close()
+            return False
+        self.sock = sock
+        return True
+
+    def wait(self) -> None:
+        """
+        Block until at least one worker has sent a notification (or the fallback timeout
+        expires), then drain every pending notification so the next wait() blocks again.
+        """
+        if self.sock is None:
+            time.sleep(self.poll_interval)
+            return
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ)
+            timeout = self.fallback_timeout
+            while selector.select(timeout):
+                conn, _ = self.sock.accept()
+                conn.close()
+                # Anything else already queued gets accepted without blocking
+                timeout = 0
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            with contextlib.suppress(FileNotFoundError):
+                self.socket_path.unlink()
+
+    @classmethod
+    def notify(cls, state_file_path: Union[str, pathlib.Path]) -> None:
+        """
+        Called by non-manager workers after they unregister. Failing to connect is fine,
+        the manager will notice on its fallback timeout.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        socket_path = cls.socket_path_for(state_file_path)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(socket_path))
+                sock.sendall(b"\0")
+        except OSError as e:
+            logger.debug(f"Could not notify manager at {socket_path}: {e}")
@@ -6,24 +6,19 @@ You might use that if you want to introspect the service (database/vault/etc) be
 the tests run.
 """
 
-import contextlib
 import json
 import logging
 import pathlib
-import socket
-import subprocess
 import tempfile
 from typing import Optional
 
 import mirakuru
 
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.ports import is_port_conflict, reserve_port
 
-def find_free_port():
-    # https://stackoverflow.com/a/45690594/1391176
-    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
-        s.bind(("", 0))
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        return s.getsockname()[1]
+# A free port, reserved across processes (see ports.py)
+find_free_port = reserve_port
 
 
 class LoggingTCPExecutor:
@@ -35,23 +30,23 @@ class LoggingTCPExecutor:
 
     If a connection details file already exists, it will not start the service nor clean up the file.
 
-    Automatically finds free ports to use on localhost if one isn't specified.
+    Automatically finds free ports to use on localhost if one isn't specified, and moves to
+    another one if some other process binds it first.
     """
 
     cmd_template: str = ""
     host: str = "localhost"
     port: Optional[int] = None
     env_name: str = ""
+    # Times to try starting on a new free port when another process took ours
+    start_attempts: int = 5
 
     def __init__(self, verbose: bool = False):
         """
-        Control logging verbosity by choosing stdout / stderr to be None (streams to
-        main process stdout) or subprocess.PIPE (captures subprocess output and
-        does not stream to main process sdout)
-
-        TODO: Figure out how to capture and read stdout/stderr from multiple
-        subprocesses and log them all in the main process color coded by sub-process
-        e.g. Vault logs in red, Cockroach logs in green, etc
+        The service's stdout / stderr is read by the log pump (see logpump.py) and logged in
+        the main process, each line tagged with the service name and color coded per service
+        when stderr is a terminal. With verbose the lines are logged at INFO, otherwise at
+        DEBUG.
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         # XXX: tempfiles aren't getting cleaned up when a script is keyboard interrupted, not sure why.
@@ -59,7 +54,12 @@ class LoggingTCPExecutor:
         with tempfile.NamedTemporaryFile(suffix=".json") as tmp_file:
             self.connection_details_file = pathlib.Path(tmp_file.name)
 
-        self.port = self.port or find_free_port()
+        self.verbose = verbose
+        self.auto_port = self.port is None
+        self._configure(self.port or find_free_port())
+
+    def _configure(self, port: int) -> None:
+        self.port = port
         self.connection_details = {"cmd_template": self.cmd_template}
         self.connection_details.update(self.extra_details())
         # set these after the extra details update in case a subclass is overriding them
@@ -69,19 +69,12 @@ class LoggingTCPExecutor:
         # Finally build up the mirakuru command using the cmd template and connection details
         command = self.cmd_template.format(**self.connection_details)
         self.connection_details["command"] = command
-        if verbose:
-            stdout = None
-            stderr = None
-        else:
-            stdout = subprocess.DEVNULL
-            stderr = subprocess.DEVNULL
-
-        self.executor = mirakuru.TCPExecutor(
+        self.executor = PumpedTCPExecutor(
             command=command,
             host=self.host,
             port=self.port,
-            stdout=stdout,
-            stderr=stderr,
+            name=self.__class__.__name__,
+            level=logging.INFO if self.verbose else logging.DEBUG,
         )
 
     def extra_details(self) -> dict:
@@ -95,13 +88,25 @@ class LoggingTCPExecutor:
         return self.command.split()[0]
 
     def __enter__(self):
-        try:
-            self.executor.__enter__()
-        except mirakuru.ExecutorError as e:
-            if "already running" in str(e):
+        for attempt in range(1, self.start_attempts + 1):
+            try:
+                self.executor.__enter__()
+                break
+            except mirakuru.ExecutorError as e:
+                if not is_port_conflict(e):
+                    raise
+                if not self.auto_port:
+                    # A fixed port, presumably the service is already running there
+                    self.logger.warning(
+                        f"Port {self.port} already in use when trying to start {self.executor}."
+                    )
+                    break
+                if attempt == self.start_attempts:
+                    raise
                 self.logger.warning(
-                    f"Port {self.port} already in use when trying to start {self.executor}."
+                    f"Port {self.port} taken by another process, retrying on a new port."
                 )
+                self._configure(find_free_port())
         self.connection_details_file.write_text(
             json.dumps(self.connection_details, indent=4)
         )
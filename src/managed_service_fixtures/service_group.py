@@ -0,0 +1,158 @@
+"""
+Start several managed services at the same time instead of one after another.
+
+Each ExternalServiceLifecycleManager blocks in __enter__ until its process is up, so
+entering them one at a time makes session setup take the sum of every boot time.
+ServiceGroup enters all of them on a thread pool so setup takes roughly as long as the
+slowest service. Teardown is concurrent as well, which matters under xdist where the
+manager worker of each service may be waiting for other workers to unregister.
+"""
+import asyncio
+import concurrent.futures
+import logging
+from types import TracebackType
+from typing import Any, Callable, ContextManager, List, Optional, Type
+
+import pytest
+
+from managed_service_fixtures.base_manager import (
+    ExternalServiceLifecycleManager,
+    lifecycle_executor,
+)
+from managed_service_fixtures.demand import register_service_fixture
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceGroup:
+    """
+    Context manager that enters a collection of context managers concurrently and
+    returns a list of whatever each of them returned from __enter__, in the same order
+    they were passed in.
+
+    Works with ExternalServiceLifecycleManager subclasses as well as LoggingTCPExecutor
+    subclasses used in run_test_services.py style scripts.
+
+    If any context fails to enter, the ones that did enter are exited before the original
+    exception is re-raised.
+
+    Example usage:
+
+    with ServiceGroup(cockroach_manager, redis_manager) as (crdb_details, redis_details):
+        ...
+
+    `async with` works too, without blocking the event loop while services start or stop.
+    """
+
+    def __init__(self, *contexts: ContextManager, max_workers: Optional[int] = None):
+        self.contexts = list(contexts)
+        self.max_workers = max_workers or max(len(self.contexts), 1)
+        self.entered: List[ContextManager] = []  # set in __enter__, used in __exit__
+
+    def __enter__(self) -> List[Any]:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="service-group"
+        ) as pool:
+            futures = [pool.submit(context.__enter__) for context in self.contexts]
+            concurrent.futures.wait(futures)
+
+        results = []
+        error: Optional[BaseException] = None
+        for context, future in zip(self.contexts, futures):
+            exc = future.exception()
+            if exc is None:
+                self.entered.append(context)
+                results.append(future.result())
+            elif error is None:
+                error = exc
+            else:
+                logger.error(f"Additional failure while starting {context}: {exc!r}")
+
+        if error is not None:
+            # Don't leave half of the group running if one service couldn't start
+            self.__exit__(type(error), error, error.__traceback__)
+            raise error
+        return results
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        if not self.entered:
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="service-group"
+        ) as pool:
+            futures = [
+                pool.submit(context.__exit__, exc_type, exc_val, exc_tb)
+                for context in self.entered
+            ]
+            concurrent.futures.wait(futures)
+        self.entered = []
+
+        errors = [future.exception() for future in futures if future.exception()]
+        for exc in errors[1:]:
+            logger.error(f"Additional failure while stopping services: {exc!r}")
+        if errors:
+            raise errors[0]
+
+    async def __aenter__(self) -> List[Any]:
+        """__enter__ on a lifecycle_executor() thread, which blocks until all have started"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(lifecycle_executor(), self.__enter__)
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            lifecycle_executor(), self.__exit__, exc_type, exc_val, exc_tb
+        )
+
+
+@pytest.fixture(scope="session")
+def managed_service_group(
+    worker_id: str,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+) -> Callable[..., ServiceGroup]:
+    """
+    Returns a factory that builds a ServiceGroup out of ExternalServiceLifecycleManager
+    subclasses, wiring in the xdist / tmp path / port fixtures for each of them.
+
+    Managers that take extra arguments can be passed in with functools.partial.
+
+    @pytest.fixture(scope="session")
+    def services(managed_service_group):
+        app = functools.partial(AppManager, "myapp.main:app")
+        with managed_service_group(CockroachManager, RedisServiceManager, app) as (
+            crdb_details,
+            redis_details,
+            app_details,
+        ):
+            yield crdb_details, redis_details, app_details
+    """
+
+    def _factory(
+        *manager_classes: Callable[..., ExternalServiceLifecycleManager]
+    ) -> ServiceGroup:
+        return ServiceGroup(
+            *(
+                manager_class(
+                    worker_id=worker_id,
+                    tmp_path_factory=tmp_path_factory,
+                    unused_tcp_port_factory=unused_tcp_port_factory,
+                )
+                for manager_class in manager_classes
+            )
+        )
+
+    return _factory
+
+
+register_service_fixture("managed_service_group")
@@ -1,5 +1,8 @@
-from dataclasses import dataclass
-from typing import Callable, Optional, Tuple
+import concurrent.futures
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple, Union
 
 import mirakuru
 import pytest
@@ -8,12 +11,22 @@ from managed_service_fixtures.base_manager import (
     ExternalServiceLifecycleManager,
     ServiceDetails,
 )
+from managed_service_fixtures.demand import register_service_fixture
+from managed_service_fixtures.forkserver import ForkedApp
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.ports import PortTaken, port_in_use
+from managed_service_fixtures.proxy import RoundRobinProxy
+from managed_service_fixtures.readiness import http_ready
 
 
 @dataclass
 class AppDetails(ServiceDetails):
     hostname: str = "localhost"
     port: int = 8000
+    # Every replica's port (port is the first of them)
+    ports: List[int] = field(default_factory=list)
+    # Port of the round-robin proxy in front of the replicas, if there is one
+    proxy_port: Optional[int] = None
 
     @property
     def url(self) -> str:
@@ -23,6 +36,104 @@ class AppDetails(ServiceDetails):
     def ws_base(self) -> str:
         return f"ws://{self.hostname}:{self.port}"
 
+    @property
+    def urls(self) -> List[str]:
+        return [f"http://{self.hostname}:{port}" for port in self.ports or [self.port]]
+
+    @property
+    def proxy_url(self) -> Optional[str]:
+        if self.proxy_port is None:
+            return None
+        return f"http://{self.hostname}:{self.proxy_port}"
+
+
+class InProcessServer:
+    """
+    uvicorn.Server for an app imported into this process, running on a dedicated thread
+    with its own event loop. Has the start / running / stop methods of a mirakuru executor.
+    """
+
+    def __init__(self, app_location: str, host: str, port: int, timeout: float = 60.0):
+        # uvicorn is only needed by projects testing ASGI apps
+        import uvicorn
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # log_config=None keeps uvicorn from reconfiguring logging for the whole process
+        self.server = uvicorn.Server(
+            uvicorn.Config(app_location, host=host, port=port, log_config=None)
+        )
+        self.thread: Optional[threading.Thread] = None
+        # What the server thread died of, if it raised
+        self.error: Optional[BaseException] = None
+
+    def _run(self) -> None:
+        try:
+            self.server.run()
+        except BaseException as e:
+            self.error = e
+
+    def start(self) -> "InProcessServer":
+        # uvicorn only installs signal handlers on the main thread, so this is safe
+        self.thread = threading.Thread(
+            target=self._run, name=f"uvicorn-{self.port}", daemon=True
+        )
+        self.thread.start()
+        deadline = time.monotonic() + self.timeout
+        while not self.server.started:
+            if not self.thread.is_alive():
+                if port_in_use(self.host, self.port):
+                    raise PortTaken(f"{self.host}:{self.port} already in use")
+                # A failed lifespan startup returns, uvicorn logs why on uvicorn.error
+                raise RuntimeError(
+                    f"uvicorn exited before serving on {self.host}:{self.port} "
+                    f"({self.error!r}, see the uvicorn.error log)"
+                ) from self.error
+            if time.monotonic() > deadline:
+                # Can't interrupt a hung startup, the daemon thread exits with us. Stop it
+                # should it ever get done.
+                self.server.should_exit = True
+                raise TimeoutError(
+                    f"uvicorn not serving on {self.host}:{self.port} after {self.timeout}s, "
+                    "is the app's lifespan startup stuck?"
+                )
+            time.sleep(0.005)
+        return self
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self) -> None:
+        if self.running():
+            self.server.should_exit = True
+            self.thread.join()
+
+
+class ExecutorGroup:
+    """Several executors (app replicas, a proxy) started, checked and stopped as one"""
+
+    def __init__(self, executors: list):
+        self.executors = executors
+
+    def start(self) -> "ExecutorGroup":
+        with concurrent.futures.ThreadPoolExecutor(len(self.executors)) as pool:
+            futures = [pool.submit(executor.start) for executor in self.executors]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def running(self) -> bool:
+        return all(executor.running() for executor in self.executors)
+
+    def stop(self) -> None:
+        for executor in self.executors:
+            executor.stop()
+
 
 class AppManager(ExternalServiceLifecycleManager):
     """
@@ -32,6 +143,24 @@ class AppManager(ExternalServiceLifecycleManager):
     you would set TEST_APP_LOCATION to "myapp.start:entrypoint".
 
     The default location to look for the app location is app.main:app.
+
+    The app counts as ready once a GET to health_path gets any non-5xx response, pass a
+    dedicated health check path if "/" is slow or has side effects.
+
+    For concurrency and load tests, `replicas` starts several uvicorn processes on their own
+    ports (AppDetails.ports / .urls) and `workers` is passed to uvicorn's --workers. With
+    `proxy=True` a round-robin TCP proxy in this process fronts the replicas, at
+    AppDetails.proxy_url.
+
+    With mode="thread" the app is served from this process instead: uvicorn.Server runs on
+    a dedicated thread with its own event loop, so there's no interpreter startup or
+    re-import of the app, and breakpoints in the app work. The app module is imported in this
+    process, app_location may also be the app object itself.
+
+    mode="forkserver" keeps the app out of process but imports it only once, in a fork server
+    (see managed_service_fixtures.forkserver) that forks a child per app instance.
+
+    `workers` needs mode="subprocess".
     Note: all environment variables of the parent process (pytest runner) automatically get pased
     into the child process that mirakuru spawns.
     """
@@ -39,23 +168,79 @@ class AppManager(ExternalServiceLifecycleManager):
     env_file_pointer: str = "TEST_APP_DETAILS"
     json_state_file_name = "asgi.json"
     service_details_class = AppDetails
+    # A kept-warm app would keep serving stale code after edits
+    supports_keep_warm = False
 
-    def __init__(self, app_location, *args, **kwargs):
+    def __init__(
+        self,
+        app_location,
+        *args,
+        health_path: str = "/",
+        replicas: int = 1,
+        workers: Optional[int] = None,
+        proxy: bool = False,
+        mode: str = "subprocess",
+        **kwargs,
+    ):
+        if mode not in ("subprocess", "thread", "forkserver"):
+            raise ValueError(
+                f"mode must be 'subprocess', 'thread' or 'forkserver', not {mode!r}"
+            )
+        if workers and mode != "subprocess":
+            raise ValueError(f"workers is not supported with mode={mode!r}")
         super().__init__(*args, **kwargs)
         self.app_location = app_location
+        self.health_path = health_path
+        self.replicas = replicas
+        self.workers = workers
+        self.proxy = proxy
+        self.mode = mode
+
+    def _uvicorn_executor(
+        self, hostname: str, port: int, name: str
+    ) -> Union[mirakuru.TCPExecutor, InProcessServer, ForkedApp]:
+        if self.mode == "thread":
+            return InProcessServer(self.app_location, hostname, port)
+        if self.mode == "forkserver":
+            return ForkedApp(self.app_location, hostname, port)
+        cmd = f"""uvicorn --host {hostname} --port {port} {self.app_location}"""
+        if self.workers:
+            cmd += f" --workers {self.workers}"
+        return PumpedTCPExecutor(
+            cmd, host=hostname, port=int(port), shell=True, name=name
+        )
 
     def _start_service(self) -> Tuple[AppDetails, mirakuru.Executor]:
         hostname = "localhost"
-        port = self.unused_tcp_port_factory()
+        if self.replicas == 1 and not self.proxy:
+            port = self.unused_tcp_port_factory()
+            details = AppDetails(hostname=hostname, port=port, ports=[port])
+            process = self._uvicorn_executor(hostname, port, self.service_name)
+            process.start()
+            assert process.running()
+            return details, process
 
-        details = AppDetails(hostname=hostname, port=port)
-
-        cmd = f"""uvicorn --host {hostname} --port {port} {self.app_location}"""
-        process = mirakuru.TCPExecutor(cmd, host=hostname, port=int(port), shell=True)
-        process.start()
-        assert process.running()
+        ports = [self.unused_tcp_port_factory() for _ in range(self.replicas)]
+        executors = [
+            self._uvicorn_executor(hostname, port, f"{self.service_name}-{i}")
+            for i, port in enumerate(ports)
+        ]
+        if self.proxy:
+            executors.append(
+                RoundRobinProxy([(hostname, port) for port in ports], host=hostname)
+            )
+        process = ExecutorGroup(executors).start()
+        details = AppDetails(
+            hostname=hostname,
+            port=ports[0],
+            ports=ports,
+            proxy_port=executors[-1].port if self.proxy else None,
+        )
         return details, process
 
+    def _check_ready(self, service_details: AppDetails) -> bool:
+        return all(http_ready(url + self.health_path) for url in service_details.urls)
+
 
 @pytest.fixture(scope="session")
 def managed_asgi_app_factory(
@@ -67,6 +252,11 @@ def managed_asgi_app_factory(
         app_location: Optional[str] = None,
         env_file_pointer: Optional[str] = None,
         json_state_file_name: Optional[str] = None,
+        health_path: str = "/",
+        replicas: int = 1,
+        workers: Optional[int] = None,
+        proxy: bool = False,
+        mode: str = "subprocess",
     ) -> AppManager:
         return AppManager(
             worker_id=worker_id,
@@ -75,6 +265,14 @@ def managed_asgi_app_factory(
             app_location=app_location,
             env_file_pointer=env_file_pointer,
             json_state_file_name=json_state_file_name,
+            health_path=health_path,
+            replicas=replicas,
+            workers=workers,
+            proxy=proxy,
+            mode=mode,
         )
 
     return _factory
+
+
+register_service_fixture("managed_asgi_app_factory")
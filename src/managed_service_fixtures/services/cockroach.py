@@ -1,13 +1,91 @@
+import concurrent.futures
+import dataclasses
+import functools
+import hashlib
+import itertools
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
 from dataclasses import dataclass
-from typing import Callable, Tuple
+from types import TracebackType
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
 import mirakuru
 import pytest
+from filelock import FileLock
 
 from managed_service_fixtures.base_manager import (
     ExternalServiceLifecycleManager,
     ServiceDetails,
 )
+from managed_service_fixtures.demand import fixture_service, register_service_fixture
+from managed_service_fixtures.lazy import maybe_lazy
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.readiness import wait_until_ready
+from managed_service_fixtures.warm import keep_warm_enabled
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "TEST_CRDB_PROFILE"
+STORE_CACHE_ENV = "TEST_CRDB_STORE_CACHE"
+
+# Database the migrations of a CockroachMigrations run in
+MIGRATED_DB = "migrated"
+
+
+@dataclass(frozen=True)
+class CockroachProfile:
+    """
+    Memory bounds for a Cockroach node. Sizes are passed to `cockroach start-single-node` as
+    is, so they can be bytes with a unit (256mib) or a fraction of system memory (.25).
+    None leaves Cockroach's own default, which for max_sql_memory is 25% of system memory.
+    """
+
+    # In-memory stores can't be smaller than 640MiB
+    store_size: str = "641mib"
+    cache: Optional[str] = None
+    max_sql_memory: Optional[str] = None
+
+    @property
+    def memory_flags(self) -> str:
+        flags = ""
+        if self.cache:
+            flags += f" --cache={self.cache}"
+        if self.max_sql_memory:
+            flags += f" --max-sql-memory={self.max_sql_memory}"
+        return flags
+
+    @property
+    def flags(self) -> str:
+        return f"--store=type=mem,size={self.store_size}{self.memory_flags}"
+
+
+COCKROACH_PROFILES: Dict[str, CockroachProfile] = {
+    "default": CockroachProfile(),
+    # Enough for test schemas and small datasets, and bounded on machines with lots of RAM
+    "small": CockroachProfile(cache="64mib", max_sql_memory="128mib"),
+}
+
+
+def cockroach_profile(
+    profile: Union[str, dict, CockroachProfile, None] = None
+) -> CockroachProfile:
+    """Resolve a profile name (default: $TEST_CRDB_PROFILE or "default") or fields"""
+    if isinstance(profile, CockroachProfile):
+        return profile
+    if isinstance(profile, dict):
+        return CockroachProfile(**profile)
+    name = profile or os.environ.get(PROFILE_ENV) or "default"
+    try:
+        return COCKROACH_PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown Cockroach profile {name!r}, expected one of {', '.join(COCKROACH_PROFILES)}"
+        ) from None
 
 
 @dataclass
@@ -18,6 +96,10 @@ class CockroachDetails(ServiceDetails):
     username: str = "root"
     password: str = ""
     dbname: str = "defaultdb"
+    # The node's CockroachProfile
+    store_size: str = "641mib"
+    cache: Optional[str] = None
+    max_sql_memory: Optional[str] = None
 
     @property
     def sync_dsn(self) -> str:
@@ -34,6 +116,154 @@ class CockroachDetails(ServiceDetails):
         """Web UI/Dashboard URL for debug and query review"""
         return f"http://{self.hostname}:{self.http_port}"
 
+    @property
+    def cli_url(self) -> str:
+        """Connection URL for the `cockroach sql --url` CLI"""
+        credentials = self.username
+        if self.password:
+            credentials += f":{self.password}"
+        return f"postgresql://{credentials}@{self.hostname}:{self.sql_port}/{self.dbname}?sslmode=disable"
+
+
+def execute_sql(details: CockroachDetails, statement: str) -> str:
+    """
+    Run a SQL statement with the `cockroach sql` CLI and return its output. Uses the CLI so
+    that no Python database driver is required, the `cockroach` binary is already needed
+    to manage the service.
+    """
+    result = subprocess.run(
+        ["cockroach", "sql", "--url", details.cli_url, "--format=csv", "-e", statement],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout
+
+
+class CockroachSnapshot:
+    """
+    Capture a prepared database once with BACKUP, then RESTORE a fresh copy of it under a
+    new name whenever a test needs a clean database. Restoring a small schema is cheaper
+    than dropping and re-creating every table or truncating everything between tests.
+
+    Backups are written to nodelocal storage, which CockroachManager points at a temp dir
+    with --external-io-dir. Externally managed clusters need to allow nodelocal as well.
+
+    snapshot = CockroachSnapshot(details)   # details.dbname already has the schema
+    snapshot.capture()
+    fresh_details = snapshot.restore()      # a copy named e.g. test_gw0_3
+    snapshot.drop(fresh_details)            # dropped in the background
+    snapshot.close()                        # waits for pending drops
+    """
+
+    def __init__(self, details: CockroachDetails, name: Optional[str] = None):
+        self.details = details
+        self.name = name or f"{details.dbname}_snapshot"
+        self.uri = f"nodelocal://1/snapshots/{self.name}"
+        # DDL is run connected to defaultdb so restored copies can be dropped freely
+        self.admin_details = dataclasses.replace(details, dbname="defaultdb")
+        self.counter = itertools.count()
+        self.dropper = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="cockroach-snapshot-drop"
+        )
+
+    def capture(self) -> None:
+        """Snapshot details.dbname as it is right now, replacing any earlier capture."""
+        execute_sql(
+            self.admin_details,
+            f"BACKUP DATABASE {self.details.dbname} INTO '{self.uri}'",
+        )
+
+    def restore(self, dbname: Optional[str] = None) -> CockroachDetails:
+        """Restore the latest capture as a new database and return details pointing at it."""
+        dbname = dbname or f"{self.details.dbname}_{next(self.counter)}"
+        execute_sql(
+            self.admin_details,
+            f"RESTORE DATABASE {self.details.dbname} FROM LATEST IN '{self.uri}' "
+            f"WITH new_db_name = '{dbname}'",
+        )
+        return dataclasses.replace(self.details, dbname=dbname)
+
+    def drop(self, details: CockroachDetails) -> concurrent.futures.Future:
+        """Drop a restored copy without making the caller wait for it."""
+        return self.dropper.submit(
+            execute_sql,
+            self.admin_details,
+            f"DROP DATABASE IF EXISTS {details.dbname} CASCADE",
+        )
+
+    def close(self) -> None:
+        self.dropper.shutdown(wait=True)
+
+
+def store_cache_dir() -> pathlib.Path:
+    if os.environ.get(STORE_CACHE_ENV):
+        path = pathlib.Path(os.environ[STORE_CACHE_ENV])
+    else:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+        path = (
+            pathlib.Path(cache_home) / "managed-service-fixtures" / "cockroach-stores"
+        )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def cockroach_version() -> str:
+    return subprocess.run(
+        ["cockroach", "version", "--build-tag"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def clone_tree(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """Copy a directory tree, as copy-on-write clones where the filesystem supports it"""
+    if sys.platform == "linux":
+        cmd = ["cp", "-a", "--reflink=auto", str(src), str(dst)]
+    elif sys.platform == "darwin":
+        cmd = ["cp", "-c", "-R", str(src), str(dst)]
+    else:
+        cmd = None
+    if cmd and subprocess.run(cmd, capture_output=True).returncode == 0:
+        return
+    shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(src, dst, symlinks=True)
+
+
+@dataclass
+class CockroachMigrations:
+    """
+    A schema to build once and cache as a pre-migrated on-disk store.
+
+    `migrate` is called with details of an empty `migrated` database on a node with a disk
+    store, and should bring it up to date (e.g. run `alembic upgrade head` against
+    details.sync_dsn). The node's store is then saved under store_cache_dir(), keyed by a
+    hash of the files under `sources` (e.g. the alembic versions directory), `version` and
+    the Cockroach version. Later nodes start on a copy of the saved store and skip `migrate`
+    entirely. Any change to the sources makes a new key, and so a new store.
+    """
+
+    migrate: Callable[[CockroachDetails], None]
+    sources: List[Union[str, pathlib.Path]] = dataclasses.field(default_factory=list)
+    # Anything else the schema depends on, bump to force a rebuild
+    version: str = ""
+
+    def key(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{cockroach_version()}\0{self.version}\0".encode())
+        for source in sorted(pathlib.Path(s) for s in self.sources):
+            files = sorted(
+                p
+                for p in ([source] if source.is_file() else source.rglob("*"))
+                if p.is_file() and "__pycache__" not in p.parts
+            )
+            for path in files:
+                digest.update(f"{path.relative_to(source.parent)}\0".encode())
+                digest.update(path.read_bytes())
+        return digest.hexdigest()[:24]
+
 
 class CockroachManager(ExternalServiceLifecycleManager):
     """
@@ -44,6 +274,26 @@ class CockroachManager(ExternalServiceLifecycleManager):
 
     There is no table schema creation here, users will need to do that somewhere else.
 
+    Every worker (the xdist worker_id, or "master" when not running in parallel) gets its own
+    database on the shared node, e.g. test_gw3. It is created when the worker enters the
+    manager and dropped when it exits, so tests in different workers don't share tables.
+    Kept-warm nodes (see warm.py) are shared by concurrent runs too, so there its name ends
+    with the worker's pid, e.g. test_gw3_4242.
+    Set per_worker_database = False to hand every worker the shared `defaultdb` instead.
+    Clusters configured from TEST_CRDB_DETAILS are handed out as configured, this manager
+    doesn't run DDL on databases it didn't start.
+
+    The node is started with an --external-io-dir so that CockroachSnapshot can BACKUP to
+    and RESTORE from nodelocal storage.
+
+    Its memory is bounded by a CockroachProfile: pass `profile` (a name from
+    COCKROACH_PROFILES or a CockroachProfile), or set TEST_CRDB_PROFILE, e.g. to "small".
+
+    With `migrations` (a CockroachMigrations) the node runs on a disk store copied from a
+    cached pre-migrated store, built on first use. Worker databases are then restored from a
+    snapshot of the migrated database rather than created empty. If `migrate` fails, the
+    node's store is removed and nothing is cached.
+
     See https://www.cockroachlabs.com/docs/stable/install-cockroachdb.html for
     installing Cockroach.
     """
@@ -51,8 +301,39 @@ class CockroachManager(ExternalServiceLifecycleManager):
     env_file_pointer: str = "TEST_CRDB_DETAILS"
     json_state_file_name = "cockroachdb.json"
     service_details_class = CockroachDetails
+    per_worker_database: bool = True
 
-    def _start_service(self) -> Tuple[CockroachDetails, mirakuru.Executor]:
+    def __init__(
+        self,
+        *args,
+        profile: Union[str, dict, CockroachProfile, None] = None,
+        migrations: Optional[CockroachMigrations] = None,
+        **kwargs,
+    ):
+        if migrations:
+            # Not the service of managed_cockroach without migrations (e.g. prewarmed)
+            kwargs["json_state_file_name"] = (
+                kwargs.get("json_state_file_name") or "cockroachdb-migrated.json"
+            )
+        super().__init__(*args, **kwargs)
+        self.profile = cockroach_profile(profile)
+        self.migrations = migrations
+        if migrations:
+            # A keep-warm broker can't be handed the migrate callable
+            self.supports_keep_warm = False
+        # Both set in __enter__, used in __exit__. DDL for the per-worker database is
+        # run through the shared details, connected to defaultdb.
+        self.shared_details: Optional[CockroachDetails] = None
+        self.worker_dbname: Optional[str] = None
+        self.external_io_dir: Optional[str] = None  # set in _start_service
+        self.store_dir: Optional[str] = None  # set in _start_service with migrations
+
+    def _warm_kwargs(self) -> dict:
+        return {"profile": dataclasses.asdict(self.profile)}
+
+    def _start_node(
+        self, store_flags: str
+    ) -> Tuple[CockroachDetails, mirakuru.Executor]:
         sql_port = self.unused_tcp_port_factory()
         http_port = self.unused_tcp_port_factory()
         hostname = "localhost"
@@ -67,26 +348,181 @@ class CockroachManager(ExternalServiceLifecycleManager):
             password=password,
             # defaultdb exists, and 'root' user has superuser privs over it.
             dbname="defaultdb",
+            **dataclasses.asdict(self.profile),
         )
 
         # chdir to avoid heap_profiler/ subdir from littering top of gate tree.
-        cockroach_cmd = f"""cd $TMPDIR && cockroach start-single-node --insecure --listen-addr  localhost:{sql_port} --http-addr localhost:{http_port} --store=type=mem,size=641mib"""
-        process = mirakuru.TCPExecutor(
-            cockroach_cmd, host=hostname, port=int(sql_port), shell=True
+        cockroach_cmd = f"""cd $TMPDIR && cockroach start-single-node --insecure --listen-addr  localhost:{sql_port} --http-addr localhost:{http_port} {store_flags} --external-io-dir={self.external_io_dir}"""
+        process = PumpedTCPExecutor(
+            cockroach_cmd,
+            host=hostname,
+            port=int(sql_port),
+            shell=True,
+            name=self.service_name,
         )
         process.start()
         assert process.running()
         return details, process
 
+    def _start_service(self) -> Tuple[CockroachDetails, mirakuru.Executor]:
+        try:
+            if self.migrations:
+                return self._start_migrated_service()
+            # Backs nodelocal:// storage, used by CockroachSnapshot. Removed in
+            # _release_service.
+            self.external_io_dir = tempfile.mkdtemp(prefix="cockroach-extern-")
+            return self._start_node(self.profile.flags)
+        except BaseException:
+            # Retried on new ports, or given up on, either way with new directories
+            self._remove_work_dirs()
+            raise
+
+    def _start_ready_service(self) -> Tuple[CockroachDetails, mirakuru.Executor]:
+        try:
+            return super()._start_ready_service()
+        except BaseException:
+            self._remove_work_dirs()
+            raise
+
+    def _start_migrated_service(self) -> Tuple[CockroachDetails, mirakuru.Executor]:
+        # store/ and extern/ (with the snapshot of the migrated database) of a stopped node
+        cached = store_cache_dir() / self.migrations.key()
+        self.store_dir = tempfile.mkdtemp(prefix="cockroach-store-")
+        work_dir = pathlib.Path(self.store_dir)
+        self.external_io_dir = str(work_dir / "extern")
+        store_flags = f"--store=path={work_dir / 'store'}{self.profile.memory_flags}"
+
+        # Concurrent runs with the same migrations wait for one of them to build the store
+        with FileLock(str(cached) + ".lock"):
+            if cached.is_dir():
+                for name in ("store", "extern"):
+                    clone_tree(cached / name, work_dir / name)
+            else:
+                logger.info(f"Building a migrated Cockroach store in {cached}")
+                os.mkdir(self.external_io_dir)
+                details, process = self._start_node(store_flags)
+                try:
+                    wait_until_ready(
+                        lambda: self._check_ready(details),
+                        timeout=self.readiness_timeout,
+                        description=type(self).__name__,
+                    )
+                    execute_sql(details, f"CREATE DATABASE {MIGRATED_DB}")
+                    migrated = dataclasses.replace(details, dbname=MIGRATED_DB)
+                    self.migrations.migrate(migrated)
+                    CockroachSnapshot(migrated).capture()
+                finally:
+                    process.stop()
+                # Only complete stores ever appear under the key
+                partial = cached.with_name(f"{cached.name}.partial-{os.getpid()}")
+                try:
+                    partial.mkdir()
+                    for name in ("store", "extern"):
+                        clone_tree(work_dir / name, partial / name)
+                    os.rename(partial, cached)
+                except BaseException:
+                    shutil.rmtree(partial, ignore_errors=True)
+                    raise
+        return self._start_node(store_flags)
+
+    def _check_ready(self, service_details: CockroachDetails) -> bool:
+        try:
+            execute_sql(service_details, "SELECT 1")
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def _remove_work_dirs(self) -> None:
+        for path in (self.external_io_dir, self.store_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+        self.external_io_dir = self.store_dir = None
+
+    def _release_service(self) -> None:
+        super()._release_service()
+        self._remove_work_dirs()
+
+    def _create_worker_database(self, details: CockroachDetails) -> None:
+        if self.migrations:
+            # Every worker gets its own copy of the migrated database
+            snapshot = CockroachSnapshot(
+                dataclasses.replace(details, dbname=MIGRATED_DB)
+            )
+            execute_sql(
+                details, f"DROP DATABASE IF EXISTS {self.worker_dbname} CASCADE"
+            )
+            snapshot.restore(self.worker_dbname)
+        else:
+            execute_sql(details, f"CREATE DATABASE IF NOT EXISTS {self.worker_dbname}")
+
+    def __enter__(self) -> CockroachDetails:
+        service_details = super().__enter__()
+        if self.configed_from_env:
+            # Maybe remote, without DDL rights for us or a local cockroach CLI to run it
+            return service_details
+        if not self.per_worker_database:
+            if self.migrations:
+                return dataclasses.replace(service_details, dbname=MIGRATED_DB)
+            return service_details
+
+        self.shared_details = service_details
+        # Worker ids are gw0, gw1, ... or master, all valid SQL identifiers
+        self.worker_dbname = f"test_{self.worker_id}"
+        if self.supports_keep_warm and keep_warm_enabled():
+            # A kept-warm node is shared with concurrent runs, whose workers have the same
+            # ids. Don't create or drop their databases.
+            self.worker_dbname += f"_{os.getpid()}"
+        try:
+            self._create_worker_database(service_details)
+        except BaseException as e:
+            super().__exit__(type(e), e, e.__traceback__)
+            raise
+        return dataclasses.replace(service_details, dbname=self.worker_dbname)
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException],
+        exc_val: BaseException,
+        exc_tb: TracebackType,
+    ) -> None:
+        try:
+            if self.worker_dbname:
+                execute_sql(
+                    self.shared_details,
+                    f"DROP DATABASE IF EXISTS {self.worker_dbname} CASCADE",
+                )
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Could not drop {self.worker_dbname}: {e.stderr}")
+        finally:
+            super().__exit__(exc_type, exc_val, exc_tb)
+
+
+@pytest.fixture(scope="session")
+def managed_cockroach_migrations() -> Optional[CockroachMigrations]:
+    """
+    Override to return a CockroachMigrations, and managed_cockroach runs on a cached
+    pre-migrated store, handing each worker a copy of the migrated database.
+
+    @pytest.fixture(scope="session")
+    def managed_cockroach_migrations():
+        return CockroachMigrations(migrate=run_alembic, sources=["alembic/versions"])
+    """
+    return None
+
 
 @pytest.fixture(scope="session")
 def managed_cockroach(
     worker_id: str,
     tmp_path_factory: pytest.TempPathFactory,
     unused_tcp_port_factory: Callable[[], int],
+    managed_cockroach_migrations: Optional[CockroachMigrations],
 ) -> CockroachDetails:
     """
-    Yields connection details for a CockroachDB instance.
+    Yields connection details for a CockroachDB instance. The `dbname` is a database
+    private to this xdist worker (test_gw0, test_gw1, ... or test_master, plus the worker's
+    pid on kept-warm nodes), so each worker needs to create its own schema, unless
+    managed_cockroach_migrations is overridden.
+    With TEST_CRDB_DETAILS, `dbname` is the configured database, shared by every worker.
 
     SQLAlchemy connection example:
      - engine = create_engine(cockroach_details.sync_dsn)
@@ -94,9 +530,51 @@ def managed_cockroach(
 
     View the CRDB Dashboard at URL: print(cockroach_details.webui).
     """
-    with CockroachManager(
+    manager = CockroachManager(
         worker_id=worker_id,
         tmp_path_factory=tmp_path_factory,
         unused_tcp_port_factory=unused_tcp_port_factory,
-    ) as cockroach_details:
+        migrations=managed_cockroach_migrations,
+    )
+    if managed_cockroach_migrations:
+        # A service prewarmed after collection was started without the migrations
+        service = maybe_lazy(manager)
+    else:
+        service = fixture_service("managed_cockroach", manager)
+    with service as cockroach_details:
         yield cockroach_details
+
+
+@pytest.fixture(scope="session")
+def managed_cockroach_snapshot(
+    managed_cockroach: CockroachDetails,
+) -> CockroachSnapshot:
+    """
+    Snapshot of this worker's database, used by managed_cockroach_fresh.
+
+    Captured when first requested. Autouse session fixtures run before it, so a schema
+    created in one of those (like configure_db in tests/test_cockroach.py) is part of the
+    snapshot. Override this fixture to build the schema explicitly before capturing.
+    """
+    snapshot = CockroachSnapshot(managed_cockroach)
+    snapshot.capture()
+    yield snapshot
+    snapshot.close()
+
+
+@pytest.fixture
+def managed_cockroach_fresh(
+    managed_cockroach_snapshot: CockroachSnapshot,
+) -> CockroachDetails:
+    """
+    Yields connection details for a brand new database restored from
+    managed_cockroach_snapshot, dropped (in the background) after the test.
+    """
+    details = managed_cockroach_snapshot.restore()
+    yield details
+    managed_cockroach_snapshot.drop(details)
+
+
+register_service_fixture(
+    "managed_cockroach", CockroachManager, configured_by="managed_cockroach_migrations"
+)
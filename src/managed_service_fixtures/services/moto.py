@@ -1,4 +1,10 @@
-from typing import Callable, Tuple
+import concurrent.futures
+import dataclasses
+import json
+import os
+import pathlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import mirakuru
 import pytest
@@ -7,23 +13,208 @@ from managed_service_fixtures.base_manager import (
     ExternalServiceLifecycleManager,
     ServiceDetails,
 )
+from managed_service_fixtures.demand import fixture_service, register_service_fixture
+from managed_service_fixtures.lazy import maybe_lazy
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.readiness import http_ready
 
+SEED_ENV = "TEST_MOTO_SEED"
+SERVICES_ENV = "TEST_MOTO_SERVICES"
 
+# Moto's S3 only takes a plain CreateBucket in this region
+S3_REGION = "us-east-1"
+# Handed to xdist workers in turn, gw0 -> us-east-2, gw1 -> us-west-1, ...
+WORKER_REGIONS = [
+    "us-east-2",
+    "us-west-1",
+    "us-west-2",
+    "ca-central-1",
+    "eu-west-1",
+    "eu-west-2",
+    "eu-west-3",
+    "eu-central-1",
+    "eu-north-1",
+    "ap-south-1",
+    "ap-southeast-1",
+    "ap-southeast-2",
+    "ap-northeast-1",
+    "ap-northeast-2",
+    "sa-east-1",
+]
+
+
+@dataclass
 class MotoDetails(ServiceDetails):
     hostname: str = "localhost"
     port: int = 5000
+    # Seeded bucket -> keys of the objects uploaded to it
+    buckets: Dict[str, List[str]] = field(default_factory=dict)
+    # Services the server mocks, empty for all of them
+    services: List[str] = field(default_factory=list)
+    # This xdist worker's region and S3 bucket prefix, see MotoServiceManager
+    region: str = S3_REGION
+    bucket_prefix: str = ""
+    aws_access_key_id: str = "testing"
+    aws_secret_access_key: str = "testing"
 
     @property
     def url(self):
         return f"http://{self.hostname}:{self.port}"
 
+    @property
+    def boto3_kwargs(self) -> dict:
+        """Keyword arguments for boto3.client / boto3.resource, e.g. boto3.client("sqs", **kw)"""
+        return {
+            "endpoint_url": self.url,
+            "region_name": self.region,
+            "aws_access_key_id": self.aws_access_key_id,
+            "aws_secret_access_key": self.aws_secret_access_key,
+        }
+
+    @property
+    def s3_kwargs(self) -> dict:
+        """boto3_kwargs for S3, in us-east-1 so create_bucket needs no LocationConstraint"""
+        return {**self.boto3_kwargs, "region_name": S3_REGION}
+
+    def bucket(self, name: str) -> str:
+        """This worker's name for bucket `name`, S3 bucket names are shared by every region"""
+        return f"{self.bucket_prefix}{name}"
+
+
+def worker_region(worker_id: str) -> str:
+    """
+    An xdist worker's region from WORKER_REGIONS, us-east-1 for serial runs. Raises a
+    ValueError for workers past the end of the list, which would have to share a region.
+    """
+    if not worker_id.startswith("gw"):
+        return S3_REGION
+    index = int(worker_id[2:])
+    if index >= len(WORKER_REGIONS):
+        raise ValueError(
+            f"managed_moto has a region for {len(WORKER_REGIONS)} xdist workers, "
+            f"{worker_id} would share one with gw{index % len(WORKER_REGIONS)}. "
+            f"Run with -n {len(WORKER_REGIONS)} or fewer."
+        )
+    return WORKER_REGIONS[index]
+
+
+def worker_bucket_prefix(worker_id: str) -> str:
+    """Prefix of an xdist worker's bucket names, gw0 -> "gw0-", and none for serial runs"""
+    if worker_id.startswith("gw"):
+        return f"{worker_id}-"
+    return ""
+
+
+def s3_seed_plan(seed: Union[dict, str, pathlib.Path]) -> Dict[str, Dict[str, str]]:
+    """
+    Resolve a seed into {bucket: {key: local file}}. A seed is one of
+
+     - a directory, whose subdirectories are buckets and the files in them objects, keyed
+       by their path relative to the bucket directory
+     - a JSON or YAML manifest file, or a dict, of {bucket: directory} or
+       {bucket: {key: file}}. Relative paths in a manifest file are relative to it.
+    """
+    base = pathlib.Path.cwd()
+    if not isinstance(seed, dict):
+        path = pathlib.Path(seed)
+        if path.is_dir():
+            seed = {p.name: str(p) for p in sorted(path.iterdir()) if p.is_dir()}
+        elif path.suffix in (".yaml", ".yml"):
+            # PyYAML is only needed by projects with YAML manifests
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    f"Reading {path} needs PyYAML, pip install pyyaml"
+                ) from None
+
+            seed, base = yaml.safe_load(path.read_text()), path.parent
+        else:
+            seed, base = json.loads(path.read_text()), path.parent
+
+    plan = {}
+    for bucket, source in seed.items():
+        if isinstance(source, dict):
+            plan[bucket] = {key: str(base / file) for key, file in source.items()}
+            continue
+        directory = base / source
+        plan[bucket] = {
+            p.relative_to(directory).as_posix(): str(p)
+            for p in sorted(directory.rglob("*"))
+            if p.is_file()
+        }
+    return plan
+
+
+class S3Seeder:
+    """
+    Create buckets on an S3 endpoint and upload local files into them, `concurrency` files
+    at a time. Files over `multipart_threshold` bytes are uploaded in parts, several parts
+    at a time. Needs boto3.
+    """
+
+    def __init__(
+        self,
+        details: MotoDetails,
+        concurrency: int = 16,
+        multipart_threshold: int = 8 * 1024 * 1024,
+    ):
+        # boto3 is only needed by projects seeding S3
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = boto3.client("s3", **details.s3_kwargs)
+        self.concurrency = concurrency
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=4,
+        )
+
+    def apply(self, plan: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
+        """Upload the files of an s3_seed_plan(), return the keys in each bucket"""
+        uploads = [
+            (file, bucket, key)
+            for bucket, objects in plan.items()
+            for key, file in objects.items()
+        ]
+        # Biggest first, so a large file doesn't start last and hold everything up
+        uploads.sort(key=lambda upload: os.path.getsize(upload[0]), reverse=True)
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            for future in [
+                pool.submit(self.client.create_bucket, Bucket=bucket) for bucket in plan
+            ]:
+                future.result()
+            for future in [
+                pool.submit(
+                    self.client.upload_file, *upload, Config=self.transfer_config
+                )
+                for upload in uploads
+            ]:
+                future.result()
+        return {bucket: sorted(objects) for bucket, objects in plan.items()}
+
 
 class MotoServiceManager(ExternalServiceLifecycleManager):
     """
-    Start a dev-mode Vault server or read connection details from a filepath defined
-    by a TEST_VAULT_DETAILS environment variable.
+    Start a Moto server or read connection details from a filepath defined by a
+    TEST_MOTO_DETAILS environment variable.
+
+    One server mocks every AWS service Moto has, loading each on first use. Pass `services`
+    (or set TEST_MOTO_SERVICES=s3,sqs,...) to record which ones the tests use in
+    MotoDetails.services. Moto can only be limited to a single service, so a list of one
+    starts e.g. `moto_server s3`, and longer lists start all of them.
 
-    If this manages the Vault server, the root token id is `root`.
+    xdist workers share the server. Each gets its own region (see worker_region), which
+    keeps apart its resources of regional services (SQS, DynamoDB, ...), and connects with
+    details.boto3_kwargs. S3 has a single bucket namespace, so workers connect to it with
+    details.s3_kwargs (in us-east-1) and name their buckets with details.bucket(name),
+    which adds a per-worker prefix (see worker_bucket_prefix). Moto 3 has no per-account
+    resources, so workers all share its default account.
+
+    With `seed` (a directory or manifest, see s3_seed_plan, default $TEST_MOTO_SEED) the
+    manager uploads the seed's files into buckets of every server it starts, and lists
+    them in MotoDetails.buckets. Other workers find them already there.
 
     `pip install moto[server]` will install moto_server CLI.
     """
@@ -32,33 +223,107 @@ class MotoServiceManager(ExternalServiceLifecycleManager):
     json_state_file_name = "moto.json"
     service_details_class = MotoDetails
 
+    def __init__(
+        self,
+        *args,
+        seed: Union[dict, str, pathlib.Path, None] = None,
+        services: Optional[List[str]] = None,
+        **kwargs,
+    ):
+        if seed:
+            # Not the service of managed_moto without a seed (e.g. prewarmed)
+            kwargs["json_state_file_name"] = (
+                kwargs.get("json_state_file_name") or "moto-seeded.json"
+            )
+        super().__init__(*args, **kwargs)
+        self.seed = seed or os.environ.get(SEED_ENV)
+        if self.seed:
+            # A kept-warm server wouldn't notice changes to the seed's files
+            self.supports_keep_warm = False
+        if services is None:
+            services = [s for s in os.environ.get(SERVICES_ENV, "").split(",") if s]
+        self.services = sorted(services)
+
+    def _warm_kwargs(self) -> dict:
+        return {"services": self.services}
+
+    def _start_ready_service(self) -> Tuple[MotoDetails, mirakuru.Executor]:
+        details, process = super()._start_ready_service()
+        if self.seed:
+            try:
+                with self.timings.phase("ready"):
+                    details.buckets = S3Seeder(details).apply(s3_seed_plan(self.seed))
+            except BaseException:
+                process.stop()
+                raise
+        return details, process
+
     def _start_service(self) -> Tuple[MotoDetails, mirakuru.Executor]:
         hostname = "localhost"
         port = self.unused_tcp_port_factory()
-        details = MotoDetails(hostname=hostname, port=port)
+        details = MotoDetails(hostname=hostname, port=port, services=self.services)
 
-        moto_cmd = f"moto_server --host {hostname} --port {port} s3"
-        process = mirakuru.TCPExecutor(moto_cmd, host=hostname, port=int(port))
+        moto_cmd = f"moto_server --host {hostname} --port {port}"
+        if len(self.services) == 1:
+            moto_cmd += f" {self.services[0]}"
+        process = PumpedTCPExecutor(
+            moto_cmd, host=hostname, port=int(port), name=self.service_name
+        )
         process.start()
         assert process.running()
         return details, process
 
+    def _check_ready(self, service_details: MotoDetails) -> bool:
+        return http_ready(service_details.url)
+
+    def __enter__(self) -> MotoDetails:
+        return dataclasses.replace(
+            super().__enter__(),
+            region=worker_region(self.worker_id),
+            bucket_prefix=worker_bucket_prefix(self.worker_id),
+        )
+
+
+@pytest.fixture(scope="session")
+def managed_moto_seed() -> Union[dict, str, pathlib.Path, None]:
+    """
+    Override to return a directory or manifest (see s3_seed_plan) to upload into the
+    managed_moto server's buckets.
+    """
+    return None
+
 
 @pytest.fixture(scope="session")
 def managed_moto(
     worker_id: str,
     tmp_path_factory: pytest.TempPathFactory,
     unused_tcp_port_factory: Callable[[], int],
+    managed_moto_seed: Union[dict, str, pathlib.Path, None],
 ) -> MotoDetails:
     """
-    Yields connection details for a Moto server.
+    Yields connection details for a Moto server mocking every AWS service (or those in
+    TEST_MOTO_SERVICES), with the buckets of managed_moto_seed (or TEST_MOTO_SEED) uploaded
+    once by the manager worker. Each xdist worker gets its own region and bucket prefix.
 
     boto3 connection example:
-     - client = boto3.client('s3', endpoint_url=moto_details.url)
+     - client = boto3.client('sqs', **moto_details.boto3_kwargs)
+     - client = boto3.client('s3', **moto_details.s3_kwargs)
     """
-    with MotoServiceManager(
+    manager = MotoServiceManager(
         worker_id=worker_id,
         tmp_path_factory=tmp_path_factory,
         unused_tcp_port_factory=unused_tcp_port_factory,
-    ) as moto_details:
+        seed=managed_moto_seed,
+    )
+    if managed_moto_seed:
+        # A service prewarmed after collection was started without this seed
+        service = maybe_lazy(manager)
+    else:
+        service = fixture_service("managed_moto", manager)
+    with service as moto_details:
         yield moto_details
+
+
+register_service_fixture(
+    "managed_moto", MotoServiceManager, configured_by="managed_moto_seed"
+)
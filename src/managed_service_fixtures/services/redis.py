@@ -1,5 +1,8 @@
+import dataclasses
+import os
+import socket
 from dataclasses import dataclass
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
 import mirakuru
 import pytest
@@ -8,16 +11,52 @@ from managed_service_fixtures.base_manager import (
     ExternalServiceLifecycleManager,
     ServiceDetails,
 )
+from managed_service_fixtures.demand import fixture_service, register_service_fixture
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.pool import ServicePool, pool_size
+from managed_service_fixtures.readiness import redis_ping
 
 
 @dataclass
 class RedisDetails(ServiceDetails):
     hostname: str = "localhost"
     port: int = 6379
+    # Logical database, managed_redis hands each xdist worker its own
+    db: int = 0
 
     @property
     def url(self):
-        return f"redis://{self.hostname}:{self.port}"
+        return f"redis://{self.hostname}:{self.port}/{self.db}"
+
+
+def _encode_command(*args: str) -> str:
+    return f"*{len(args)}\r\n" + "".join(f"${len(arg)}\r\n{arg}\r\n" for arg in args)
+
+
+def redis_command(
+    host: str, port: int, *args: str, db: int = 0, timeout: float = 5.0
+) -> bytes:
+    """
+    Send one command to Redis (against logical database `db`) and return the first line of
+    the reply, without needing a Redis client library. Meant for simple admin commands like
+    FLUSHALL or FLUSHDB.
+    """
+    commands = [("SELECT", str(db)), args] if db else [args]
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall("".join(_encode_command(*cmd) for cmd in commands).encode())
+        replies = sock.makefile("rb")
+        for cmd in commands:
+            reply = replies.readline()
+            if reply.startswith(b"-"):
+                raise RuntimeError(f"Redis {cmd[0]} failed: {reply.decode().strip()}")
+    return reply
+
+
+def worker_db(worker_id: str) -> int:
+    """Logical database for an xdist worker, gw0 -> 0, gw1 -> 1, ... and master -> 0"""
+    if worker_id.startswith("gw"):
+        return int(worker_id[2:])
+    return 0
 
 
 class RedisServiceManager(ExternalServiceLifecycleManager):
@@ -26,24 +65,55 @@ class RedisServiceManager(ExternalServiceLifecycleManager):
     by a TEST_REDIS_DETAILS environment variable.
 
     See https://redis.io/topics/quickstart#installing-redis for installing Redis.
+
+    Each xdist worker gets its own logical database on the shared server (see worker_db)
+    so parallel tests don't see each other's keys. The server is started with enough
+    --databases for every worker, at least Redis' default of 16. A server configured from
+    TEST_REDIS_DETAILS may have fewer, so its workers all get the configured `db`.
     """
 
     env_file_pointer = "TEST_REDIS_DETAILS"
     json_state_file_name = "redis.json"
     service_details_class = RedisDetails
 
+    def __init__(self, *args, databases: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set by xdist in every worker process
+        worker_count = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", 1))
+        self.databases = databases or max(16, worker_count)
+
+    def _warm_kwargs(self) -> dict:
+        return {"databases": self.databases}
+
     def _start_service(self) -> Tuple[RedisDetails, mirakuru.Executor]:
         hostname = "localhost"
         port = self.unused_tcp_port_factory()
         details = RedisDetails(hostname=hostname, port=port)
 
-        redis_cmd = f"redis-server --port {port}"
+        redis_cmd = f"redis-server --port {port} --databases {self.databases}"
 
-        process = mirakuru.TCPExecutor(redis_cmd, host=hostname, port=int(port))
+        process = PumpedTCPExecutor(
+            redis_cmd, host=hostname, port=int(port), name=self.service_name
+        )
         process.start()
         assert process.running()
         return details, process
 
+    def _check_ready(self, service_details: RedisDetails) -> bool:
+        return redis_ping(service_details.hostname, service_details.port)
+
+    def _recycle(
+        self, service_details: RedisDetails, process: mirakuru.Executor
+    ) -> bool:
+        redis_command(service_details.hostname, service_details.port, "FLUSHALL")
+        return True
+
+    def __enter__(self) -> RedisDetails:
+        service_details = super().__enter__()
+        if self.configed_from_env:
+            return service_details
+        return dataclasses.replace(service_details, db=worker_db(self.worker_id))
+
 
 @pytest.fixture(scope="session")
 def managed_redis(
@@ -59,12 +129,62 @@ def managed_redis(
     * If env variable TEST_REDIS_DETAILS is set, then it is assumed that it names
     the port number a long-lived instance of Redis is listening on localhost at.
 
-    * Otherwise, a transient service will be created. Currently one per
-        each xdist runner, if running under xdist.
+    * Otherwise, a transient service will be created. One server is shared by all xdist
+        workers, each of them using its own logical database (`db`, included in `url`).
+        Workers using a server from TEST_REDIS_DETAILS share its configured `db`.
+    """
+    with fixture_service(
+        "managed_redis",
+        RedisServiceManager(
+            worker_id=worker_id,
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=unused_tcp_port_factory,
+        ),
+    ) as redis_details:
+        yield redis_details
+
+
+@pytest.fixture(scope="session")
+def managed_redis_pool(
+    worker_id: str,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+) -> ServicePool:
     """
-    with RedisServiceManager(
+    Pool of Redis servers private to this worker, pre-started in the background. Size is
+    set by the MANAGED_SERVICE_FIXTURES_POOL_SIZE env variable (default 2).
+    """
+    manager = RedisServiceManager(
         worker_id=worker_id,
         tmp_path_factory=tmp_path_factory,
         unused_tcp_port_factory=unused_tcp_port_factory,
-    ) as redis_details:
-        yield redis_details
+    )
+    pool = ServicePool(manager, size=pool_size())
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def managed_redis_fresh(managed_redis_pool: ServicePool) -> RedisDetails:
+    """
+    Connection details for an empty Redis server used by this test alone. Servers come
+    from managed_redis_pool and are flushed in the background after the test.
+    """
+    details = managed_redis_pool.checkout()
+    yield details
+    managed_redis_pool.checkin(details)
+
+
+@pytest.fixture
+def managed_redis_flushed(managed_redis: RedisDetails) -> RedisDetails:
+    """
+    managed_redis, with this worker's logical database emptied (FLUSHDB) before the test.
+    """
+    redis_command(
+        managed_redis.hostname, managed_redis.port, "FLUSHDB", db=managed_redis.db
+    )
+    return managed_redis
+
+
+register_service_fixture("managed_redis", RedisServiceManager)
+register_service_fixture("managed_redis_pool", output_name="redis")
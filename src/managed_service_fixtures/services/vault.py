@@ -1,5 +1,11 @@
+import concurrent.futures
+import http.client
+import json
+import os
+import pathlib
+import threading
 from dataclasses import dataclass
-from typing import Callable, Tuple
+from typing import Callable, List, Optional, Tuple, Union
 
 import mirakuru
 import pytest
@@ -8,6 +14,11 @@ from managed_service_fixtures.base_manager import (
     ExternalServiceLifecycleManager,
     ServiceDetails,
 )
+from managed_service_fixtures.demand import fixture_service, register_service_fixture
+from managed_service_fixtures.lazy import maybe_lazy
+from managed_service_fixtures.logpump import PumpedTCPExecutor
+from managed_service_fixtures.pool import ServicePool, pool_size
+from managed_service_fixtures.readiness import http_ready
 
 
 @dataclass
@@ -21,6 +32,134 @@ class VaultDetails(ServiceDetails):
         return f"http://{self.hostname}:{self.port}"
 
 
+SEED_ENV = "TEST_VAULT_SEED"
+
+
+def load_seed(seed: Union[dict, str, pathlib.Path, None]) -> Optional[dict]:
+    """A seed spec as a dict, read from a JSON or YAML file if given a path"""
+    if seed is None or isinstance(seed, dict):
+        return seed
+    path = pathlib.Path(seed)
+    if path.suffix in (".yaml", ".yml"):
+        # PyYAML is only needed by projects with YAML seed files
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError(
+                f"Reading {path} needs PyYAML, pip install pyyaml"
+            ) from None
+
+        return yaml.safe_load(path.read_text())
+    return json.loads(path.read_text())
+
+
+class VaultSeeder:
+    """
+    Apply a seed spec to a Vault server, with up to `concurrency` requests in flight over
+    keep-alive connections (one per thread). The spec has up to five sections:
+
+        mounts:     {path: body of POST /v1/sys/mounts/<path>}, e.g. {"type": "kv"}
+        auth:       {path: body of POST /v1/sys/auth/<path>}, e.g. {"type": "approle"}
+        policies:   {name: HCL policy text}
+        secrets:    {path: data}, written as kv-v2 or kv-v1 depending on the mount
+        writes:     {path: body}, any other POST /v1/<path>, e.g. approle roles
+
+    mounts and auth are enabled first, everything else is written after them.
+    """
+
+    def __init__(self, details: VaultDetails, concurrency: int = 16):
+        self.details = details
+        self.concurrency = concurrency
+        self._local = threading.local()
+        self._connections: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self, fresh: bool = False) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or fresh:
+            conn = http.client.HTTPConnection(
+                self.details.hostname, self.details.port, timeout=30
+            )
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        payload = json.dumps(body) if body is not None else None
+        headers = {
+            "X-Vault-Token": self.details.token,
+            "Content-Type": "application/json",
+        }
+        try:
+            conn = self._connection()
+            conn.request(method, f"/v1/{path}", body=payload, headers=headers)
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError):
+            # The server closed an idle keep-alive connection
+            conn = self._connection(fresh=True)
+            conn.request(method, f"/v1/{path}", body=payload, headers=headers)
+            resp = conn.getresponse()
+        data = resp.read()
+        if resp.status >= 400:
+            raise RuntimeError(
+                f"Vault seed {method} /v1/{path} failed with {resp.status}: {data.decode()}"
+            )
+        return json.loads(data) if data else {}
+
+    def _secret_request(self, path: str, data: dict, mounts: dict) -> Tuple:
+        path = path.strip("/")
+        mount = max(
+            (m for m in mounts if f"{path}/".startswith(m)), key=len, default=None
+        )
+        options = (mounts.get(mount) or {}).get("options") or {}
+        if mount and options.get("version") == "2":
+            return ("POST", f"{mount}data/{path[len(mount):]}", {"data": data})
+        return ("POST", path, data)
+
+    def apply(self, spec: dict) -> None:
+        enable = [
+            ("POST", f"sys/mounts/{path}", body)
+            for path, body in spec.get("mounts", {}).items()
+        ]
+        enable += [
+            ("POST", f"sys/auth/{path}", body)
+            for path, body in spec.get("auth", {}).items()
+        ]
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+
+                def run(requests: list) -> None:
+                    for future in [pool.submit(self.request, *r) for r in requests]:
+                        future.result()
+
+                run(enable)
+                mounts = {}
+                if spec.get("secrets"):
+                    response = self.request("GET", "sys/mounts")
+                    mounts = response.get("data", response)
+                write = [
+                    ("PUT", f"sys/policies/acl/{name}", {"policy": policy})
+                    for name, policy in spec.get("policies", {}).items()
+                ]
+                write += [
+                    self._secret_request(path, data, mounts)
+                    for path, data in spec.get("secrets", {}).items()
+                ]
+                write += [
+                    ("POST", path.strip("/"), body)
+                    for path, body in spec.get("writes", {}).items()
+                ]
+                run(write)
+        finally:
+            # Also when a request failed, or the threads' connections are left open
+            with self._lock:
+                for conn in self._connections:
+                    conn.close()
+                self._connections.clear()
+            self._local = threading.local()
+
+
 class VaultManager(ExternalServiceLifecycleManager):
     """
     Start a dev-mode Vault server or read connection details from a filepath defined
@@ -28,6 +167,10 @@ class VaultManager(ExternalServiceLifecycleManager):
 
     If this manages the Vault server, the root token id is `root`.
 
+    With `seed` (a VaultSeeder spec, or the path of a JSON or YAML file with one, default
+    $TEST_VAULT_SEED) the manager applies the spec to every server it starts, right after
+    it's ready. Other workers find it provisioned. Externally managed servers aren't seeded.
+
     See https://www.vaultproject.io/docs/install for installing Vault.
     """
 
@@ -35,6 +178,34 @@ class VaultManager(ExternalServiceLifecycleManager):
     json_state_file_name = "vault.json"
     service_details_class = VaultDetails
 
+    def __init__(
+        self,
+        *args,
+        seed: Union[dict, str, pathlib.Path, None] = None,
+        **kwargs,
+    ):
+        if seed:
+            # Not the service of managed_vault without a seed (e.g. prewarmed)
+            kwargs["json_state_file_name"] = (
+                kwargs.get("json_state_file_name") or "vault-seeded.json"
+            )
+        super().__init__(*args, **kwargs)
+        self.seed = load_seed(seed or os.environ.get(SEED_ENV))
+
+    def _warm_kwargs(self) -> dict:
+        return {"seed": self.seed} if self.seed else {}
+
+    def _start_ready_service(self) -> Tuple[VaultDetails, mirakuru.Executor]:
+        details, process = super()._start_ready_service()
+        if self.seed:
+            try:
+                with self.timings.phase("ready"):
+                    VaultSeeder(details).apply(self.seed)
+            except BaseException:
+                process.stop()
+                raise
+        return details, process
+
     def _start_service(self) -> Tuple[VaultDetails, mirakuru.Executor]:
         hostname = "localhost"
         port = self.unused_tcp_port_factory()
@@ -43,27 +214,91 @@ class VaultManager(ExternalServiceLifecycleManager):
 
         vault_cmd = f"vault server -dev -dev-listen-address={hostname}:{port} -dev-root-token-id=root"
 
-        process = mirakuru.TCPExecutor(vault_cmd, host=hostname, port=int(port))
+        process = PumpedTCPExecutor(
+            vault_cmd, host=hostname, port=int(port), name=self.service_name
+        )
         process.start()
         assert process.running()
         return details, process
 
+    def _check_ready(self, service_details: VaultDetails) -> bool:
+        # 200 only once Vault is initialized, unsealed and active
+        return http_ready(f"{service_details.url}/v1/sys/health", max_status=200)
+
+
+@pytest.fixture(scope="session")
+def managed_vault_seed() -> Union[dict, str, pathlib.Path, None]:
+    """
+    Override to return a seed spec (see VaultSeeder), or the path of a JSON or YAML file
+    with one, and managed_vault / managed_vault_fresh servers are provisioned with it.
+    """
+    return None
+
 
 @pytest.fixture(scope="session")
 def managed_vault(
     worker_id: str,
     tmp_path_factory: pytest.TempPathFactory,
     unused_tcp_port_factory: Callable[[], int],
+    managed_vault_seed: Union[dict, str, pathlib.Path, None],
 ) -> VaultDetails:
     """
-    Yields connection details for a Vault server.
+    Yields connection details for a Vault server, seeded by the manager worker if
+    managed_vault_seed is overridden (or TEST_VAULT_SEED is set).
 
     hvac.py connection example:
      - client = hvac.Client(url=vault_details.url, token=vault_details.token)
     """
-    with VaultManager(
+    manager = VaultManager(
         worker_id=worker_id,
         tmp_path_factory=tmp_path_factory,
         unused_tcp_port_factory=unused_tcp_port_factory,
-    ) as vault_details:
+        seed=managed_vault_seed,
+    )
+    if managed_vault_seed:
+        # A service prewarmed after collection was started without this seed
+        service = maybe_lazy(manager)
+    else:
+        service = fixture_service("managed_vault", manager)
+    with service as vault_details:
         yield vault_details
+
+
+@pytest.fixture(scope="session")
+def managed_vault_pool(
+    worker_id: str,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+    managed_vault_seed: Union[dict, str, pathlib.Path, None],
+) -> ServicePool:
+    """
+    Pool of dev-mode Vault servers private to this worker, pre-started (and seeded) in the
+    background. Size is set by the MANAGED_SERVICE_FIXTURES_POOL_SIZE env variable
+    (default 2).
+    """
+    manager = VaultManager(
+        worker_id=worker_id,
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        seed=managed_vault_seed,
+    )
+    pool = ServicePool(manager, size=pool_size())
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def managed_vault_fresh(managed_vault_pool: ServicePool) -> VaultDetails:
+    """
+    Connection details for a Vault server used by this test alone. Dev-mode Vault keeps
+    everything in memory, so used servers are restarted in the background after the test.
+    """
+    details = managed_vault_pool.checkout()
+    yield details
+    managed_vault_pool.checkin(details)
+
+
+register_service_fixture(
+    "managed_vault", VaultManager, configured_by="managed_vault_seed"
+)
+register_service_fixture("managed_vault_pool", output_name="vault")
@@ -0,0 +1,73 @@
+"""
+Monotonic timings of each phase of a managed service's lifecycle.
+
+Every ExternalServiceLifecycleManager fills in a LifecycleTimings and records it when it
+exits. The pytest plugin (plugin.py) gathers the recorded timings from every xdist worker
+and prints them as a summary table at the end of the session, or writes them to JSON.
+
+Phases:
+ - lock: registering and unregistering in the state registry, including waiting on its lock
+   (enter and exit combined)
+ - start: _start_service, or attaching to a kept-warm service
+ - ready: waiting for _check_ready to pass
+ - wait_workers: the manager worker waiting in __exit__ for other workers to unregister
+ - stop: stopping the process, or releasing a kept-warm service
+"""
+import contextlib
+import dataclasses
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List
+
+PHASES = ("lock", "start", "ready", "wait_workers", "stop")
+
+_recorded: List["LifecycleTimings"] = []
+
+
+@dataclass
+class LifecycleTimings:
+    service: str
+    worker_id: str
+    # serial, manager, worker or external (connection details read from env)
+    role: str = "serial"
+    phases: Dict[str, float] = field(default_factory=dict)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+
+def record(timings: LifecycleTimings) -> None:
+    _recorded.append(timings)
+
+
+def recorded() -> List[dict]:
+    """Timings recorded in this process, as plain dicts so xdist can ship them around"""
+    return [dataclasses.asdict(timings) for timings in _recorded]
+
+
+def format_table(entries: List[dict]) -> List[str]:
+    header = ["service", "worker", "role", *PHASES, "total"]
+    rows = []
+    for entry in sorted(entries, key=lambda e: (e["service"], e["worker_id"])):
+        phases = entry["phases"]
+        rows.append(
+            [
+                entry["service"],
+                entry["worker_id"],
+                entry["role"],
+                *(f"{phases[p]:.3f}" if p in phases else "-" for p in PHASES),
+                f"{sum(phases.values()):.3f}",
+            ]
+        )
+    widths = [
+        max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))
+    ]
+    return [
+        "  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [header, *rows]
+    ]
@@ -0,0 +1,219 @@
+"""
+Opt-in "keep-warm" mode, services outlive the pytest run that started them and get re-used
+by later runs.
+
+Set MANAGED_SERVICE_FIXTURES_KEEP_WARM=1 to enable it. Instead of calling _start_service in
+the pytest process (where mirakuru kills the service at interpreter exit), the manager asks a
+small detached broker process to start it. The broker writes nothing but a record file in
+the warm directory (readable only by its owner, connection details can hold credentials), keeps the service running while any pytest process holds a lease on
+it, and stops it once it has been idle for MANAGED_SERVICE_FIXTURES_WARM_TTL seconds.
+
+The next run finds the record, health-checks the service, takes a lease and returns the
+connection details without starting anything.
+
+This is the same idea as scripts/run_test_services.py and LoggingTCPExecutor, except the
+fixtures start and discover the long-lived services on their own.
+
+The broker and a small CLI to inspect kept-warm services live in warm_daemon.py:
+
+    python -m managed_service_fixtures.warm_daemon list   # show kept-warm services
+    python -m managed_service_fixtures.warm_daemon stop   # stop all of them
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING, List
+
+from filelock import FileLock
+
+if TYPE_CHECKING:
+    from managed_service_fixtures.base_manager import (
+        ExternalServiceLifecycleManager,
+        ServiceDetails,
+    )
+
+logger = logging.getLogger(__name__)
+
+KEEP_WARM_ENV = "MANAGED_SERVICE_FIXTURES_KEEP_WARM"
+WARM_TTL_ENV = "MANAGED_SERVICE_FIXTURES_WARM_TTL"
+WARM_DIR_ENV = "MANAGED_SERVICE_FIXTURES_WARM_DIR"
+
+DEFAULT_TTL = 15 * 60
+
+
+def keep_warm_enabled() -> bool:
+    return os.environ.get(KEEP_WARM_ENV, "").lower() in ("1", "true", "yes", "on")
+
+
+def warm_ttl() -> float:
+    return float(os.environ.get(WARM_TTL_ENV, DEFAULT_TTL))
+
+
+def warm_dir() -> pathlib.Path:
+    if os.environ.get(WARM_DIR_ENV):
+        path = pathlib.Path(os.environ[WARM_DIR_ENV])
+    else:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+        path = pathlib.Path(cache_home) / "managed-service-fixtures" / "warm"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but owned by someone else
+        return True
+    return True
+
+
+def write_private(path: pathlib.Path, text: str) -> None:
+    """Write a file only its owner can read, kept-warm services' details hold credentials"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode only applies to new files, not to records written by older versions
+    os.fchmod(fd, 0o600)
+    with open(fd, "w") as f:
+        f.write(text)
+
+
+def port_open(host: str, port: int, timeout: float = 1.0) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class WarmServiceLease:
+    """
+    Client side of keep-warm mode, used by ExternalServiceLifecycleManager in place of
+    calling _start_service / stopping the mirakuru process itself.
+
+    Instances are only compatible with managers of the same class constructed with the
+    same keep-warm kwargs (see ExternalServiceLifecycleManager._warm_kwargs).
+    """
+
+    def __init__(self, manager: "ExternalServiceLifecycleManager"):
+        self.manager = manager
+        manager_cls = type(manager)
+        self.manager_path = f"{manager_cls.__module__}:{manager_cls.__qualname__}"
+        self.kwargs = manager._warm_kwargs()
+        key = json.dumps([self.manager_path, self.kwargs], sort_keys=True)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        self.record_path = warm_dir() / f"{manager_cls.__name__}-{digest}.json"
+        self.lock_path = pathlib.Path(str(self.record_path) + ".lock")
+        self.log_path = self.record_path.with_suffix(".log")
+        # Not .json, that would make it a record to warm_records
+        self.kwargs_path = self.record_path.with_suffix(".kwargs")
+
+    def _healthy(self, record: dict) -> bool:
+        if not pid_alive(record["broker_pid"]):
+            return False
+        if not port_open(record["host"], record["port"]):
+            return False
+        details = self.manager.service_details_class(**record["details"])
+        return self.manager._check_ready(details)
+
+    def acquire(self) -> "ServiceDetails":
+        with FileLock(self.lock_path):
+            record = None
+            if self.record_path.is_file():
+                record = json.loads(self.record_path.read_text())
+                if not self._healthy(record):
+                    logger.warning(
+                        f"Evicting unhealthy kept-warm service {self.record_path.name}"
+                    )
+                    stop_broker(record)
+                    record = None
+
+            if record is None:
+                record = self._spawn_broker()
+            else:
+                logger.info(f"Re-using kept-warm service {self.record_path.name}")
+
+            record["leases"] = [pid for pid in record["leases"] if pid_alive(pid)]
+            record["leases"].append(os.getpid())
+            write_private(self.record_path, json.dumps(record))
+
+        return self.manager.service_details_class(**record["details"])
+
+    def release(self) -> None:
+        with FileLock(self.lock_path):
+            if not self.record_path.is_file():
+                return
+            record = json.loads(self.record_path.read_text())
+            with contextlib.suppress(ValueError):
+                record["leases"].remove(os.getpid())
+            record["last_used"] = time.time()
+            write_private(self.record_path, json.dumps(record))
+
+    def _spawn_broker(self) -> dict:
+        """
+        Start a detached broker and block until it reports the service is up. Called while
+        holding the record lock, so the broker itself never writes the record at startup.
+
+        The kwargs go in a file the broker reads and removes, seeds in them can be too
+        large for the command line and may hold secrets that shouldn't show up in `ps`.
+        """
+        write_private(self.kwargs_path, json.dumps(self.kwargs))
+        cmd = [
+            sys.executable,
+            "-m",
+            "managed_service_fixtures.warm_daemon",
+            "serve",
+            "--manager",
+            self.manager_path,
+            "--kwargs-file",
+            str(self.kwargs_path),
+            "--record",
+            str(self.record_path),
+            "--ttl",
+            str(warm_ttl()),
+        ]
+        with self.log_path.open("ab") as log_file:
+            broker = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=log_file,
+                start_new_session=True,
+            )
+        with broker.stdout:
+            line = broker.stdout.readline()
+        if not line:
+            broker.wait()
+            self.kwargs_path.unlink(missing_ok=True)
+            raise RuntimeError(
+                f"Keep-warm broker for {self.manager_path} exited with {broker.returncode}, see {self.log_path}"
+            )
+        started = json.loads(line)
+        return {
+            "manager": self.manager_path,
+            "broker_pid": broker.pid,
+            "host": started["host"],
+            "port": started["port"],
+            "details": started["details"],
+            "leases": [],
+            "last_used": time.time(),
+        }
+
+
+def stop_broker(record: dict) -> None:
+    if pid_alive(record["broker_pid"]):
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(record["broker_pid"], signal.SIGTERM)
+
+
+def warm_records() -> List[pathlib.Path]:
+    return sorted(warm_dir().glob("*.json"))
@@ -0,0 +1,132 @@
+"""
+Keep-warm broker process and a CLI for inspecting kept-warm services, see warm.py.
+
+The broker is started by WarmServiceLease, it is not meant to be run by hand.
+"""
+import dataclasses
+import importlib
+import json
+import logging
+import os
+import pathlib
+import signal
+import sys
+import time
+from typing import Optional
+
+import click
+from filelock import FileLock
+
+from managed_service_fixtures.run_service_executor import find_free_port
+from managed_service_fixtures.warm import (
+    DEFAULT_TTL,
+    pid_alive,
+    stop_broker,
+    warm_records,
+    write_private,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def serve(manager_path: str, kwargs: dict, record_path: pathlib.Path, ttl: float):
+    module_name, _, cls_name = manager_path.partition(":")
+    manager_cls = getattr(importlib.import_module(module_name), cls_name)
+    manager = manager_cls(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+        **kwargs,
+    )
+    service_details, process = manager._start_ready_service()
+    manager.mirakuru_process = process
+
+    def _terminate(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _terminate)
+    lock_path = pathlib.Path(str(record_path) + ".lock")
+    check_interval = min(max(ttl / 4, 1), 30)
+    try:
+        details = dataclasses.asdict(service_details)
+        details.pop("is_manager")
+        details.pop("sessions")
+        started = {"host": process.host, "port": process.port, "details": details}
+        sys.stdout.write(json.dumps(started) + "\n")
+        sys.stdout.flush()
+        sys.stdout.close()
+
+        while True:
+            time.sleep(check_interval)
+            if not process.running():
+                logger.warning(f"{manager_path} service exited on its own")
+                break
+            with FileLock(lock_path):
+                if not record_path.is_file():
+                    break
+                record = json.loads(record_path.read_text())
+                if record["broker_pid"] != os.getpid():
+                    # Someone evicted us and started a replacement
+                    break
+                record["leases"] = [pid for pid in record["leases"] if pid_alive(pid)]
+                idle_for = time.time() - record["last_used"]
+                if not record["leases"] and idle_for > ttl:
+                    logger.info(f"{manager_path} idle for {idle_for:.0f}s, stopping")
+                    record_path.unlink()
+                    break
+                write_private(record_path, json.dumps(record))
+    finally:
+        manager._release_service()
+        with FileLock(lock_path):
+            if record_path.is_file():
+                record = json.loads(record_path.read_text())
+                if record["broker_pid"] == os.getpid():
+                    record_path.unlink()
+
+
+@click.group()
+def cli():
+    logging.basicConfig(level=logging.INFO)
+
+
+@cli.command("serve")
+@click.option("--manager", "manager_path", required=True)
+@click.option("--kwargs-file", "kwargs_path", default=None, type=click.Path())
+@click.option("--record", "record_path", required=True, type=click.Path())
+@click.option("--ttl", default=DEFAULT_TTL, type=float)
+def serve_command(
+    manager_path: str, kwargs_path: Optional[str], record_path: str, ttl: float
+):
+    """Run a kept-warm service, started by the fixtures, not meant to be run by hand."""
+    kwargs = {}
+    if kwargs_path:
+        # Written for us alone by WarmServiceLease, it may hold secrets from seeds
+        kwargs_file = pathlib.Path(kwargs_path)
+        kwargs = json.loads(kwargs_file.read_text())
+        kwargs_file.unlink()
+    serve(manager_path, kwargs, pathlib.Path(record_path), ttl)
+
+
+@cli.command("list")
+def list_command():
+    """Show kept-warm services."""
+    for record_path in warm_records():
+        record = json.loads(record_path.read_text())
+        idle_for = time.time() - record["last_used"]
+        click.echo(
+            f"{record['manager']} {record['host']}:{record['port']} "
+            f"broker_pid={record['broker_pid']} leases={record['leases']} idle={idle_for:.0f}s"
+        )
+
+
+@cli.command("stop")
+def stop_command():
+    """Stop every kept-warm service."""
+    for record_path in warm_records():
+        record = json.loads(record_path.read_text())
+        click.echo(f"Stopping {record['manager']} (broker_pid={record['broker_pid']})")
+        stop_broker(record)
+
+
+if __name__ == "__main__":
+    cli()
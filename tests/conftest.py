@@ -1 +1 @@
-pytest_plugins = "managed_service_fixtures"
+pytest_plugins = ["managed_service_fixtures", "pytester"]
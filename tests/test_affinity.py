@@ -0,0 +1,96 @@
+import re
+from typing import Dict, Set
+
+import pytest
+
+MODULE = """
+def test_a(managed_moto):
+    pass
+
+def test_b(managed_moto):
+    pass
+
+def test_c():
+    pass
+"""
+
+
+@pytest.fixture
+def suite(pytester):
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(test_one=MODULE, test_two=MODULE, test_three=MODULE)
+    return pytester
+
+
+def test_service_tests_share_one_worker(suite):
+    result = suite.runpytest_subprocess(
+        "-p", "no:cacheprovider", "-n", "3", "--service-workers", "1"
+    )
+    result.assert_outcomes(passed=9)
+    # Every test using moto ran on the same worker
+    result.stdout.fnmatch_lines(
+        ["*managed service demand*", "gw?: managed_moto (6 tests)"]
+    )
+
+
+def test_service_tests_spread_over_workers(suite):
+    result = suite.runpytest_subprocess(
+        "-p", "no:cacheprovider", "-n", "3", "--service-workers", "3", "-v"
+    )
+    result.assert_outcomes(passed=9)
+    # One group per module, tests of a module stay together
+    for module in ("one", "two", "three"):
+        result.stdout.fnmatch_lines(
+            [f"*test_{module}.py::test_a@managed-managed_moto-? *"]
+        )
+
+
+def test_incompatible_dist_mode(suite):
+    result = suite.runpytest_subprocess(
+        "-p",
+        "no:cacheprovider",
+        "-n",
+        "2",
+        "--dist",
+        "loadfile",
+        "--service-workers",
+        "1",
+    )
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*--service-workers needs --dist loadgroup*"])
+
+
+def test_each_service_on_at_most_n_workers(pytester, monkeypatch):
+    # Lazy fixtures never start their service unless a test touches it
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_LAZY", "1")
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    combinations = {
+        "crdb": "managed_cockroach",
+        "crdb_redis": "managed_cockroach, managed_redis",
+        "crdb_moto": "managed_cockroach, managed_moto",
+        "redis": "managed_redis",
+        "moto": "managed_moto",
+    }
+    pytester.makepyfile(
+        **{
+            f"test_{name}_{i}": "".join(
+                f"def test_{n}({fixtures}):\n    pass\n" for n in range(3)
+            )
+            for name, fixtures in combinations.items()
+            for i in range(3)
+        }
+    )
+    result = pytester.runpytest_subprocess(
+        "-p", "no:cacheprovider", "-n", "4", "--service-workers", "2", "-v"
+    )
+    result.assert_outcomes(passed=45)
+
+    workers: Dict[str, Set[str]] = {}
+    for line in result.stdout.lines:
+        match = re.search(r"\[(gw\d+)\].* test_(\w+)_\d\.py::", line)
+        if match:
+            for service in match.group(2).split("_"):
+                workers.setdefault(service, set()).add(match.group(1))
+    assert sorted(workers) == ["crdb", "moto", "redis"]
+    for service, used_by in workers.items():
+        assert len(used_by) <= 2, f"{service} ran on {sorted(used_by)}"
@@ -1,3 +1,6 @@
+import asyncio
+import os
+import threading
 from typing import Callable
 
 import httpx
@@ -5,8 +8,8 @@ import pytest
 import websockets
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
-from managed_service_fixtures import AppDetails
-from managed_service_fixtures.services.asgi_app import AppManager
+from managed_service_fixtures import AppDetails, find_free_port
+from managed_service_fixtures.services.asgi_app import AppManager, InProcessServer
 
 app = FastAPI()
 
@@ -16,6 +19,11 @@ async def index():
     return {"Hello": "World"}
 
 
+@app.get("/pid")
+async def pid():
+    return {"pid": os.getpid(), "ppid": os.getppid()}
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -50,6 +58,93 @@ async def test_ws(fastapi_app: AppDetails):
         await websocket.close()
 
 
+def test_replicas_behind_proxy(managed_asgi_app_factory: Callable[..., AppManager]):
+    with managed_asgi_app_factory(
+        "tests.test_asgi_app:app",
+        json_state_file_name="asgi-replicas.json",
+        replicas=2,
+        proxy=True,
+    ) as app_details:
+        assert len(app_details.urls) == 2
+        replica_pids = {
+            httpx.get(url + "/pid").json()["pid"] for url in app_details.urls
+        }
+        assert len(replica_pids) == 2
+        # A new connection per request, each goes to the next replica
+        proxied_pids = {
+            httpx.get(app_details.proxy_url + "/pid").json()["pid"] for _ in range(4)
+        }
+        assert proxied_pids == replica_pids
+
+
+async def test_ws_through_proxy(managed_asgi_app_factory: Callable[..., AppManager]):
+    with managed_asgi_app_factory(
+        "tests.test_asgi_app:app",
+        json_state_file_name="asgi-proxy.json",
+        proxy=True,
+    ) as app_details:
+        proxy_ws = app_details.proxy_url.replace("http://", "ws://")
+        async with websockets.connect(proxy_ws + "/ws") as websocket:
+            await websocket.send("Hello")
+            assert await websocket.recv() == "echo: Hello"
+
+
+def test_in_process_app(managed_asgi_app_factory: Callable[..., AppManager]):
+    with managed_asgi_app_factory(
+        "tests.test_asgi_app:app",
+        json_state_file_name="asgi-thread.json",
+        mode="thread",
+    ) as app_details:
+        # Served by this very process, no subprocess involved
+        assert httpx.get(app_details.url + "/pid").json()["pid"] == os.getpid()
+
+
+def test_in_process_app_failing_startup():
+    async def lifespan(app):
+        raise RuntimeError("no database")
+        yield
+
+    server = InProcessServer(FastAPI(lifespan=lifespan), "localhost", find_free_port())
+    with pytest.raises(RuntimeError, match="exited before serving"):
+        server.start()
+    assert not server.running()
+
+
+def test_in_process_app_stuck_startup():
+    stuck = threading.Event()
+
+    async def lifespan(app):
+        while not stuck.is_set():
+            await asyncio.sleep(0.01)
+        yield
+
+    server = InProcessServer(
+        FastAPI(lifespan=lifespan), "localhost", find_free_port(), timeout=0.5
+    )
+    try:
+        with pytest.raises(TimeoutError, match="lifespan startup stuck"):
+            server.start()
+    finally:
+        stuck.set()
+        server.thread.join(timeout=5)
+    # Told to exit once its startup got done
+    assert not server.running()
+
+
+def test_forkserver_apps(managed_asgi_app_factory: Callable[..., AppManager]):
+    with managed_asgi_app_factory(
+        "tests.test_asgi_app:app",
+        json_state_file_name="asgi-forkserver.json",
+        mode="forkserver",
+        replicas=2,
+    ) as app_details:
+        pids = [httpx.get(url + "/pid").json() for url in app_details.urls]
+        # Two app processes forked from the same (not this) process
+        assert len({p["pid"] for p in pids}) == 2
+        assert len({p["ppid"] for p in pids}) == 1
+        assert os.getpid() not in {p["ppid"] for p in pids}
+
+
 # Whereas you would get breakpoint/debug support in this setup
 @pytest.fixture
 async def client():
@@ -0,0 +1,52 @@
+import asyncio
+import contextlib
+import threading
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures.services.asgi_app import AppManager
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+class RecordingMotoManager(MotoServiceManager):
+    def __enter__(self):
+        self.entered_on = threading.current_thread().name
+        return super().__enter__()
+
+
+async def test_async_managers_start_concurrently_without_blocking_the_loop(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    # worker_id="master" keeps these instances independent of any xdist state files
+    kwargs = dict(
+        worker_id="master",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+    )
+    moto = RecordingMotoManager(**kwargs)
+    app = AppManager("tests.test_asgi_app:app", **kwargs)
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.ensure_future(ticker())
+    async with contextlib.AsyncExitStack() as stack:
+        moto_details, app_details = await asyncio.gather(
+            stack.enter_async_context(moto), stack.enter_async_context(app)
+        )
+        # The loop kept running while both services were booting
+        assert ticks > 10
+        # On a thread of its own executor, not of the loop's default one
+        assert moto.entered_on.startswith("managed-service-lifecycle")
+        async with httpx.AsyncClient() as client:
+            assert (await client.get(moto_details.url)).status_code == 200
+            assert (await client.get(app_details.url)).json() == {"Hello": "World"}
+    ticking.cancel()
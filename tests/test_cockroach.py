@@ -1,9 +1,27 @@
+import dataclasses
+import json
+import os
+import tempfile
+from typing import Callable
+
 import pytest
 import sqlalchemy as sa
 import sqlalchemy.orm
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
-from managed_service_fixtures import CockroachDetails
+from managed_service_fixtures import (
+    CockroachDetails,
+    CockroachMigrations,
+    CockroachProfile,
+)
+from managed_service_fixtures.ports import PortTaken
+from managed_service_fixtures.services.cockroach import (
+    COCKROACH_PROFILES,
+    CockroachManager,
+    cockroach_profile,
+    execute_sql,
+)
+from managed_service_fixtures.warm import keep_warm_enabled, stop_broker
 
 
 @sa.orm.as_declarative()
@@ -26,12 +44,68 @@ class Todo(Base):
 
 @pytest.fixture(scope="session", autouse=True)
 def configure_db(managed_cockroach: CockroachDetails):
-    if managed_cockroach.is_manager:
-        engine = sa.create_engine(managed_cockroach.sync_dsn, echo=True)
-        Base.metadata.create_all(engine)
-        yield
-        # Base.metadata.drop_all(engine)
-        engine.dispose()
+    # Every xdist worker has its own database, so every worker creates the schema
+    engine = sa.create_engine(managed_cockroach.sync_dsn, echo=True)
+    Base.metadata.create_all(engine)
+    yield
+    engine.dispose()
+
+
+def test_per_worker_database(managed_cockroach: CockroachDetails, worker_id: str):
+    if keep_warm_enabled():
+        assert managed_cockroach.dbname == f"test_{worker_id}_{os.getpid()}"
+    else:
+        assert managed_cockroach.dbname == f"test_{worker_id}"
+
+
+def test_kept_warm_node_databases_are_per_run(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    # Concurrent runs share the node and have workers of the same names
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_KEEP_WARM", "1")
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_WARM_DIR", str(tmp_path / "warm"))
+    try:
+        with CockroachManager(
+            worker_id="master",
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=unused_tcp_port_factory,
+            json_state_file_name="cockroach-warm.json",
+        ) as details:
+            assert details.dbname == f"test_master_{os.getpid()}"
+            other_run = dataclasses.replace(details, dbname="defaultdb")
+            execute_sql(other_run, "CREATE DATABASE test_master")
+        databases = execute_sql(
+            other_run, "SELECT database_name FROM [SHOW DATABASES]"
+        ).split()
+        assert "test_master" in databases
+        assert details.dbname not in databases
+    finally:
+        for record_path in (tmp_path / "warm").glob("*.json"):
+            stop_broker(json.loads(record_path.read_text()))
+
+
+def test_env_cluster_database_is_untouched(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    details_file = tmp_path / "crdb.json"
+    details_file.write_text(json.dumps({"hostname": "crdb.example", "dbname": "app"}))
+    monkeypatch.setenv("TEST_CRDB_DETAILS", str(details_file))
+    # Nothing to reach, any SQL would fail
+    monkeypatch.setenv("PATH", "")
+    with CockroachManager(
+        worker_id="gw1",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        json_state_file_name="cockroachdb-env.json",
+    ) as details:
+        assert details.hostname == "crdb.example"
+        assert details.dbname == "app"
 
 
 async def test_cockroach(managed_cockroach: CockroachDetails):
@@ -55,3 +129,121 @@ async def test_cockroach(managed_cockroach: CockroachDetails):
 
     assert user.name == "test-user"
     assert user.todos[0].title == "test-todo"
+
+
+@pytest.mark.parametrize("name", ["first", "second"])
+def test_fresh_database_per_test(managed_cockroach_fresh: CockroachDetails, name: str):
+    # Restored from the snapshot taken after configure_db, so the tables exist but
+    # rows written by other tests don't
+    engine = sa.create_engine(managed_cockroach_fresh.sync_dsn)
+    with sa.orm.Session(engine) as session:
+        assert session.query(User).count() == 0
+        session.add(User(name=name))
+        session.commit()
+        assert session.query(User).count() == 1
+    engine.dispose()
+
+
+def test_failed_starts_remove_their_directories(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    manager = CockroachManager(
+        worker_id="master",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+    )
+
+    def lose_port(store_flags):
+        raise PortTaken("somebody else's")
+
+    monkeypatch.setattr(manager, "_start_node", lose_port)
+    with pytest.raises(PortTaken):
+        manager._start_ready_service()
+    assert not list(tmp_path.iterdir())
+
+
+def test_failed_migrations_leave_nothing_behind(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    monkeypatch.setenv("TEST_CRDB_STORE_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    (tmp_path / "tmp").mkdir()
+
+    def migrate(details: CockroachDetails):
+        raise RuntimeError("bad migration")
+
+    manager = CockroachManager(
+        worker_id="master",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        migrations=CockroachMigrations(migrate=migrate, version="broken"),
+    )
+    with pytest.raises(RuntimeError, match="bad migration"):
+        manager._start_ready_service()
+    assert not list((tmp_path / "tmp").iterdir())
+    assert [p.suffix for p in (tmp_path / "cache").iterdir()] == [".lock"]
+
+
+def test_resource_profile(managed_cockroach: CockroachDetails):
+    profile = cockroach_profile()
+    assert managed_cockroach.store_size == profile.store_size
+    assert managed_cockroach.max_sql_memory == profile.max_sql_memory
+
+
+def test_cockroach_profile_selection(monkeypatch):
+    monkeypatch.delenv("TEST_CRDB_PROFILE", raising=False)
+    assert cockroach_profile() == COCKROACH_PROFILES["default"]
+    monkeypatch.setenv("TEST_CRDB_PROFILE", "small")
+    assert cockroach_profile().flags == (
+        "--store=type=mem,size=641mib --cache=64mib --max-sql-memory=128mib"
+    )
+    assert cockroach_profile({"store_size": "1gib"}) == CockroachProfile("1gib")
+    with pytest.raises(ValueError, match="default, small"):
+        cockroach_profile("huge")
+
+
+def test_migrated_store_is_cached(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    monkeypatch.setenv("TEST_CRDB_STORE_CACHE", str(tmp_path / "cache"))
+    (tmp_path / "versions").mkdir()
+    (tmp_path / "versions" / "001.sql").write_text("CREATE TABLE users (id INT)")
+    runs = []
+
+    def migrate(details: CockroachDetails):
+        runs.append(details.dbname)
+        execute_sql(details, (tmp_path / "versions" / "001.sql").read_text())
+
+    migrations = CockroachMigrations(migrate=migrate, sources=[tmp_path / "versions"])
+
+    def start():
+        with CockroachManager(
+            worker_id="master",
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=unused_tcp_port_factory,
+            json_state_file_name="cockroach-migrated-test.json",
+            migrations=migrations,
+        ) as details:
+            assert details.dbname == "test_master"
+            return execute_sql(details, "SELECT count(*) FROM users")
+
+    assert start() == "count\n0\n"
+    assert start() == "count\n0\n"
+    assert runs == ["migrated"]
+
+    # A schema change builds a new store
+    key = migrations.key()
+    (tmp_path / "versions" / "002.sql").write_text("ALTER TABLE users ADD name STRING")
+    assert migrations.key() != key
+    start()
+    assert runs == ["migrated", "migrated"]
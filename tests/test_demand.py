@@ -0,0 +1,117 @@
+from managed_service_fixtures import demand, find_free_port
+from managed_service_fixtures.readiness import http_ready
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+def test_fixture_takes_over_prewarmed_service():
+    assert demand.prewarm(
+        ["managed_moto", "managed_redis_pool", "not_a_service"],
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+    ) == ["managed_moto"]
+    prewarmed = demand._prewarmed["managed_moto"]
+    unused = MotoServiceManager(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+    )
+    with demand.fixture_service("managed_moto", unused) as details:
+        assert http_ready(details.url)
+        assert prewarmed.manager.mirakuru_process.running()
+    assert unused.mirakuru_process is None
+    assert not prewarmed.manager.mirakuru_process.running()
+    assert demand.stop_unclaimed() == []
+
+
+TESTS = """
+import pytest
+
+def test_one(managed_moto):
+    assert managed_moto.port
+
+def test_two(managed_moto):
+    assert managed_moto.port
+
+@pytest.mark.skip
+def test_skipped(managed_moto):
+    pass
+
+def test_no_services():
+    pass
+"""
+
+
+def test_demand_summary(pytester):
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(TESTS)
+    result = pytester.runpytest_subprocess(
+        "-p", "no:cacheprovider", "--prewarm-services"
+    )
+    result.assert_outcomes(passed=3, skipped=1)
+    result.stdout.fnmatch_lines(
+        ["*managed service demand*", "master: managed_moto (2 tests)"]
+    )
+
+
+def test_deselected_services_are_not_prewarmed(pytester):
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(TESTS)
+    result = pytester.runpytest_subprocess(
+        "-p", "no:cacheprovider", "--prewarm-services", "-k", "no_services"
+    )
+    result.assert_outcomes(passed=1, deselected=3)
+    result.stdout.no_fnmatch_line("*managed service demand*")
+    result.stdout.no_fnmatch_line("*moto*")
+
+
+def test_services_with_overridden_configuration_are_not_prewarmed(pytester):
+    # Started without the seed, the prewarmed server would never be used
+    (pytester.path / "seed" / "images").mkdir(parents=True)
+    (pytester.path / "seed" / "images" / "cat.txt").write_text("meow")
+    pytester.makeconftest(
+        """
+        import pathlib
+        import pytest
+
+        pytest_plugins = "managed_service_fixtures"
+
+        @pytest.fixture(scope="session")
+        def managed_moto_seed():
+            return pathlib.Path(__file__).parent / "seed"
+        """
+    )
+    pytester.makepyfile(
+        """
+        def test_seeded(managed_moto):
+            assert managed_moto.buckets == {"images": ["cat.txt"]}
+        """
+    )
+    result = pytester.runpytest_subprocess(
+        "-p", "no:cacheprovider", "--prewarm-services"
+    )
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["master: managed_moto (1 test)"])
+    result.stdout.no_fnmatch_line("*prewarmed, unused*")
+
+
+def test_demand_per_xdist_worker(pytester):
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(TESTS)
+    result = pytester.runpytest_subprocess(
+        "-p", "no:cacheprovider", "--prewarm-services", "-n", "2"
+    )
+    result.assert_outcomes(passed=3, skipped=1)
+    result.stdout.fnmatch_lines(["*managed service demand*", "gw*: managed_moto*"])
+
+
+def test_uses_service_output():
+    # managed_cockroach_fresh needs managed_cockroach, both in the fixture closure
+    closure = ["managed_cockroach_fresh", "managed_cockroach", "tmp_path"]
+    assert demand.uses_service_output(closure, "cockroachdb")
+    assert demand.uses_service_output(closure, "cockroachdb-migrated")
+    assert not demand.uses_service_output(closure, "moto")
+    assert demand.uses_service_output(["managed_redis_pool"], "redis")
+    assert not demand.uses_service_output(["tmp_path"], "redis")
+    # Factories start services of any name
+    assert demand.uses_service_output(["managed_asgi_app_factory"], "app-0")
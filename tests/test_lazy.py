@@ -0,0 +1,70 @@
+import pytest
+
+from managed_service_fixtures import LazyService, MotoDetails, find_free_port
+from managed_service_fixtures.readiness import http_ready
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+def moto_manager() -> MotoServiceManager:
+    return MotoServiceManager(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+    )
+
+
+def test_untouched_service_never_starts():
+    manager = moto_manager()
+    with LazyService(manager) as details:
+        assert not details.started
+        assert "not started" in repr(details)
+    assert manager.mirakuru_process is None
+
+
+def test_inspecting_details_doesnt_start_service():
+    manager = moto_manager()
+    with LazyService(manager) as details:
+        assert isinstance(details, MotoDetails)
+        assert not details.is_manager
+        assert details.sessions == []
+        assert not details.started
+    assert manager.mirakuru_process is None
+
+
+def test_hashable_like_the_details():
+    with LazyService(moto_manager()) as details:
+        # Neither are MotoDetails, as a dataclass with eq but not frozen
+        with pytest.raises(TypeError, match="unhashable"):
+            hash(details)
+        assert details.is_manager
+
+
+def test_first_access_starts_service():
+    manager = moto_manager()
+    with LazyService(manager) as details:
+        assert http_ready(details.url)
+        assert details.started
+        assert isinstance(details, MotoDetails)
+        process = manager.mirakuru_process
+        assert process.running()
+    assert not process.running()
+
+
+def test_lazy_fixtures_skip_startup(pytester, monkeypatch):
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_LAZY", "1")
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(
+        """
+        import pytest
+
+        def test_skipped(managed_moto):
+            pytest.skip("never connects")
+
+        def test_not_started(managed_moto):
+            assert not managed_moto.started
+        """
+    )
+    result = pytester.runpytest_subprocess("-p", "no:cacheprovider")
+    result.assert_outcomes(passed=1, skipped=1)
+    # Nothing was started, so no timings were recorded
+    result.stdout.no_fnmatch_line("*managed service timings*")
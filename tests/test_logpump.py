@@ -0,0 +1,78 @@
+import logging
+import subprocess
+import sys
+import time
+
+from managed_service_fixtures.logpump import LogPump
+
+
+def wait_for_lines(pump: LogPump, name: str, count: int) -> list:
+    deadline = time.monotonic() + 5
+    while len(pump.tail(name)) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pump.tail(name)
+
+
+def test_lines_from_several_processes_are_kept_per_service(caplog):
+    caplog.set_level(logging.INFO, logger="managed_service_fixtures.output")
+    pump = LogPump(buffer_lines=3)
+    procs = {}
+    for name in ("alpha", "beta"):
+        # Partial writes must be joined back into whole lines
+        code = (
+            "import sys\n"
+            f"for i in range(5): sys.stdout.write('{name} ' + str(i)); "
+            "sys.stdout.flush(); sys.stdout.write('\\n')\n"
+        )
+        procs[name] = subprocess.Popen(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        pump.attach(name, procs[name].stdout)
+
+    for name, proc in procs.items():
+        proc.wait()
+        # The pump read a dup of the pipe, closing ours doesn't stop it
+        proc.stdout.close()
+        # Bounded ring buffer, only the last lines are kept
+        assert wait_for_lines(pump, name, 3) == [f"{name} 2", f"{name} 3", f"{name} 4"]
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert "[alpha] alpha 0" in messages
+    assert "[beta] beta 4" in messages
+    assert {
+        r.name for r in caplog.records if r.name.startswith("managed_service_fixtures")
+    } == {
+        "managed_service_fixtures.output.alpha",
+        "managed_service_fixtures.output.beta",
+    }
+
+
+def test_colorized_tags():
+    pump = LogPump(colorize=True)
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "print('hello')"], stdout=subprocess.PIPE
+    )
+    pump.attach("svc", proc.stdout)
+    proc.wait()
+    assert wait_for_lines(pump, "svc", 1) == ["hello"]
+    assert pump.colors["svc"].startswith("\x1b[")
+
+
+def test_service_output_attached_to_failure_report(pytester):
+    pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+    pytester.makepyfile(
+        """
+        def test_fails(managed_moto):
+            assert False
+
+        def test_unrelated_failure():
+            assert False
+        """
+    )
+    result = pytester.runpytest_subprocess("-p", "no:cacheprovider")
+    result.assert_outcomes(failed=2)
+    result.stdout.fnmatch_lines(["*Managed service output: moto*"])
+    # Only the test using moto gets its output
+    assert result.stdout.str().count("Managed service output") == 1
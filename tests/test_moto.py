@@ -0,0 +1,164 @@
+import json
+from typing import Callable
+
+import boto3
+import pytest
+
+from managed_service_fixtures.services.moto import (
+    WORKER_REGIONS,
+    MotoServiceManager,
+    s3_seed_plan,
+    worker_bucket_prefix,
+    worker_region,
+)
+
+
+@pytest.fixture
+def seed_dir(tmp_path):
+    (tmp_path / "seed" / "images" / "cats").mkdir(parents=True)
+    (tmp_path / "seed" / "images" / "cats" / "tom.png").write_bytes(b"meow")
+    (tmp_path / "seed" / "reports").mkdir()
+    # Big enough to be uploaded in parts
+    (tmp_path / "seed" / "reports" / "big.bin").write_bytes(b"x" * (9 * 1024 * 1024))
+    return tmp_path / "seed"
+
+
+def test_seed_plan(seed_dir):
+    assert s3_seed_plan(seed_dir) == {
+        "images": {"cats/tom.png": str(seed_dir / "images" / "cats" / "tom.png")},
+        "reports": {"big.bin": str(seed_dir / "reports" / "big.bin")},
+    }
+    manifest = seed_dir.parent / "manifest.json"
+    manifest.write_text(
+        json.dumps(
+            {"pets": "seed/images", "docs": {"a/big.bin": "seed/reports/big.bin"}}
+        )
+    )
+    assert s3_seed_plan(manifest) == {
+        "pets": {"cats/tom.png": str(seed_dir / "images" / "cats" / "tom.png")},
+        "docs": {"a/big.bin": str(seed_dir / "reports" / "big.bin")},
+    }
+
+
+def test_seeded_moto(
+    seed_dir,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    with MotoServiceManager(
+        worker_id="master",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        seed=seed_dir,
+    ) as moto_details:
+        assert moto_details.buckets == {
+            "images": ["cats/tom.png"],
+            "reports": ["big.bin"],
+        }
+        client = boto3.client(
+            "s3",
+            endpoint_url=moto_details.url,
+            region_name="us-east-1",
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+        tom = client.get_object(Bucket="images", Key="cats/tom.png")
+        assert tom["Body"].read() == b"meow"
+        big = client.head_object(Bucket="reports", Key="big.bin")
+        assert big["ContentLength"] == 9 * 1024 * 1024
+        # Multipart uploads get an ETag with the number of parts
+        assert big["ETag"].endswith('-2"')
+
+
+def test_worker_regions_and_bucket_prefixes():
+    assert worker_region("master") == "us-east-1"
+    assert worker_region("gw0") != worker_region("gw1")
+    last = f"gw{len(WORKER_REGIONS) - 1}"
+    assert len({worker_region(f"gw{i}") for i in range(len(WORKER_REGIONS))}) == len(
+        WORKER_REGIONS
+    )
+    assert worker_region(last) == WORKER_REGIONS[-1]
+    # Never wraps around to a region another worker has
+    with pytest.raises(ValueError, match="would share one with gw0"):
+        worker_region(f"gw{len(WORKER_REGIONS)}")
+    assert worker_bucket_prefix("master") == ""
+    assert worker_bucket_prefix("gw3") == "gw3-"
+
+
+def test_multi_service_moto(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    with MotoServiceManager(
+        worker_id="gw1",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        json_state_file_name="moto-multi.json",
+    ) as moto_details:
+        assert moto_details.region == worker_region("gw1")
+
+        # One server for every service
+        sqs = boto3.client("sqs", **moto_details.boto3_kwargs)
+        queue_url = sqs.create_queue(QueueName="jobs")["QueueUrl"]
+        sqs.send_message(QueueUrl=queue_url, MessageBody="hello")
+        messages = sqs.receive_message(QueueUrl=queue_url)["Messages"]
+        assert messages[0]["Body"] == "hello"
+
+        dynamodb = boto3.client("dynamodb", **moto_details.boto3_kwargs)
+        dynamodb.create_table(
+            TableName="users",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        assert dynamodb.list_tables()["TableNames"] == ["users"]
+
+        # Other workers' regions don't see this worker's resources
+        other = {**moto_details.boto3_kwargs, "region_name": worker_region("gw2")}
+        assert boto3.client("dynamodb", **other).list_tables()["TableNames"] == []
+
+
+def test_single_service_moto(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    manager = MotoServiceManager(
+        worker_id="gw1",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        json_state_file_name="moto-s3.json",
+        services=["s3"],
+    )
+    with manager as moto_details:
+        assert moto_details.services == ["s3"]
+        assert manager.mirakuru_process.command.endswith(" s3")
+        s3 = boto3.client("s3", **moto_details.s3_kwargs)
+        assert s3.list_buckets()["Buckets"] == []
+
+
+def test_workers_buckets_are_apart(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    def manager(worker_id: str) -> MotoServiceManager:
+        return MotoServiceManager(
+            worker_id=worker_id,
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=unused_tcp_port_factory,
+            json_state_file_name="moto-buckets.json",
+        )
+
+    with manager("gw0") as gw0, manager("gw1") as gw1:
+        assert gw0.is_manager and not gw1.is_manager
+        assert gw0.region != gw1.region
+        for details, body in ((gw0, b"from gw0"), (gw1, b"from gw1")):
+            # A plain create_bucket, from a worker outside us-east-1
+            s3 = boto3.client("s3", **details.s3_kwargs)
+            s3.create_bucket(Bucket=details.bucket("uploads"))
+            s3.put_object(Bucket=details.bucket("uploads"), Key="report", Body=body)
+
+        for details, body in ((gw0, b"from gw0"), (gw1, b"from gw1")):
+            s3 = boto3.client("s3", **details.s3_kwargs)
+            report = s3.get_object(Bucket=details.bucket("uploads"), Key="report")
+            assert report["Body"].read() == body
+        assert gw0.bucket("uploads") != gw1.bucket("uploads")
@@ -0,0 +1,32 @@
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures import ServicePool
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+def test_pool_restarts_services_without_reset(
+    worker_id: str,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    manager = MotoServiceManager(
+        worker_id=worker_id,
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+    )
+    pool = ServicePool(manager, size=1)
+    try:
+        first = pool.checkout()
+        assert httpx.get(first.url).status_code == 200
+        pool.checkin(first)
+
+        # Moto has no cheap reset, so the pool hands out a restarted instance
+        second = pool.checkout()
+        assert second.port != first.port
+        assert httpx.get(second.url).status_code == 200
+        pool.checkin(second)
+    finally:
+        pool.close()
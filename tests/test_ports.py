@@ -0,0 +1,97 @@
+import concurrent.futures
+import errno
+import itertools
+import json
+import random
+import socket
+import subprocess
+import time
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures.ports import (
+    PortReservations,
+    is_port_conflict,
+    reserve_port,
+    reserving,
+)
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+def test_reserved_ports_are_skipped(tmp_path):
+    reservations = PortReservations(tmp_path / "reservations.json")
+    candidates = itertools.cycle([20001, 20002, 20003])
+    assert reservations.reserve(lambda: next(candidates)) == 20001
+    # Another process using the same candidates doesn't get the same port
+    other = PortReservations(tmp_path / "reservations.json")
+    assert other.reserve(lambda: next(candidates)) == 20002
+    with pytest.raises(RuntimeError, match="No unreserved port"):
+        other.reserve(lambda: 20001, attempts=3)
+
+
+def test_reservations_expire(tmp_path):
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    path = tmp_path / "reservations.json"
+    path.write_text(
+        json.dumps(
+            {
+                "20001": {"pid": dead.pid, "expires": time.time() + 60},
+                "20002": {"pid": 1, "expires": time.time() - 1},
+            }
+        )
+    )
+    candidates = itertools.cycle([20001, 20002])
+    reservations = PortReservations(path)
+    assert reservations.reserve(lambda: next(candidates)) == 20001
+    assert reservations.reserve(lambda: next(candidates)) == 20002
+
+
+def test_concurrent_reservations_are_unique(tmp_path):
+    def reserve(_):
+        # Separate instances, as if they were separate processes
+        return PortReservations(tmp_path / "reservations.json").reserve(
+            lambda: random.randint(20000, 20099)
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        ports = list(executor.map(reserve, range(64)))
+    assert len(set(ports)) == 64
+
+
+def test_reserving_wraps_factories_once():
+    assert reserving(reserve_port) is reserve_port
+    factory = reserving(lambda: 20001)
+    assert reserving(factory) is factory
+
+
+def test_is_port_conflict():
+    assert is_port_conflict(OSError(errno.EADDRINUSE, "Address already in use"))
+    assert not is_port_conflict(OSError(errno.ECONNREFUSED, "Connection refused"))
+    assert not is_port_conflict(RuntimeError("something else"))
+
+
+def test_start_retries_on_taken_port(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    # Somebody else binds the first port the manager is given before moto starts
+    squatter = socket.socket()
+    squatter.bind(("localhost", 0))
+    squatter.listen()
+    taken = squatter.getsockname()[1]
+    ports = itertools.chain([taken], iter(unused_tcp_port_factory, None))
+
+    try:
+        with MotoServiceManager(
+            worker_id="master",
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=lambda: next(ports),
+            json_state_file_name="moto-ports.json",
+        ) as moto_details:
+            assert moto_details.port != taken
+            assert httpx.get(moto_details.url).status_code == 200
+    finally:
+        squatter.close()
@@ -0,0 +1,53 @@
+import mirakuru
+import pytest
+
+from managed_service_fixtures import find_free_port
+from managed_service_fixtures.base_manager import (
+    ExternalServiceLifecycleManager,
+    ServiceDetails,
+)
+from managed_service_fixtures.readiness import http_ready, wait_until_ready
+
+
+def test_wait_until_ready_retries_until_check_passes():
+    attempts = []
+
+    def check():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise ConnectionError("not yet")
+        return True
+
+    wait_until_ready(check, timeout=5)
+    assert len(attempts) == 3
+
+
+def test_wait_until_ready_times_out():
+    with pytest.raises(TimeoutError, match="never-ready"):
+        wait_until_ready(lambda: False, timeout=0.1, description="never-ready")
+
+
+def test_http_ready_refused():
+    assert not http_ready("http://localhost:1")
+
+
+class InterruptedManager(ExternalServiceLifecycleManager):
+    json_state_file_name = "interrupted.json"
+
+    def _start_service(self):
+        self.process = mirakuru.SimpleExecutor("sleep 60").start()
+        return ServiceDetails(), self.process
+
+    def _check_ready(self, service_details: ServiceDetails) -> bool:
+        raise KeyboardInterrupt
+
+
+def test_interrupted_readiness_stops_service():
+    manager = InterruptedManager(
+        worker_id="master",
+        tmp_path_factory=None,
+        unused_tcp_port_factory=find_free_port,
+    )
+    with pytest.raises(KeyboardInterrupt):
+        manager._start_ready_service()
+    assert not manager.process.running()
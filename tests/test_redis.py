@@ -1,7 +1,11 @@
+import json
+from typing import Callable
+
 import pytest
 import redis.asyncio as aioredis
 
 from managed_service_fixtures import RedisDetails
+from managed_service_fixtures.services.redis import RedisServiceManager
 
 
 @pytest.fixture
@@ -13,8 +17,50 @@ async def redis_client(managed_redis: RedisDetails) -> aioredis.Redis:
     await redis.close()
 
 
+async def test_redis_worker_db(managed_redis: RedisDetails, worker_id: str):
+    expected_db = int(worker_id[2:]) if worker_id.startswith("gw") else 0
+    assert managed_redis.db == expected_db
+    assert managed_redis.url.endswith(f"/{expected_db}")
+
+
+def test_env_server_keeps_its_db(
+    tmp_path,
+    monkeypatch,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    # Its `databases` setting isn't ours, gw16 and up may be out of range
+    details_file = tmp_path / "redis.json"
+    details_file.write_text(json.dumps({"hostname": "redis.example", "db": 3}))
+    monkeypatch.setenv("TEST_REDIS_DETAILS", str(details_file))
+    with RedisServiceManager(
+        worker_id="gw16",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        json_state_file_name="redis-env.json",
+    ) as details:
+        assert details.db == 3
+        assert details.url == "redis://redis.example:6379/3"
+
+
+async def test_redis_flushed(managed_redis_flushed: RedisDetails):
+    redis = await aioredis.from_url(managed_redis_flushed.url)
+    assert await redis.dbsize() == 0
+    await redis.close()
+
+
 async def test_redis(redis_client: aioredis.Redis):
     await redis_client.set("foo", "bar")
 
     value = await redis_client.get("foo")
     assert value == b"bar"
+
+
+@pytest.mark.parametrize("value", ["first", "second"])
+async def test_redis_fresh(managed_redis_fresh: RedisDetails, value: str):
+    # Each test gets a server no other test is using, flushed after previous use
+    redis = await aioredis.from_url(managed_redis_fresh.url)
+    assert await redis.dbsize() == 0
+    await redis.set("foo", value)
+    assert await redis.get("foo") == value.encode()
+    await redis.close()
@@ -0,0 +1,251 @@
+import concurrent.futures
+import contextlib
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures.base_manager import ExternalServiceLifecycleManager
+from managed_service_fixtures.registry import (
+    OWNER_DIR_ENV,
+    REGISTRIES,
+    OwnerRecord,
+    is_stale,
+    owner_entry,
+    process_start_time,
+    reap_orphans,
+    registry_class,
+)
+from managed_service_fixtures.services.moto import MotoServiceManager
+from managed_service_fixtures.warm import pid_alive
+
+
+@pytest.fixture(params=sorted(REGISTRIES))
+def registry(request, tmp_path):
+    return REGISTRIES[request.param](tmp_path / "service.json")
+
+
+def test_register_refcounts(registry):
+    assert registry.register("gw1") is None
+
+    with registry.lock:
+        registry.publish({"hostname": "localhost", "port": 1234, "sessions": []})
+
+    state = registry.register("gw1")
+    assert state == {"hostname": "localhost", "port": 1234, "sessions": ["gw1"]}
+    # Two references from the same worker, e.g. two fixtures of the same service
+    assert sorted(registry.register("gw1")["sessions"]) == ["gw1", "gw1"]
+    assert sorted(registry.register("gw2")["sessions"]) == ["gw1", "gw1", "gw2"]
+
+    registry.unregister("gw1")
+    registry.unregister("gw2")
+    assert not registry.retire()
+    registry.unregister("gw1")
+    assert registry.retire()
+
+    # Retired services are unpublished, the next worker becomes the manager
+    assert registry.register("gw1") is None
+
+
+def test_concurrent_register(registry):
+    with registry.lock:
+        registry.publish({"hostname": "localhost", "port": 1234, "sessions": []})
+
+    def join(i):
+        # A registry per worker, as if they were separate processes
+        type(registry)(registry.state_file_path).register(f"gw{i}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(join, range(32)))
+
+    assert len(registry.register("gw0")["sessions"]) == 33
+
+
+def dead_pid() -> int:
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    return dead.pid
+
+
+def test_evict(registry):
+    owner = {**owner_entry([]), "pid": dead_pid()}
+    with registry.lock:
+        registry.publish({"port": 1234, "sessions": [], "owner": owner})
+    assert is_stale(registry.register("gw1"))
+
+    with registry.lock:
+        registry.evict()
+    assert registry.register("gw1") is None
+    # Workers still holding a reference to the evicted service can let go of it
+    registry.unregister("gw1")
+
+
+def test_dead_owner_is_stale():
+    owner = owner_entry([])
+    assert owner["started"] is not None
+    assert not is_stale({"owner": owner})
+    assert is_stale({"owner": {**owner, "pid": dead_pid()}})
+    # Its pid now belongs to a process that started later
+    assert is_stale({"owner": {**owner, "started": "0"}})
+    # Connection details from the environment have no owner to go stale
+    assert not is_stale({"port": 1234})
+
+
+def test_take_over_from_dead_manager(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    manager = MotoServiceManager(
+        worker_id="gw1",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        json_state_file_name="moto-takeover.json",
+    )
+    # What a manager that was SIGKILLed leaves behind: published state and its service
+    orphan = subprocess.Popen(["sleep", "60"], start_new_session=True)
+    owner = {"pid": dead_pid(), "started": None, "pgids": [orphan.pid]}
+    with manager.registry.lock:
+        manager.registry.publish(
+            {"hostname": "localhost", "port": 1, "sessions": [], "owner": owner}
+        )
+
+    start = time.monotonic()
+    with manager as moto_details:
+        assert time.monotonic() - start < 30
+        assert moto_details.is_manager
+        assert httpx.get(moto_details.url).status_code == 200
+        assert orphan.wait(timeout=5) == -9
+        state = manager.registry.register("gw2")
+        assert not is_stale(state)
+        assert state["owner"]["pgids"] == [manager.mirakuru_process.process.pid]
+        manager.registry.unregister("gw2")
+    assert not pid_alive(orphan.pid)
+
+
+def group_alive(pgid: int) -> bool:
+    """True if a process group has members that aren't zombies"""
+    output = subprocess.run(
+        ["ps", "-A", "-o", "pgid=,stat="], check=True, capture_output=True, text=True
+    ).stdout
+    return any(
+        int(group) == pgid and not stat.startswith("Z")
+        for group, stat in (line.split() for line in output.splitlines())
+    )
+
+
+def test_reap_orphans(tmp_path, monkeypatch):
+    monkeypatch.setenv(OWNER_DIR_ENV, str(tmp_path))
+    orphan = subprocess.Popen(["sleep", "60"], start_new_session=True)
+    alive = subprocess.Popen(["sleep", "60"], start_new_session=True)
+    # The owner of a concurrent run, stopped (Ctrl-Z, suspended laptop) for a long time
+    paused = subprocess.Popen(["sleep", "60"])
+    paused.send_signal(signal.SIGSTOP)
+    try:
+        owner = {"pid": paused.pid, "started": process_start_time(paused.pid)}
+        OwnerRecord(
+            "orphaned", {**owner_entry([orphan.pid]), "pid": dead_pid()}
+        ).write()
+        record = OwnerRecord("alive", {**owner, "pgids": [alive.pid]})
+        record.write()
+
+        assert reap_orphans() == [orphan.pid]
+        assert orphan.wait(timeout=5) == -9
+        assert alive.poll() is None
+        assert [p.name for p in tmp_path.glob("*.json")] == [record.path.name]
+
+        # Reaped once its pid is re-used by another process
+        record.owner["started"] = "0"
+        record.write()
+        assert reap_orphans() == [alive.pid]
+        assert alive.wait(timeout=5) == -9
+        assert not list(tmp_path.glob("*.json"))
+    finally:
+        orphan.kill()
+        alive.kill()
+        paused.kill()
+
+
+def test_killed_session_is_reaped_by_next_session(pytester, monkeypatch):
+    monkeypatch.setenv(OWNER_DIR_ENV, str(pytester.path / "owners"))
+    # A serial run holding moto that gets SIGKILLed
+    script = textwrap.dedent(
+        """
+        import os, time
+        from managed_service_fixtures import find_free_port
+        from managed_service_fixtures.services.moto import MotoServiceManager
+
+        manager = MotoServiceManager(
+            worker_id="master", tmp_path_factory=None, unused_tcp_port_factory=find_free_port
+        )
+        with manager:
+            print(os.getpgid(manager.mirakuru_process.process.pid), flush=True)
+            time.sleep(600)
+        """
+    )
+    owner = subprocess.Popen(
+        [sys.executable, "-c", script], stdout=subprocess.PIPE, text=True
+    )
+    pgid = int(owner.stdout.readline())
+    owner.kill()
+    owner.wait()
+    try:
+        assert group_alive(pgid)
+
+        # An unrelated pytest session reaps it before running anything
+        pytester.makeconftest('pytest_plugins = "managed_service_fixtures"')
+        pytester.makepyfile("def test_nothing():\n    pass\n")
+        result = pytester.runpytest_subprocess("-p", "no:cacheprovider")
+        result.assert_outcomes(passed=1)
+        deadline = time.monotonic() + 5
+        while group_alive(pgid) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert not group_alive(pgid)
+        assert not list((pytester.path / "owners").glob("*.json"))
+    finally:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(pgid, 9)
+
+
+class UnstartableManager(ExternalServiceLifecycleManager):
+    json_state_file_name = "unstartable.json"
+
+    def _start_service(self):
+        raise AssertionError("Only ever joins a published service")
+
+
+def test_last_worker_reaps_service_of_dead_manager(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    manager = UnstartableManager(
+        worker_id="gw1",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+    )
+    orphan = subprocess.Popen(["sleep", "60"], start_new_session=True)
+    with manager.registry.lock:
+        manager.registry.publish({"sessions": [], "owner": owner_entry([orphan.pid])})
+
+    # Joins while the manager is alive, and leaves after it died
+    with manager as details:
+        assert not details.is_manager
+        with manager.registry.lock:
+            state = manager.registry.state()
+            state["owner"]["pid"] = dead_pid()
+            manager.registry.publish(state)
+    assert orphan.wait(timeout=5) == -9
+    assert manager.registry.state() is None
+
+
+def test_registry_from_env(monkeypatch):
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_REGISTRY", "sqlite")
+    assert registry_class() is REGISTRIES["sqlite"]
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_REGISTRY", "nope")
+    with pytest.raises(ValueError, match="json, sqlite"):
+        registry_class()
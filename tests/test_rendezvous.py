@@ -0,0 +1,23 @@
+import threading
+import time
+
+from managed_service_fixtures.rendezvous import TeardownRendezvous
+
+
+def test_notify_wakes_waiting_manager(tmp_path):
+    state_file_path = tmp_path / "service.json"
+    rendezvous = TeardownRendezvous(state_file_path)
+    assert rendezvous.listen()
+    try:
+        timer = threading.Timer(0.1, TeardownRendezvous.notify, args=(state_file_path,))
+        timer.start()
+        start = time.monotonic()
+        rendezvous.wait()
+        assert time.monotonic() - start < rendezvous.fallback_timeout
+    finally:
+        rendezvous.close()
+    assert not rendezvous.socket_path.exists()
+
+
+def test_notify_without_listener_is_harmless(tmp_path):
+    TeardownRendezvous.notify(tmp_path / "nobody-listening.json")
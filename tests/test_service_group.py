@@ -0,0 +1,49 @@
+import contextlib
+import functools
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures import AppDetails, MotoDetails, ServiceGroup
+from managed_service_fixtures.services.asgi_app import AppManager
+from managed_service_fixtures.services.moto import MotoServiceManager
+
+
+@pytest.fixture(scope="session")
+def grouped_services(managed_service_group: Callable[..., ServiceGroup]):
+    app = functools.partial(AppManager, "tests.test_asgi_app:app")
+    with managed_service_group(MotoServiceManager, app) as (moto_details, app_details):
+        yield moto_details, app_details
+
+
+async def test_service_group(grouped_services):
+    moto_details, app_details = grouped_services
+    assert isinstance(moto_details, MotoDetails)
+    assert isinstance(app_details, AppDetails)
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(app_details.url)
+        assert resp.json() == {"Hello": "World"}
+        resp = await client.get(moto_details.url)
+        assert resp.status_code == 200
+
+
+def test_service_group_exits_started_contexts_on_failure():
+    exited = []
+
+    @contextlib.contextmanager
+    def ok():
+        try:
+            yield "ok"
+        finally:
+            exited.append("ok")
+
+    @contextlib.contextmanager
+    def broken():
+        raise RuntimeError("boom")
+        yield
+
+    with pytest.raises(RuntimeError, match="boom"):
+        with ServiceGroup(ok(), broken()):
+            pass
+    assert exited == ["ok"]
@@ -0,0 +1,16 @@
+from managed_service_fixtures import timings
+
+
+def test_format_table():
+    lifecycle = timings.LifecycleTimings(
+        service="redis", worker_id="gw0", role="manager"
+    )
+    with lifecycle.phase("start"):
+        pass
+    lifecycle.phases["stop"] = 0.25
+    header, row = timings.format_table([{**lifecycle.__dict__}])
+    assert header.split() == ["service", "worker", "role", *timings.PHASES, "total"]
+    cells = row.split()
+    assert cells[:3] == ["redis", "gw0", "manager"]
+    assert cells[3] == "-"  # no lock phase
+    assert cells[-2] == "0.250"
@@ -1,6 +1,16 @@
+import http.client
+import http.server
+import json
+import sys
+import threading
+from typing import Callable
+
 import hvac
+import pytest
+import yaml
 
 from managed_service_fixtures import VaultDetails
+from managed_service_fixtures.services.vault import VaultManager, VaultSeeder, load_seed
 
 
 async def test_vault(managed_vault: VaultDetails):
@@ -20,3 +30,87 @@ async def test_vault(managed_vault: VaultDetails):
 
     read_result = client.secrets.kv.v2.read_secret_version(path="test-mount-path")
     assert read_result["data"]["data"]["foo"] == "bar"
+
+
+SEED = {
+    "mounts": {"kv1": {"type": "kv"}},
+    "auth": {"approle": {"type": "approle"}},
+    "policies": {"reader": 'path "secret/*" { capabilities = ["read"] }'},
+    "secrets": {f"secret/app/{i}": {"value": str(i)} for i in range(50)},
+    "writes": {"auth/approle/role/app": {"token_policies": ["reader"]}},
+}
+
+
+def test_load_seed(tmp_path):
+    (tmp_path / "seed.json").write_text(json.dumps(SEED))
+    assert load_seed(tmp_path / "seed.json") == SEED
+    (tmp_path / "seed.yaml").write_text(yaml.safe_dump(SEED))
+    assert load_seed(str(tmp_path / "seed.yaml")) == SEED
+    assert load_seed(SEED) is SEED
+
+
+def test_load_yaml_seed_without_pyyaml(tmp_path, monkeypatch):
+    (tmp_path / "seed.yaml").write_text(yaml.safe_dump(SEED))
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    with pytest.raises(ImportError, match="pip install pyyaml"):
+        load_seed(tmp_path / "seed.yaml")
+
+
+class RecordingSeeder(VaultSeeder):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = set()
+
+    def _connection(self, fresh: bool = False) -> http.client.HTTPConnection:
+        conn = super()._connection(fresh)
+        self.opened.add(conn)
+        return conn
+
+
+def test_failed_seed_closes_its_connections():
+    class Failing(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("localhost", 0), Failing)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        seeder = RecordingSeeder(
+            VaultDetails(port=server.server_address[1], token="root"), concurrency=4
+        )
+        with pytest.raises(RuntimeError, match="failed with 500"):
+            seeder.apply({"mounts": {f"kv{i}": {"type": "kv"} for i in range(8)}})
+        assert seeder.opened
+        assert all(conn.sock is None for conn in seeder.opened)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_seeded_vault(
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    with VaultManager(
+        worker_id="master",
+        tmp_path_factory=tmp_path_factory,
+        unused_tcp_port_factory=unused_tcp_port_factory,
+        seed=SEED,
+    ) as details:
+        client = hvac.Client(url=details.url, token=details.token)
+        assert "kv1/" in client.sys.list_mounted_secrets_engines()["data"]
+        assert "approle/" in client.sys.list_auth_methods()["data"]
+        assert "reader" in client.sys.list_acl_policies()["data"]["keys"]
+        secret = client.secrets.kv.v2.read_secret_version(path="app/49")
+        assert secret["data"]["data"] == {"value": "49"}
+        assert client.read("auth/approle/role/app")["data"]["token_policies"] == [
+            "reader"
+        ]
@@ -0,0 +1,53 @@
+import json
+import pathlib
+import time
+from typing import Callable
+
+import httpx
+import pytest
+
+from managed_service_fixtures.services.moto import MotoServiceManager
+from managed_service_fixtures.warm import pid_alive, stop_broker
+
+
+@pytest.fixture
+def keep_warm(tmp_path, monkeypatch):
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_KEEP_WARM", "1")
+    monkeypatch.setenv("MANAGED_SERVICE_FIXTURES_WARM_DIR", str(tmp_path / "warm"))
+    yield tmp_path / "warm"
+    for record_path in (tmp_path / "warm").glob("*.json"):
+        stop_broker(json.loads(record_path.read_text()))
+
+
+def test_kept_warm_service_is_reused(
+    keep_warm,
+    tmp_path_factory: pytest.TempPathFactory,
+    unused_tcp_port_factory: Callable[[], int],
+):
+    def run_session():
+        with MotoServiceManager(
+            worker_id="master",
+            tmp_path_factory=tmp_path_factory,
+            unused_tcp_port_factory=unused_tcp_port_factory,
+        ) as moto_details:
+            assert httpx.get(moto_details.url).status_code == 200
+            return moto_details
+
+    first = run_session()
+    start = time.monotonic()
+    second = run_session()
+    assert time.monotonic() - start < 1
+    assert first.port == second.port
+
+    (record_path,) = keep_warm.glob("*.json")
+    record = json.loads(record_path.read_text())
+    assert record["leases"] == []
+    assert pid_alive(record["broker_pid"])
+    # Its kwargs were handed over in a file, not on the command line, and cleaned up
+    cmdline = pathlib.Path(f"/proc/{record['broker_pid']}/cmdline").read_bytes()
+    assert b"--kwargs-file" in cmdline
+    assert b'"services"' not in cmdline
+    assert not list(keep_warm.glob("*.kwargs"))
+    # Nor kept in the record, which only its owner can read
+    assert "kwargs" not in record
+    assert record_path.stat().st_mode & 0o777 == 0o600